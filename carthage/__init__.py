@@ -10,6 +10,9 @@ import asyncio
 import atexit
 import sys
 
+from .profiling import startup_profile as _startup_profile
+_import_phase = _startup_profile.begin('import', 'carthage')
+
 import carthage.config
 import carthage.config.types
 import carthage.dependency_injection
@@ -55,10 +58,10 @@ __all__ += ['Network', 'NetworkConfig', 'MacStore', 'V4Config', 'V4Pool']
 from .machine import ssh_jump_host, Machine, AbstractMachineModel, MachineCustomization, ContainerCustomization, FilesystemCustomization, customization_task, BareMetalMachine
 import carthage.ssh  # ssh import must come after machine
 from .ssh import RsyncPath
-import carthage.pki
 from . import ansible
 from . import cloud_init
-from .files import rsync_git_tree, git_tree_hash
+# libvirt defines configuration schema, so it is imported even though most of it is used lazily.
+import carthage.libvirt
 
 
 __all__ += ['ssh_jump_host', 'Machine', 'rsync_git_tree',
@@ -69,33 +72,55 @@ __all__ += ['ssh_jump_host', 'Machine', 'rsync_git_tree',
             'customization_task',
             'BareMetalMachine']
 
-from . import image
-from .image import ContainerVolume, wrap_container_customization, SshAuthorizedKeyCustomizations
+# Subsystems that base_injector does not need are imported the first
+# time they (or a name from them) are accessed; see __getattr__.
+_lazy_modules = frozenset({
+    'container', 'debian', 'dns', 'files', 'image', 'local', 'pki',
+    'system_dependency', 'vm'})
+_lazy_attributes = {
+    'rsync_git_tree': 'files',
+    'git_tree_hash': 'files',
+    'ContainerVolume': 'image',
+    'wrap_container_customization': 'image',
+    'SshAuthorizedKeyCustomizations': 'image',
+    'MachineDependency': 'system_dependency',
+    'CommandDependency': 'system_dependency',
+    'SystemDependency': 'system_dependency',
+    'disable_system_dependency': 'system_dependency',
+    'LocalMachine': 'local',
+    'LocalMachineMixin': 'local',
+    'DebianContainerImage': 'debian',
+    'DnsZone': 'dns',
+    'PublicDnsManagement': 'dns',
+}
 
 __all__ += ['ContainerVolume', 'wrap_container_customization', 'SshAuthorizedKeyCustomizations']
 
-
-from .system_dependency import MachineDependency, CommandDependency, SystemDependency, disable_system_dependency
-
 __all__ += ['MachineDependency', 'SystemDependency', 'CommandDependency', 'disable_system_dependency']
 
-import carthage.container
-import carthage.local
-from .local import LocalMachine, LocalMachineMixin
 __all__ += ['LocalMachine', 'LocalMachineMixin']
 
-import carthage.pki
+__all__ += ['DebianContainerImage']
+
+__all__ += ['DnsZone', 'PublicDnsManagement']
 
-import carthage.vm
 
-import carthage.debian
-from .debian import DebianContainerImage
+def __getattr__(name):
+    import importlib
+    if name in _lazy_modules:
+        return importlib.import_module('.' + name, __name__)
+    try:
+        module = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
 
-__all__ += ['DebianContainerImage']
 
-from .dns import DnsZone, PublicDnsManagement
+def __dir__():
+    return sorted(set(globals()) | _lazy_modules | set(_lazy_attributes))
 
-__all__ += ['DnsZone', 'PublicDnsManagement']
 
 from .plugins import CarthagePlugin
 from . import plugins
@@ -108,7 +133,7 @@ carthage.config.inject_config(base_injector)
 carthage.config.types.ResourcePlugin.register(base_injector, 'resource')
 base_injector.add_provider(plugins.PluginMappings)
 base_injector.add_provider(deployment.MachineDeployableFinder)
-base_injector.add_provider(carthage.vm.LibvirtDeployableFinder, allow_multiple=True)
+base_injector.add_provider(carthage.libvirt.LibvirtDeployableFinder, allow_multiple=True)
 
 base_injector.add_provider(ssh.SshKey)
 base_injector.add_provider(ssh.AuthorizedKeysFile)
@@ -117,6 +142,7 @@ base_injector.add_provider(MacStore)
 base_injector.add_provider(ansible.AnsibleConfig)
 base_injector.add_provider(carthage.network.external_network)
 base_injector.add_provider(carthage.network.BridgeNetwork, allow_multiple=True)
+base_injector.add_provider(carthage.network.NamespacePool)
 
 base_injector.add_provider(InjectionKey(carthage.ssh.SshAgent), carthage.ssh.ssh_agent)
 base_injector(carthage.cloud_init.enable_cloud_init_plugins)
@@ -128,6 +154,7 @@ base_injector(plugins.load_plugin_from_package, sys.modules[__name__])
 # Things that need to import after base_injector is defined
 from . import deployment_commands
 base_injector(deployment_commands.register)
+_startup_profile.end(_import_phase)
 
 @atexit.register
 def __done():
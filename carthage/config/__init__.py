@@ -6,7 +6,7 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
 
-from .schema import ConfigSchema, config_key, ConfigAccessor
+from .schema import ConfigSchema, config_key, ConfigAccessor, ConfigSnapshot
 from .layout import ConfigLayout
 from .types import ConfigPath
 from . import base
@@ -17,4 +17,4 @@ def inject_config(injector):
     injector.replace_provider(ConfigLayout, allow_multiple=True)
 
 
-__all__ = ("config_key", "ConfigSchema", "ConfigLayout", "inject_config", 'ConfigAccessor')
+__all__ = ("config_key", "ConfigSchema", "ConfigLayout", "inject_config", 'ConfigAccessor', 'ConfigSnapshot')
@@ -49,7 +49,13 @@ class BaseSchema(ConfigSchema, prefix=""):
     delete_volumes: bool = False
     #: If true, pull git plugins (update them) as part of loading
     pull_plugins: bool = True
+    #: How many git plugins to fetch or update at once when loading a list of plugins
+    plugin_fetch_concurrency: int = 8
+    #: How many models ModelGroup.resolve_networking and ModelGroup.generate work on at once; 0 for no limit
+    model_concurrency: int = 32
     persist_local_networking: bool = False
+    #: Number of network namespaces and, per bridge, veth pairs to create ahead of need so containers start faster; 0 disables the pools.
+    network_pool_size: int = 0
 
     external_vlan_id: int = 0
     external_bridge_name: str = "brint"
@@ -8,12 +8,13 @@
 
 import importlib
 import logging
-import yaml
 from pathlib import Path
 from ..dependency_injection import inject, Injectable, InjectionKey, Injector, partial_with_dependencies
 import carthage
 
 from .schema import config_key, ConfigAccessor, ConfigSchema
+from ..profiling import startup_profile
+from ..utils import yaml_load_cached
 
 @inject(injector=Injector)
 class ConfigLayout(ConfigAccessor, Injectable):
@@ -83,6 +84,10 @@ class ConfigLayout(ConfigAccessor, Injectable):
         '''
         :param ignore_import_errors: If true, then loading a plugin will not fail simply because the plugin's python code  raises an error.  This is intended to allow introspection of plugin metadata to determine plugin dependencies; actually trying to use a plugin that has raised an error on load is unlikely to work.
         '''
+        with startup_profile.phase('config', path or getattr(y, 'name', '')):
+            return self._load_yaml(y, injector=injector, path=path, ignore_import_errors=ignore_import_errors)
+
+    def _load_yaml(self, y, *, injector, path, ignore_import_errors):
         from . import types as config_types
         if injector is None:
             injector = self._injector
@@ -90,7 +95,7 @@ class ConfigLayout(ConfigAccessor, Injectable):
             base_path = Path(path).parent
         else:
             base_path = Path(y.name).parent
-        d = yaml.safe_load(y)
+        d = yaml_load_cached(y)
         assert isinstance(d, dict)
         from .types import ConfigPath
         # The plugin loader needs checkout_dir, but we need to
@@ -116,9 +121,13 @@ class ConfigLayout(ConfigAccessor, Injectable):
                     mapping[k] = injector(config_types.ConfigPath, mapping[k])
                 plugin_mappings.add_mapping(mapping)
         if 'plugins' in d:
+            plugins = []
             for p in d['plugins']:
                 if (not ':' in p) and (p == '..' or p == '.' or '/' in p):
                     p = base_path.joinpath(p)
+                plugins.append(p)
+            prefetch_plugins(plugins)
+            for p in plugins:
                 enable_plugin(p, ignore_import_errors=ignore_import_errors)
             del d['plugins']
         if 'include' in d:
@@ -135,6 +144,15 @@ class ConfigLayout(ConfigAccessor, Injectable):
             # import that failed, so also ignore KeyError from _load.
 
 
+def prefetch_plugins(plugins):
+    '''
+    Fetch git hosted plugins in *plugins* concurrently ahead of :func:`enable_plugin`.
+    '''
+    from .. import base_injector
+    from ..plugins import prefetch_plugins
+    base_injector(prefetch_plugins, plugins)
+
+
 def enable_plugin(plugin, ignore_import_errors=False):
     '''
 Load and enable a Carthage plugin.
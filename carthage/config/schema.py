@@ -6,7 +6,9 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
 
+import contextvars
 import sys
+import weakref
 from ipaddress import IPv6Address, IPv4Address, IPv4Network, IPv6Network
 from pathlib import Path
 import types
@@ -25,6 +27,95 @@ class ConfigResolutionFailed(ValueError):
         super().__init__(f'Resolution of {k} with value `{val}` failed')
 
 
+class _DependencyTracker:
+
+    '''Records the config keys consulted while resolving a value, along with the provider each key had at the time.  A cached resolution remains valid as long as every recorded key still has the same provider.
+    '''
+
+    __slots__ = ('lookups', 'cacheable')
+
+    def __init__(self):
+        self.lookups = {}
+        self.cacheable = True
+
+
+#: The trackers for resolutions in progress, innermost last.  Config is read from executor threads and interleaved tasks, so each context keeps its own stack.
+_trackers: contextvars.ContextVar[tuple[_DependencyTracker, ...]] = contextvars.ContextVar('_trackers', default=())
+_resolution_cache = weakref.WeakKeyDictionary()
+_missing = object()
+
+
+def _current_provider(injector, key):
+    # Equivalent to injector._get_parent(key) without the cost of
+    # formatting a KeyError for keys left at their defaults.
+    while injector is not None:
+        provider = injector._providers.get(key)
+        if provider is not None:
+            return provider.provider
+        injector = injector.parent_injector
+    return None
+
+
+def _note_config_lookup(injector, key):
+    trackers = _trackers.get()
+    if trackers:
+        trackers[-1].lookups[(weakref.ref(injector), key)] = _current_provider(injector, key)
+
+
+def _note_uncacheable():
+    '''The value being resolved depends on something other than config keys (the environment or a lookup plugin), so it must not be cached.
+    '''
+    for tracker in _trackers.get():
+        tracker.cacheable = False
+
+
+def _lookups_current(lookups):
+    for (injector_ref, key), provider in lookups.items():
+        injector = injector_ref()
+        if injector is None or injector.closed:
+            return False
+        if _current_provider(injector, key) is not provider:
+            return False
+    return True
+
+
+def _cached_resolution(injector, cache_key, resolve, *, frozen=False):
+    '''Return ``resolve()``, reusing an earlier result for *cache_key* on *injector* if none of the config keys it consulted has changed since.
+
+    :param frozen: Cache the result even if it depends on something other than config keys.
+    '''
+    if injector.closed:
+        return resolve()
+    cache = _resolution_cache.setdefault(injector, {})
+    try:
+        value, lookups, generation = cache[cache_key]
+    except KeyError:
+        pass
+    else:
+        if generation == Injector.provider_generation or _lookups_current(lookups):
+            if generation != Injector.provider_generation:
+                cache[cache_key] = (value, lookups, Injector.provider_generation)
+            trackers = _trackers.get()
+            if trackers:
+                trackers[-1].lookups.update(lookups)
+            return value
+    generation = Injector.provider_generation
+    tracker = _DependencyTracker()
+    outer = _trackers.get()
+    token = _trackers.set(outer + (tracker,))
+    try:
+        value = resolve()
+    finally:
+        _trackers.reset(token)
+        if outer:
+            outer[-1].lookups.update(tracker.lookups)
+            if not tracker.cacheable:
+                outer[-1].cacheable = False
+    if tracker.cacheable or frozen:
+        cache[cache_key] = (value, tracker.lookups, generation)
+    return value
+
+
 class ConfigSchemaMeta(type):
 
     def __new__(mcls, name, bases, namespace, *, prefix, **kwargs):
@@ -118,7 +209,7 @@ class ConfigSchema(metaclass=ConfigSchemaMeta, prefix=""):
         Represents an item in a configuration schema
 '''
 
-        __slots__ = ('name', 'type', 'namespace', 'default', 'key')
+        __slots__ = ('name', 'type', 'namespace', 'default', 'key', '_cacheable')
 
         def __init__(self, name, type_, default, namespace=None):
             if isinstance(type_, types.GenericAlias):
@@ -135,12 +226,22 @@ class ConfigSchema(metaclass=ConfigSchemaMeta, prefix=""):
             self.default = default
             self.namespace = namespace
             self.key = config_key(name)
+            # Substituted strings are immutable, so resolving a default
+            # can be shared until a key it refers to changes.
+            from .types import ConfigString
+            self._cacheable = issubclass(type_, ConfigString)
 
         def __repr__(self):
             return f'ConfigSchema.Item("{self.name}", {self.type.__name__}, {repr(self.default)}, {repr(self.namespace)})'
 
         def resolve(self, injector):
             "Return the value of this item resolved against the given injector"
+            if self._cacheable:
+                return _cached_resolution(injector, self, lambda: self._resolve(injector))
+            return self._resolve(injector)
+
+        def _resolve(self, injector):
+            _note_config_lookup(injector, self.key)
             try:
                 res = injector.get_instance(self.key)
                 return res
@@ -180,6 +281,7 @@ class ConfigAccessor:
         except KeyError:
             if self._prefix + k in ConfigSchema._schemas:
                 try:
+                    _note_config_lookup(self._injector, config_key(self._prefix + k))
                     return self._injector.get_instance(config_key(self._prefix + k))
                 except KeyError:
                     return self._injector(ConfigAccessor, prefix=self._prefix + k)
@@ -233,5 +335,68 @@ class ConfigAccessor:
     def __getstate__(self):
         return self._dictify(True)
 
+    def _snapshot(self):
+        '''
+        Return a :class:`ConfigSnapshot` of this configuration subtree.  Accessing the snapshot does not involve the injector, so it is suited to code that reads many configuration values in a loop::
+
+            config = self.config_layout._snapshot()
+            for model in models:
+                mirror = config.debian.mirror
+
+        The same snapshot is returned until a provider for one of the keys it contains is added or replaced, at which point a new snapshot is resolved.
+        '''
+        return _cached_resolution(
+            self._injector, (ConfigSnapshot, self._prefix),
+            self._take_snapshot, frozen=True)
+
+    def _take_snapshot(self):
+        values = {}
+        failures = {}
+        for k in self._schema:
+            try:
+                values[k] = getattr(self, k)
+            except Exception as e:
+                failures[k] = e
+        for k in ConfigSchema.subsections(self._prefix):
+            v = getattr(self, k)
+            if isinstance(v, ConfigAccessor):
+                v = v._snapshot()
+            values[k] = v
+        return ConfigSnapshot(self._prefix, values, failures)
+
     def __repr__(self):
         return f'<{self.__class__.__name__} overrides: {self._dictify()}>'
+
+
+class ConfigSnapshot:
+
+    '''
+    A frozen, fully resolved view of a configuration subtree returned by :meth:`ConfigAccessor._snapshot`.  Configuration keys are plain attributes and subsections are nested snapshots.  If resolving a key failed when the snapshot was taken, accessing that key raises the same error.
+    '''
+
+    def __init__(self, prefix, values, failures):
+        d = self.__dict__
+        d.update(values)
+        d['_prefix'] = prefix
+        d['_failures'] = failures
+
+    def __getattr__(self, k):
+        if k.startswith('_'):
+            raise AttributeError(k)
+        failure = self._failures.get(k)
+        if failure is not None:
+            raise failure
+        raise AttributeError(f'{self._prefix}{k} is not a valid configuration key')
+
+    def __setattr__(self, k, v):
+        raise TypeError('Configuration snapshots are read-only')
+
+    def __delattr__(self, k):
+        raise TypeError('Configuration snapshots are read-only')
+
+    def _asdict(self):
+        return {k: (v._asdict() if isinstance(v, ConfigSnapshot) else v)
+                for k, v in self.__dict__.items() if not k.startswith('_')}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self._prefix or "(root)"}>'
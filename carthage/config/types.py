@@ -6,9 +6,11 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
 
+import functools
 import os.path
 from ..dependency_injection import inject, inject_autokwargs, InjectionKey, Injectable, Injector
 from .layout import ConfigLayout
+from .schema import _cached_resolution, _note_config_lookup, _note_uncacheable
 
 
 def getattr_path(o, attrs):
@@ -42,16 +44,21 @@ class ConfigString(str):
 
     '''
 
-    @classmethod
-    def parse(cls, s, config, injector):
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def compile(s):
+        '''Parse *s* once into a tuple of parts.  Each part is either a literal string or a tuple *(environment, parts)* for a ``${...}`` (if *environment* is true) or ``{...}`` substitution whose contents are themselves compiled parts.
+        '''
         def tok(i, awaiting_brace):
             # takes an iterator to consume input characters
+            parts = []
+            text = []
             lastch = None
             for c in i:
                 if lastch == '$' and c != '{':
-                    yield '$'
+                    text.append('$')
                 if lastch == '\\':
-                    yield c
+                    text.append(c)
                 elif c == '\\':
                     # one backslash always eats itself.
                     pass
@@ -59,27 +66,51 @@ class ConfigString(str):
                     # hold to see if next character is {
                     pass
                 elif c == '{':
-                    if lastch == '$':
-                        yield from iter(cls.subst_var("".join(tok(i, True))))
-                    else:
-                        yield from iter(cls.subst(
-                            "".join(tok(i, True)),
-                            config=config,
-                            injector=injector
-                        ))
+                    if text:
+                        parts.append("".join(text))
+                        text = []
+                    parts.append((lastch == '$', tok(i, True)))
                 elif c == '}':
                     if awaiting_brace:
-                        return  # end of inner token
+                        break  # end of inner token
                     else:
                         raise ValueError(f"Unbalanced closing brace in `{s}'")
                 else:
-                    yield c
+                    text.append(c)
                 lastch = c
+            else:
+                if awaiting_brace:
+                    raise ValueError(f"Missing right brace in `{s}'")
+            if text:
+                parts.append("".join(text))
+            return tuple(parts)
 
-            if awaiting_brace:
-                raise ValueError(f"Missing right brace in `{s}'")
+        return tok(iter(s), False)
 
-        return "".join(tok(iter(s), False))
+    @classmethod
+    def parse(cls, s, config, injector):
+        parts = cls.compile(s)
+        if not parts:
+            return ""
+        if len(parts) == 1 and isinstance(parts[0], str):
+            return parts[0]
+        return cls._render(parts, config, injector)
+
+    @classmethod
+    def _render(cls, parts, config, injector):
+        result = []
+        for part in parts:
+            if isinstance(part, str):
+                result.append(part)
+                continue
+            environment, inner = part
+            inner = cls._render(inner, config, injector)
+            if environment:
+                _note_uncacheable()
+                result.append(cls.subst_var(inner))
+            else:
+                result.append(cls.subst(inner, config=config, injector=injector))
+        return "".join(result)
 
     @staticmethod
     def subst_var(s):
@@ -99,6 +130,7 @@ class ConfigString(str):
         if sep == '':
             return str(getattr_path(config, ConfigString.parse(s,config, injector)))
         else:
+            _note_uncacheable()
             try:
                 plugin = injector.get_instance(InjectionKey(ConfigLookupPlugin, name=plugin))
             except KeyError:
@@ -106,8 +138,18 @@ class ConfigString(str):
             return plugin(ConfigString.parse(selector,config,injector))
 
     def __new__(cls, s, *, injector):
+        parts = cls.compile(s)
+        if all(isinstance(part, str) for part in parts):
+            return str.__new__(str, "".join(parts))
+        return str.__new__(str, _cached_resolution(
+            injector, (cls, s),
+            lambda: cls._resolve(s, injector)))
+
+    @classmethod
+    def _resolve(cls, s, injector):
+        _note_config_lookup(injector, InjectionKey(ConfigLayout))
         config = injector(ConfigLayout)
-        return str.__new__(str, cls.parse(s, config, injector))
+        return cls.parse(s, config, injector)
 
 
 @inject(
@@ -82,7 +82,12 @@ class Container(Machine, SetupTaskMixin):
         return f'nspawn/{self.name}'
     async def do_network_config(self, networking):
         if networking and self.network_links:
-            namespace = carthage.network.NetworkNamespace(self.full_name, self.network_links)
+            namespace = None
+            if self.config_layout.network_pool_size > 0:
+                pool = await self.ainjector.get_instance_async(InjectionKey(carthage.network.NamespacePool, _optional=True))
+                if pool: namespace = pool.take(self.network_links)
+            if namespace is None:
+                namespace = carthage.network.NetworkNamespace(self.full_name, self.network_links)
             try:
                 await namespace.start_networking()
                 self.network_namespace = namespace
@@ -165,11 +170,16 @@ class Container(Machine, SetupTaskMixin):
             else:
                 await sh.machinectl("stop", self.full_name,
                                     _bg=True, _bg_exc=False)
-                try:
-                    await sh.ip("netns", "del", self.full_name,
-                                _bg=True, _bg_exc=False)
-                except BaseException:
-                    pass
+                if self.network_namespace:
+                    # The namespace may have come from a NamespacePool and be named accordingly
+                    self.network_namespace.close()
+                    self.network_namespace = None
+                else:
+                    try:
+                        await sh.ip("netns", "del", self.full_name,
+                                    _bg=True, _bg_exc=False)
+                    except BaseException:
+                        pass
                 self._done_cb(code=0, success=True, cmd=None)
             await super().stop_machine()
 
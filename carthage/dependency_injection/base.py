@@ -23,7 +23,7 @@ import sys
 from dataclasses import dataclass
 from .. import tb_utils, event
 from .introspection import *
-from ..utils import NotPresent
+from ..utils import NotPresent, memoproperty
 
 _chatty_modules = {asyncio.futures, asyncio.tasks, sys.modules[__name__]}
 logger = logging.getLogger('carthage.dependency_injection')
@@ -180,6 +180,17 @@ class DependencyProvider:
         self.instantiation_contexts = set()
         self._creation_tb = traceback.extract_stack()[:-1]
 
+    def _copy(self):
+        # Used by ProviderTemplate; shares the creation traceback rather than extracting a new one.
+        dp = DependencyProvider.__new__(DependencyProvider)
+        dp.provider = self.provider
+        dp.allow_multiple = self.allow_multiple
+        dp.close = self.close
+        dp.keys = set(self.keys)
+        dp.instantiation_contexts = set()
+        dp._creation_tb = self._creation_tb
+        return dp
+
     def __repr__(self):
         return "<DependencyProvider allow_multiple={}: {}>".format(
             self.allow_multiple, repr(self.provider))
@@ -254,9 +265,14 @@ class AsyncRequired(RuntimeError):
 # works
 class Injector(Injectable, event.EventListener):
 
+    #: Incremented whenever a provider is added or replaced in any injector.  Caches of values derived from providers can skip revalidation while it is unchanged.
+    provider_generation = 0
+
     def __init__(self, *providers,
                  parent_injector=None):
         self._providers = {}
+        #: Incremented when providers are added to or removed from this injector.
+        self._providers_generation = 0
         self._pending = weakref.WeakSet()
         self.closed = False
         self._closing = False
@@ -337,6 +353,8 @@ class Injector(Injectable, event.EventListener):
             if k2 not in self:
                 self._providers[k2] = p
                 p.keys.add(k2)
+        Injector.provider_generation += 1
+        self._providers_generation += 1
         self.emit_event(
             k, "add_provider",
             p.provider,
@@ -893,6 +911,7 @@ Return the first injector in our parent chain containing *k* or None if there is
         self.closed = True
         del providers
         self._providers.clear()
+        self._providers_generation += 1
         self.parent_injector = None
 
     def __del__(self):
@@ -1012,8 +1031,14 @@ class InjectionKey:
         raise TypeError('InjectionKeys are immutable')
 
     def __hash__(self):
-        return hash(self.target) + sum([hash(k) for k in self.constraints.keys()]) + \
+        # InjectionKeys are immutable, and hashing is a large part of adding providers.
+        try:
+            return self.__dict__['_hash']
+        except KeyError:
+            pass
+        result = self.__dict__['_hash'] = hash(self.target) + sum([hash(k) for k in self.constraints.keys()]) + \
             sum([hash(v) for v in self.constraints.values()])
+        return result
 
     def __eq__(self, other):
         if not isinstance(other, type(self)):
@@ -1043,6 +1068,90 @@ class InjectionKey:
 _injector_injection_key = InjectionKey(Injector)
 
 
+class ProviderTemplate:
+
+    '''
+    A set of providers recorded once and then added to many injectors.  :meth:`add_provider` has the same semantics as :meth:`Injector.add_provider`, but only records the resulting provider table.  :meth:`apply` adds the table to an injector, creating a fresh :class:`DependencyProvider` for each recorded provider; keys, supplementary keys and aliasing between keys are computed only once.
+
+    Used to instantiate the same :class:`~carthage.modeling.InjectableModel` class many times.
+    '''
+
+    def __init__(self):
+        self._providers: dict[InjectionKey, DependencyProvider] = {}
+        self._events = []
+
+    def add_provider(self, k, p=None, *,
+                     allow_multiple=False,
+                     close=True,
+                     replace=False):
+        if p is None and not isinstance(k, InjectionKey):
+            p, k = k, p
+        if k is None:
+            k = default_injection_key(p)
+        if not isinstance(p, DependencyProvider):
+            p = DependencyProvider(p, allow_multiple=allow_multiple, close=close)
+        if k in self._providers:
+            existing_provider = self._providers[k]
+            if p is existing_provider:
+                return k
+            if not replace:
+                raise ExistingProvider(k, existing_provider, p)
+            existing_provider.provider = p.provider
+            existing_provider.keys.add(k)
+        else:
+            self._providers[k] = p
+            p.keys.add(k)
+        for k2 in k.supplementary_injection_keys(p.provider):
+            if k2 not in self._providers:
+                self._providers[k2] = p
+                p.keys.add(k2)
+        self._events.append((k, p, dict(replace=replace, close=close, allow_multiple=allow_multiple)))
+        return k
+
+    @memoproperty
+    def keys(self):
+        return frozenset(self._providers)
+
+    def apply(self, injector: Injector):
+        '''
+        Add the recorded providers to *injector* and emit their *add_provider* events.
+
+        :returns: False without changing *injector* if any recorded key is already provided by *injector*; replacing an existing provider depends on its state, so the caller should add providers individually instead.
+        '''
+        if not self.keys.isdisjoint(injector._providers):
+            return False
+        copies = {}
+        def copy(p):
+            try:
+                return copies[id(p)]
+            except KeyError:
+                dp = copies[id(p)] = p._copy()
+                return dp
+        for k, p in self._providers.items():
+            injector._providers[k] = copy(p)
+        Injector.provider_generation += 1
+        injector._providers_generation += 1
+        if not self._events:
+            return True
+        loop = injector.loop
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+        for k, p, options in self._events:
+            # A provider that only replaced an existing one is not in the table but is still reported.
+            dp = copy(p)
+            injector._event_scope.emit(
+                loop, k, "add_provider", dp.provider,
+                **options,
+                inspector=InjectedDependencyInspector(injector=injector, key=k, provider=dp),
+                other_keys=dp.keys,
+                adl_keys=dp.keys | {_injector_injection_key},
+                scope=injector)
+        return True
+
+
 @dataclass
 class DeferredInjection:
 
@@ -1783,7 +1892,7 @@ __all__ = [
     'DependencyProvider',
     'ExistingProvider', 'Injectable', 'InjectionFailed',
     'InjectionKey', 'Injector',
-    'DeferredInjection',
+    'DeferredInjection', 'ProviderTemplate',
     'InstantiationContext', 'aspect_for',
     'NotPresent',
     'dependency_quote', 'inject',
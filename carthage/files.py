@@ -6,15 +6,25 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
 
+import asyncio
+import contextlib
 import dataclasses
+import fcntl
+import hashlib
+import logging
 import os.path
+import shutil
+import typing
 from pathlib import Path
 from tempfile import TemporaryDirectory
+import weakref
 from .dependency_injection import *
 from . import ConfigLayout, sh
 from .ssh import RsyncPath, SshKey, rsync
 from .setup_tasks import *
+from .utils import file_locked
 __all__ = []
+logger = logging.getLogger('carthage.files')
 rsync_supports_mkpath_state = None
 
 
@@ -25,35 +35,141 @@ def rsync_supports_mkpath():
     return rsync_supports_mkpath_state
 
 
+#: Number of prepared trees retained per repository by :func:`prepare_git_tree`
+git_tree_cache_retain = 3
+
+# The file lock serializes processes; coroutines in this process also need an asyncio lock.  Locks are per event loop.
+_git_tree_locks = weakref.WeakKeyDictionary()
+# Prepared trees in use by this process: path -> [users, descriptor holding a shared lock]
+_git_trees_in_use = {}
+
+
+def _git_tree_lock(repo_dir):
+    locks = _git_tree_locks.setdefault(asyncio.get_running_loop(), {})
+    return locks.setdefault(repo_dir, asyncio.Lock())
+
+
+def _git_tree_use_lock(prepared):
+    return prepared.with_name(f'.{prepared.name}.use')
+
+
+@contextlib.contextmanager
+def _git_tree_in_use(prepared):
+    # Record locks belong to the process, and closing any descriptor for the file releases them, so each process holds one descriptor per tree however many users it has.
+    entry = _git_trees_in_use.get(prepared)
+    if entry is None:
+        fd = os.open(_git_tree_use_lock(prepared), os.O_CREAT | os.O_CLOEXEC | os.O_RDWR, 0o664)
+        fcntl.lockf(fd, fcntl.LOCK_SH)
+        entry = _git_trees_in_use[prepared] = [0, fd]
+    entry[0] += 1
+    try:
+        yield
+    finally:
+        entry[0] -= 1
+        if entry[0] == 0:
+            del _git_trees_in_use[prepared]
+            os.close(entry[1])
+
+
+def _prune_git_tree(tree):
+    if tree in _git_trees_in_use: return
+    lock_path = _git_tree_use_lock(tree)
+    fd = os.open(lock_path, os.O_CREAT | os.O_CLOEXEC | os.O_RDWR, 0o664)
+    try:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return  # In use by another process
+        shutil.rmtree(tree, ignore_errors=True)
+        lock_path.unlink()
+    finally:
+        os.close(fd)
+
+
+@inject(config=ConfigLayout)
+async def prepare_git_tree(git_tree, *, config, stack: contextlib.ExitStack = None):
+    '''
+    Return the path of a clone of the ``HEAD`` of the Git working copy containing *git_tree*.
+
+    Clones are cached under *state_dir* keyed by repository and commit, so preparing the same commit again, including from another process, reuses the existing clone.  Only the :data:`git_tree_cache_retain` most recently used clones of each repository are kept.
+
+    :param stack: If supplied, a :class:`contextlib.ExitStack` or :class:`contextlib.AsyncExitStack`.  The clone is not pruned, by this or another process, until *stack* exits.  Callers that copy from the clone should supply one.
+
+    '''
+    toplevel = sh.git('rev-parse', '--show-toplevel', _cwd=git_tree)
+    toplevel = str(toplevel.stdout, 'utf-8').rstrip()
+    commit = git_tree_hash(toplevel)
+    repo_hash = hashlib.sha256(toplevel.encode('utf-8')).hexdigest()[:16]
+    repo_dir = Path(config.state_dir)/'git_trees'/f'{Path(toplevel).name}-{repo_hash}'
+    prepared = repo_dir/commit
+    os.makedirs(repo_dir, exist_ok=True)
+    async with _git_tree_lock(repo_dir), file_locked(repo_dir/'.lock'):
+        if not prepared.exists():
+            with TemporaryDirectory(dir=repo_dir, prefix='.clone-') as temp:
+                clone = Path(temp)/'tree'
+                await sh.git('clone', '--no-checkout',
+                             toplevel, str(clone),
+                             _bg=True, _bg_exc=False)
+                await sh.git('checkout', '--quiet', commit,
+                             _cwd=clone,
+                             _bg=True, _bg_exc=False)
+                clone.rename(prepared)
+        os.utime(prepared)
+        if stack is not None:
+            stack.enter_context(_git_tree_in_use(prepared))
+        trees = sorted(
+            (p for p in repo_dir.iterdir() if p.is_dir() and not p.name.startswith('.')),
+            key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in trees[git_tree_cache_retain:]:
+            _prune_git_tree(old)
+    return prepared
+
+__all__ += ['prepare_git_tree']
+
+
 @inject(config=ConfigLayout,
         ainjector=AsyncInjector)
-async def rsync_git_tree(git_tree, target: RsyncPath,
-                         *, config, ainjector):
+async def rsync_git_tree(git_tree, target: typing.Union[RsyncPath, typing.Iterable[RsyncPath]],
+                         *, config, ainjector,
+                         concurrency: int = 8):
     '''
     Copy a git tree into a target system.
 
-Clone the ``HEAD`` of a Git working copy into a new temporary directory  This preserves committed files but does not preserve untracked or uncommitted files.  Rsync that directory to the path on a remote system indicated by *target*.
+Clone the ``HEAD`` of a Git working copy with :func:`prepare_git_tree`.  This preserves committed files but does not preserve untracked or uncommitted files.  Rsync that directory to the path on a remote system indicated by *target*.
+
+    :param target: An :class:`RsyncPath` or an iterable of them.  Given an iterable, the same prepared tree is copied to every target with at most *concurrency* rsync processes running at once, and a list of results is returned.  Every target is attempted; if any fail, the first failure is raised once all have finished.
+
 '''
 
-    assert isinstance(target, RsyncPath)
+    if isinstance(target, RsyncPath):
+        targets = [target]
+    else:
+        targets = list(target)
+    assert all(isinstance(t, RsyncPath) for t in targets)
     rsync_opts = []
     if rsync_supports_mkpath():
         rsync_opts.append('--mkpath')
-    if rsync_supports_mkpath() and not str(target.path).endswith('/'):
-        target = RsyncPath(target.machine, str(target.path) + '/')
-    git_tree = sh.git('rev-parse', '--show-toplevel', _cwd=git_tree)
-    git_tree = str(git_tree.stdout, 'utf-8').rstrip()
-    dir = None
-    try:
-        dir = TemporaryDirectory(dir=config.state_dir)
-        await sh.git('clone',
-                     git_tree, dir.name,
-                     _bg=True, _bg_exc=False)
-        return await ainjector(rsync, '-a', '--delete',
-                               *rsync_opts,
-                               dir.name + '/', target)
-    finally:
-        dir.cleanup()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def rsync_one(target):
+        if rsync_supports_mkpath() and not str(target.path).endswith('/'):
+            target = RsyncPath(target.machine, str(target.path) + '/')
+        async with semaphore:
+            return await ainjector(rsync, '-a', '--delete',
+                                   *rsync_opts,
+                                   str(prepared) + '/', target)
+
+    with contextlib.ExitStack() as stack:
+        prepared = await ainjector(prepare_git_tree, git_tree, stack=stack)
+        if isinstance(target, RsyncPath):
+            return await rsync_one(target)
+        results = await asyncio.gather(*(rsync_one(t) for t in targets), return_exceptions=True)
+    failures = [(t, r) for t, r in zip(targets, results) if isinstance(r, BaseException)]
+    for t, r in failures:
+        logger.error(f'Failed to rsync git tree to {t}: {r}')
+    if failures:
+        raise failures[0][1]
+    return results
 
 __all__ += ['rsync_git_tree', ]
 
@@ -5,7 +5,12 @@
 # WITHOUT ANY WARRANTY; without even the implied warranty of
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
+import asyncio
 import collections.abc
+import contextlib
+import contextvars
+import hashlib
+import weakref
 
 import yaml
 from pathlib import Path
@@ -15,7 +20,7 @@ import lmdb
 
 from .dependency_injection import *
 from .config import ConfigLayout
-from .utils import memoproperty
+from .utils import memoproperty, YamlLoader, YamlDumper
 
 
 __all__ = []
@@ -56,6 +61,9 @@ class KvStore(Injectable):
             map_size=max_size,
             create=True,
             writemap=True)
+        self._current_transaction = contextvars.ContextVar('kvstore_transaction', default=None)
+        self._current_snapshot = contextvars.ContextVar('kvstore_snapshot', default=None)
+        self._snapshots = weakref.WeakSet()
         if self.persistent_seed_path:
             persistent_seed_path = Path(self.persistent_seed_path)
             if persistent_seed_path.exists():
@@ -65,7 +73,7 @@ class KvStore(Injectable):
     def close(self):
         self.environment.close()
 
-    def domain(self, d:str, include_in_dump):
+    def domain(self, d:str, include_in_dump, *, cached=False):
         '''Return a :class:`KvDomain` for accessing a domain of keys in the Store.  Typical usage::
 
             kvstore = KvStore(path)
@@ -73,62 +81,278 @@ class KvStore(Injectable):
             domain.put('30', 'foo.com')   # foo.com is address 30 on this network
 
         :param include_in_dump: If True, then the contents of this domain should be included in the results of a call to :meth:`dump`
+
+        :param cached: If True, :meth:`KvDomain.get` results are cached for the life of an enclosing :meth:`read_snapshot`.  Outside a snapshot, the domain is not cached.
         '''
         if include_in_dump:
-            with self.environment.begin(write=True) as txn:
-                assert txn.put(b'dump:'+bytes(d, 'utf-8'), b'true', True)
-        return KvDomain(self, d)
+            with self.transaction() as txn:
+                assert txn.txn.put(b'dump:'+bytes(d, 'utf-8'), b'true', True)
+        return KvDomain(self, d, cached=cached)
+
+    @contextlib.contextmanager
+    def read_snapshot(self):
+        '''A context manager for an operation, such as instantiating a layout, that repeatedly reads the same keys.  One read transaction is held for the duration, and reads from domains opened with *cached* are served from a per-snapshot dictionary.  Writes made in this process through any :class:`KvDomain` invalidate the affected domain's cache and refresh the snapshot, so they are always visible to later reads.  Writes by other processes become visible only when the snapshot is refreshed or closed.  Nested calls join the enclosing snapshot.
+        '''
+        if self._current_snapshot.get() is not None:
+            yield
+            return
+        snapshot = _KvSnapshot(self.environment)
+        self._snapshots.add(snapshot)
+        token = self._current_snapshot.set(snapshot)
+        try:
+            yield
+        finally:
+            self._current_snapshot.reset(token)
+            self._snapshots.discard(snapshot)
+            snapshot.close()
+
+    def _invalidate(self, domain=None):
+        '''Note that *domain* (or every domain if None) has been written by this process.'''
+        for snapshot in list(self._snapshots):
+            snapshot.invalidate(domain)
+
+    @contextlib.contextmanager
+    def transaction(self, write=True):
+        '''A context manager for a transaction spanning any number of domains.  While the transaction is open, operations on any :class:`KvDomain` of this store (including those made by :class:`HintedAssignments`) join it rather than opening their own.  The transaction commits when the outermost context exits normally and is aborted if it exits with an exception::
+
+            with kvstore.transaction():
+                hints.put_many(new_hints, overwrite=True)
+                macs.put(key, mac, overwrite=True)
+
+        Nested calls join the enclosing transaction.  A write cannot be nested inside a read-only transaction.  Tasks started within the transaction inherit it; if such a task uses the store after the transaction has ended, :class:`KvConsistency` is raised rather than its writes escaping the transaction.
+
+        :param write: If False, open a read-only transaction, which sees a consistent snapshot of the store.
+
+        :returns: The :class:`KvTransaction`.
+        '''
+        current = self._current_transaction.get()
+        if current is not None:
+            if current.closed:
+                raise KvConsistency('The transaction this task inherited has already ended')
+            if write and not current.write:
+                raise KvConsistency('Cannot write within a read-only transaction')
+            yield current
+            return
+        with self.environment.begin(write=write) as txn:
+            current = KvTransaction(self, txn, write)
+            token = self._current_transaction.set(current)
+            try:
+                yield current
+            finally:
+                current.closed = True
+                self._current_transaction.reset(token)
+        # Committed; make the writes visible to any read_snapshot.
+        for domain in current.written:
+            self._invalidate(domain)
+
+    #: Number of records written per :meth:`lmdb.Cursor.putmulti` call in :meth:`load`
+    load_batch_size = 10000
 
     def dump(self, file, filter):
-        domains = set()
+        '''Write the domains marked *include_in_dump* to *file* as YAML, one mapping per domain.  Records are streamed from a single read snapshot to the file, so memory use does not grow with the size of the store.  The file is replaced atomically once the dump is complete.
+
+        :param filter: Called as ``filter(domain, key, value)``; records for which it returns False are omitted.
+        '''
         file = Path(file)
-        result = dict()
-        with self.environment.begin() as txn, txn.cursor() as csr:
-            csr.set_range(b'dump')
-            for key, value in csr:
-                if not key.startswith(b'dump:'): break
-                domains.add(key[5:])
-            for d in domains:
-                domain_key = d+b':'
-                csr.set_range(domain_key)
-                domain_result = dict()
-                for key, value in csr:
-                    if not key.startswith(domain_key): continue
-                    key = key[len(domain_key):]
-                    key_str = str(key, 'utf-8')
-                    value_str = str(value, 'utf-8')
-                    if filter(str(d, 'utf-8'), key_str, value_str):
-                        domain_result[key_str] = value_str
-                result[str(d, 'utf-8')] = domain_result
-        file.write_text(yaml.dump(result, default_flow_style=False))
+        tmp = file.with_name(file.name+'.tmp')
+        try:
+            with self.transaction(write=False) as t, \
+                 t.txn.cursor() as csr, \
+                 tmp.open('wt') as f:
+                domains = []
+                if csr.set_range(b'dump:'):
+                    for key in csr.iternext(values=False):
+                        if not key.startswith(b'dump:'): break
+                        domains.append(str(key[5:], 'utf-8'))
+                emitter = _DumpEmitter(f)
+                for d in sorted(domains):
+                    emitter.start_domain(d)
+                    domain_key = kv_key(d, '')
+                    if csr.set_range(domain_key):
+                        for key, value in csr:
+                            if not key.startswith(domain_key): break
+                            if key[len(domain_key):len(domain_key)+1] == b':':
+                                # A domain whose name extends d with a colon (escaped as ::)
+                                continue
+                            key_str = str(key[len(domain_key):], 'utf-8')
+                            value_str = str(value, 'utf-8')
+                            if filter(d, key_str, value_str):
+                                emitter.item(key_str, value_str)
+                    emitter.end_domain()
+                emitter.close()
+            tmp.replace(file)
+        finally:
+            tmp.unlink(missing_ok=True)
 
     def load(self, file):
         '''Load a dump file produced by :meth:`dump`.  Values already in the :class:`KvStore` override values in the dump.
 
         The intent is that a dump file can be checked into a layout repository as an initial set of assignments for things like IP addresses and MAC addresses.  An actual running state_dir for the layout may diverge from the initial hints contained in the dump.  Periodically the layout repository can be updated.
+
+        The file is parsed incrementally and written in batches of :attr:`load_batch_size` within one transaction.
         '''
         file = Path(file)
-        result = yaml.safe_load(file.read_text())
-        with self.environment.begin(write=True) as txn:
-            for domain, domain_dict in result.items():
-                for k,v in domain_dict.items():
-                    txn.put(kv_key(domain, k), bytes(v, 'utf-8'))
-                    # Does not overwrite existing values
-                    
-    
+        batch = []
+        with self.transaction() as t, t.txn.cursor() as csr, \
+             file.open('rt') as f:
+            for domain, k, v in _iter_dump(f):
+                batch.append((kv_key(domain, k), bytes(v, 'utf-8')))
+                if len(batch) >= self.load_batch_size:
+                    csr.putmulti(batch, overwrite=False)
+                    batch = []
+            if batch:
+                csr.putmulti(batch, overwrite=False)
+            t.written.add(None)
+
+    async def async_dump(self, file, filter):
+        '''Run :meth:`dump` in an executor so a large store does not block the event loop.  Must not be called while this task holds a write :meth:`transaction`.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.dump, file, filter)
+
+    async def async_load(self, file):
+        '''Run :meth:`load` in an executor; see :meth:`async_dump`.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.load, file)
+
 
 __all__ += ['KvStore']
 
+
+class _DumpEmitter:
+
+    '''Emit a ``{domain: {key: value}}`` YAML document one record at a time.
+    '''
+
+    def __init__(self, stream):
+        self.dumper = YamlDumper(stream, default_flow_style=False)
+        self.dumper.emit(yaml.StreamStartEvent())
+        self.dumper.emit(yaml.DocumentStartEvent(explicit=False))
+        self.dumper.emit(yaml.MappingStartEvent(None, None, True, flow_style=False))
+
+    def scalar(self, value):
+        tag = 'tag:yaml.org,2002:str'
+        implicit = (self.dumper.resolve(yaml.ScalarNode, value, (True, False)) == tag,
+                    self.dumper.resolve(yaml.ScalarNode, value, (False, True)) == tag)
+        self.dumper.emit(yaml.ScalarEvent(None, tag, implicit, value))
+
+    def start_domain(self, domain):
+        self.scalar(domain)
+        self.dumper.emit(yaml.MappingStartEvent(None, None, True, flow_style=False))
+
+    def item(self, key, value):
+        self.scalar(key)
+        self.scalar(value)
+
+    def end_domain(self):
+        self.dumper.emit(yaml.MappingEndEvent())
+
+    def close(self):
+        self.dumper.emit(yaml.MappingEndEvent())
+        self.dumper.emit(yaml.DocumentEndEvent(explicit=False))
+        self.dumper.emit(yaml.StreamEndEvent())
+        self.dumper.dispose()
+
+
+def _iter_dump(stream):
+    '''Yield *domain, key, value* from a file written by :meth:`KvStore.dump` without building the whole document.  Scalars are returned as strings.
+    '''
+    def expect(event_type):
+        event = next(events)
+        if not isinstance(event, event_type):
+            raise ValueError(f'Unexpected {event} in kvstore dump')
+        return event
+    events = yaml.parse(stream, Loader=YamlLoader)
+    expect(yaml.StreamStartEvent)
+    event = next(events)
+    if isinstance(event, yaml.StreamEndEvent): return
+    if not isinstance(event, yaml.DocumentStartEvent):
+        raise ValueError(f'Unexpected {event} in kvstore dump')
+    event = next(events)
+    if isinstance(event, yaml.ScalarEvent) and event.value in ('', '~', 'null'):
+        return   # Empty document
+    if not isinstance(event, yaml.MappingStartEvent):
+        raise ValueError(f'Unexpected {event} in kvstore dump')
+    while True:
+        event = next(events)
+        if isinstance(event, yaml.MappingEndEvent): break
+        domain = event.value
+        event = next(events)
+        if isinstance(event, yaml.ScalarEvent): continue   # Null domain
+        if not isinstance(event, yaml.MappingStartEvent):
+            raise ValueError(f'Unexpected {event} in kvstore dump')
+        while True:
+            event = next(events)
+            if isinstance(event, yaml.MappingEndEvent): break
+            key = event.value
+            yield domain, key, expect(yaml.ScalarEvent).value
+
+
 def kv_key(domain, key):
     domain = domain.replace(':', '::')
     return bytes(domain+':'+key, 'utf-8')
 
 
+class _KvSnapshot:
+
+    def __init__(self, environment):
+        self.environment = environment
+        self.txn = environment.begin()
+        self.caches = {}
+        self.stale = False
+        self.closed = False
+
+    def invalidate(self, domain):
+        if domain is None: self.caches.clear()
+        else: self.caches.pop(domain, None)
+        self.stale = True
+
+    def lookup(self, domain, k, key):
+        if self.stale:
+            self.txn.abort()
+            self.txn = self.environment.begin()
+            self.stale = False
+        cache = self.caches.setdefault(domain, {})
+        try: return cache[k]
+        except KeyError: pass
+        v = self.txn.get(key)
+        if v is not None: v = str(v, 'utf-8')
+        cache[k] = v
+        return v
+
+    def close(self):
+        self.closed = True
+        self.caches.clear()
+        self.txn.abort()
+
+
+class KvTransaction:
+
+    '''An open transaction on a :class:`KvStore`; see :meth:`KvStore.transaction`.
+
+    :ivar txn: The underlying :class:`lmdb.Transaction`.
+    '''
+
+    def __init__(self, store, txn, write):
+        self.store = store
+        self.txn = txn
+        self.write = write
+        #: Domains written in this transaction; None means any domain may have been written.
+        self.written = set()
+        #: True once the transaction has committed or aborted
+        self.closed = False
+
+__all__ += ['KvTransaction']
+
+
 class KvDomain:
 
-    def __init__(self, store, domain):
+    def __init__(self, store, domain, *, cached=False):
         self.domain = domain
+        self.store = store
         self.environment = store.environment
+        self.cached = cached
 
     def put(self, k, v, *,
             value=None,
@@ -141,30 +365,74 @@ class KvDomain:
         if value:
             value_bytes = bytes(value, 'utf-8')
         else: value_bytes = None
-        with self.environment.begin(write=True) as txn:
+        with self.store.transaction() as t:
+            txn = t.txn
             if value_bytes:
                 actual_value = txn.get(key)
                 if actual_value != value_bytes:
                     raise KvConsistency(f'Expecting {k} == {value} but actually {value_bytes}')
             if not txn.put(key, v_bytes, overwrite=(overwrite or value is not None)):
                 raise KvConsistency(f'{k} present in {self.domain}')
-            
+            t.written.add(self.domain)
+
+    def put_many(self, items, *, overwrite=False):
+        '''Set many keys in one transaction.
+
+        :param items: A mapping or iterable of *(k, v)* pairs.
+
+        :param overwrite: If False, raise :class:`KvConsistency` if any *k* is already present; nothing is written in that case unless an enclosing :meth:`KvStore.transaction` catches the exception.
+        '''
+        if isinstance(items, collections.abc.Mapping):
+            items = items.items()
+        encoded = [(kv_key(self.domain, k), bytes(v, 'utf-8')) for k, v in items]
+        with self.store.transaction() as t, t.txn.cursor() as csr:
+            consumed, added = csr.putmulti(encoded, overwrite=overwrite)
+            t.written.add(self.domain)
+            if not overwrite and added != consumed:
+                raise KvConsistency(f'{consumed-added} keys already present in {self.domain}')
 
     def get(self, k, default=None):
         '''Returns self[*k*] or if not present *default*'''
         key = kv_key(self.domain, k)
-        with self.environment.begin() as txn:
-            v = txn.get(key, NotPresent)
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            v = snapshot.lookup(self.domain, k, key)
+            if v is None: return default
+            return v
+        with self.store.transaction(write=False) as t:
+            v = t.txn.get(key, NotPresent)
             if v == NotPresent: return default
             return str(v, 'utf-8')
 
+    def _snapshot(self):
+        # Reads inside a transaction must see that transaction's writes.
+        if not self.cached or self.store._current_transaction.get() is not None:
+            return None
+        snapshot = self.store._current_snapshot.get()
+        # A task started within a snapshot may outlive it.
+        if snapshot is None or snapshot.closed: return None
+        return snapshot
+
+    def get_many(self, keys, default=None):
+        '''Look up many keys in one transaction.
+
+        :returns: A dict mapping each of *keys* to its value or *default* if not present.
+        '''
+        keys = list(keys)
+        result = dict.fromkeys(keys, default)
+        prefix_len = len(kv_key(self.domain, ''))
+        with self.store.transaction(write=False) as t, t.txn.cursor() as csr:
+            for key, value in csr.getmulti([kv_key(self.domain, k) for k in keys]):
+                result[str(key[prefix_len:], 'utf-8')] = str(value, 'utf-8')
+        return result
+
     def delete(self, k, value=NotPresent):
         '''Removes *k* from self or raises :class:`KvConsistency`
         If *value* is given, then self[*k*] must equal *value* before the delete.
 '''
         key = kv_key(self.domain, k)
-        with self.environment.begin(write=True) as txn, \
-             txn.cursor() as csr:
+        with self.store.transaction() as t, \
+             t.txn.cursor() as csr:
             csr.set_key(key)
             if csr.key() != key:
                 raise KvConsistency(f'{k} not in {self.domain}')
@@ -173,6 +441,7 @@ class KvDomain:
                 if csr.value() != value_bytes:
                     raise KvConsistency(f'{k} in {self.domain} had unexpected value')
             csr.delete()
+            t.written.add(self.domain)
 
 
     def __getitem__(self, k):
@@ -231,6 +500,10 @@ Called in subclasses to indicate that an assignment should be made.  :meth:`reco
 
         :param obj: The object corresponding to *key*.  Not used by :class:`HintedAssignments` except as an input to the subclass's :meth:`record_assignment`
         '''
+        with self.store.transaction():
+            self._assign_with_retries(key, obj)
+
+    def _assign_with_retries(self, key, obj):
         for i in range(self.consistency_retries):
             try:
                 hint = self._hints.get(key)
@@ -355,12 +628,249 @@ It is best if this generator yields strings; ass discussed in the documentation
 __all__ += ['HintedAssignments']
 
 
+def key_digest(key:str):
+    '''A stable, well distributed 64-bit integer hash of *key*.  Unlike :func:`hash`, the result does not vary between processes, and unlike summing characters, similar keys such as ``web01`` and ``web10`` land far apart.
+    '''
+    return int.from_bytes(hashlib.blake2b(bytes(key, 'utf-8'), digest_size=8).digest(), 'big')
+
+__all__ += ['key_digest']
+
+
+class _OccupancyBitmap:
+
+    '''A chunked bitmap of which assignments in a :class:`HashedRangeAssignments` are taken.  The bitmap is stored in its own domain of the :class:`KvStore` and is only accessed within a write transaction so it stays consistent with the assignments themselves.  Writers that do not maintain it (an older Carthage sharing the store, or direct writes to the assignments domain) are detected when an assignment is read: a taken assignment whose bit is clear causes the bitmap to be rebuilt, and a set bit for an assignment that is free is cleared.
+    '''
+
+    #: Number of assignments covered by each stored chunk
+    chunk_bits = 4096
+
+    def __init__(self, txn, domain):
+        self.txn = txn
+        self.domain = domain
+        self.chunks = {}
+        self.dirty = set()
+
+    def _chunk(self, index):
+        chunk, bit = divmod(index, self.chunk_bits)
+        try: data = self.chunks[chunk]
+        except KeyError:
+            stored = self.txn.get(kv_key(self.domain, str(chunk)))
+            if stored is None: data = bytearray(self.chunk_bits//8)
+            else: data = bytearray(stored)
+            self.chunks[chunk] = data
+        return chunk, data, bit
+
+    def __contains__(self, index):
+        chunk, data, bit = self._chunk(index)
+        return bool(data[bit>>3] & (1<<(bit&7)))
+
+    def first_clear(self, start, stop, step=1):
+        '''The first index from *start* toward *stop* (inclusive), moving by *step* (1 or -1), that is not taken; None if all are taken.
+        '''
+        index = start
+        while (index <= stop) if step > 0 else (index >= stop):
+            chunk, data, bit = self._chunk(index)
+            byte = data[bit>>3]
+            if byte == 0xff:
+                # Skip the rest of a fully taken byte
+                index = (index | 7) + 1 if step > 0 else (index & ~7) - 1
+                continue
+            if not byte & (1<<(bit&7)): return index
+            index += step
+        return None
+
+    def set(self, index, value=True):
+        chunk, data, bit = self._chunk(index)
+        if value: data[bit>>3] |= (1<<(bit&7))
+        else: data[bit>>3] &= ~(1<<(bit&7))
+        self.dirty.add(chunk)
+
+    def reset(self):
+        '''Clear every bit, including those in chunks not yet loaded.
+        '''
+        prefix = kv_key(self.domain, '')
+        with self.txn.cursor() as csr:
+            csr.set_range(prefix)
+            for k in csr.iternext(values=False):
+                if not k.startswith(prefix): break
+                try: chunk = int(k[len(prefix):])
+                except ValueError: continue
+                self.chunks[chunk] = bytearray(self.chunk_bits//8)
+                self.dirty.add(chunk)
+        for chunk in self.chunks:
+            self.chunks[chunk] = bytearray(self.chunk_bits//8)
+            self.dirty.add(chunk)
+
+    def flush(self):
+        for chunk in self.dirty:
+            self.txn.put(kv_key(self.domain, str(chunk)), bytes(self.chunks[chunk]))
+        self.dirty.clear()
+
+
 class HashedRangeAssignments(HintedAssignments):
 
+    '''Assignments within an integer-like range, preferring an assignment near a hash of the key.
+
+    Each assignment (or batch of assignments with :meth:`assign_many`) is made within a single write transaction on the :class:`KvStore`.  An occupancy bitmap is maintained alongside the assignments.  Unless *prefer_reallocate* is set or :meth:`possible_assignments` is overridden, the bitmap is used to jump from the hashed position to the nearest free assignment, and only that assignment is read.  Taken assignments are examined to see whether they can be reused only when no free assignment remains.
+
+    '''
+
     def __init__(self, domain,  **kwargs):
         super().__init__(domain, **kwargs)
+        self._occupied = self.store.domain(domain+'/occupied', False)
 
-    
+    def _assignment_index(self, assignment):
+        try: return int(self.str_to_assignment(assignment))
+        except (TypeError, ValueError): return None
+
+    def _bitmap(self, txn):
+        bitmap = _OccupancyBitmap(txn, self._occupied.domain)
+        built_key = kv_key(self._occupied.domain, 'built')
+        if txn.get(built_key) is None:
+            # Store predates the bitmap; build it from the assignments.
+            self._rebuild_bitmap(txn, bitmap)
+            txn.put(built_key, b'true')
+        return bitmap
+
+    def _rebuild_bitmap(self, txn, bitmap):
+        bitmap.reset()
+        prefix = kv_key(self._assignments.domain, '')
+        with txn.cursor() as csr:
+            csr.set_range(prefix)
+            for k in csr.iternext(values=False):
+                if not k.startswith(prefix): break
+                index = self._assignment_index(str(k[len(prefix):], 'utf-8'))
+                if index is not None: bitmap.set(index)
+
+    def _assign(self, key, obj):
+        self.assign_many([(key, obj)])
+
+    def assign_many(self, items, forced=()):
+        '''Make assignments for many objects in one write transaction.
+
+        :param items: An iterable of *(key, obj)* to be assigned as with :meth:`_assign`.
+
+        :param forced: An iterable of *(key, obj, assignment)* to be recorded as with :meth:`force_assignment` before any other assignments are made.
+
+        :meth:`record_assignment` is called for each assigned object once the transaction commits.  If any assignment fails (for example with :class:`AssignmentsExhausted`), no assignments are recorded.  Within an enclosing :meth:`KvStore.transaction`, objects are informed when this call completes, before the enclosing transaction commits.
+
+        '''
+        results = []
+        with self.store.transaction() as t:
+            txn = t.txn
+            t.written.update((self._assignments.domain, self._hints.domain, self._occupied.domain))
+            bitmap = self._bitmap(txn)
+            made = dict(self._assignments_made)
+            for key, obj, assignment in forced:
+                self._force_in_txn(txn, bitmap, made, key, str(assignment))
+            for key, obj in items:
+                results.append((key, obj, self._assign_in_txn(txn, bitmap, made, key, obj)))
+            bitmap.flush()
+        self._assignments_made = made
+        for key, obj, assignment in results:
+            self.record_assignment(key, obj, assignment)
+
+    def _assign_in_txn(self, txn, bitmap, made, key, obj):
+        hint_key = kv_key(self._hints.domain, key)
+        hint = txn.get(hint_key)
+        if hint is not None:
+            hint = str(hint, 'utf-8')
+            if self.valid_assignment(hint, obj):
+                if self._try_in_txn(txn, bitmap, made, key, hint, True) is True:
+                    return hint
+                txn.delete(hint_key)
+        if not self.prefer_reallocate and \
+           type(self).possible_assignments is HashedRangeAssignments.possible_assignments:
+            assignment = self._nearest_free(bitmap, key, obj)
+            if assignment is not None and \
+               self._try_in_txn(txn, bitmap, made, key, assignment, False) is True:
+                return assignment
+        reusable_assignment = None
+        for assignment in self.possible_assignments(key, obj):
+            assignment = str(assignment)
+            result = self._try_in_txn(txn, bitmap, made, key, assignment, self.prefer_reallocate)
+            if result is True: return assignment
+            if result == 'reusable' and reusable_assignment is None:
+                reusable_assignment = assignment
+        if reusable_assignment is not None:
+            if self._try_in_txn(txn, bitmap, made, key, reusable_assignment, True) is True:
+                return reusable_assignment
+        raise AssignmentsExhausted(f'Assignments for {self} exhausted')
+
+    def _nearest_free(self, bitmap, key, obj):
+        '''The first assignment in the order of :meth:`possible_assignments` that *bitmap* shows free, or None.
+        '''
+        low, hash, high = self.hash_key(key, obj)
+        try: low_index, index, high_index = int(low), int(hash), int(high)
+        except (TypeError, ValueError): return None
+        up = bitmap.first_clear(index, high_index)
+        # possible_assignments tries hash+distance before hash-distance, so below must be strictly nearer.
+        down_limit = low_index if up is None else max(low_index, 2*index-up+1)
+        down = bitmap.first_clear(index-1, down_limit, -1)
+        found = down if down is not None else up
+        if found is None: return None
+        return str(type(hash)(found))
+
+    def _try_in_txn(self, txn, bitmap, made, key, assignment, reallocate_assigned):
+        '''The transactional equivalent of :meth:`_try_assignment`.
+        '''
+        made.pop(key, None)
+        assignment_key = kv_key(self._assignments.domain, assignment)
+        index = self._assignment_index(assignment)
+        current_key = txn.get(assignment_key)
+        if current_key is not None:
+            current_key = str(current_key, 'utf-8')
+            if index is not None and index not in bitmap:
+                # Written by something that does not maintain the bitmap, such as an older Carthage sharing the store.
+                self._rebuild_bitmap(txn, bitmap)
+        elif index is not None and index in bitmap:
+            # Deleted by something that does not maintain the bitmap
+            bitmap.set(index, False)
+        if current_key in made:
+            if made[current_key] == assignment:
+                return False   # Has been allocated in this round to someone else
+            # The previous holder has already moved this round
+            current_key = None
+        if current_key and (current_key != key):
+            if not self._can_validate_assignments: return False
+            if self.valid_key(current_key): return False
+            if not reallocate_assigned: return 'reusable'
+        txn.put(assignment_key, bytes(key, 'utf-8'))
+        if index is not None: bitmap.set(index)
+        txn.put(kv_key(self._hints.domain, key), bytes(assignment, 'utf-8'))
+        made[key] = assignment
+        return True
+
+    def _force_in_txn(self, txn, bitmap, made, key, assignment):
+        txn.put(kv_key(self._assignments.domain, assignment), bytes(key, 'utf-8'))
+        index = self._assignment_index(assignment)
+        if index is not None: bitmap.set(index)
+        txn.put(kv_key(self._hints.domain, key), bytes(assignment, 'utf-8'))
+        made[key] = assignment
+
+    def force_assignment(self, key, obj, assignment):
+        self.assign_many([], forced=[(key, obj, assignment)])
+
+    def _try_assignment(self, key, obj, assignment, reallocate_assigned):
+        # Keep the bitmap current for callers of the per-assignment interface.
+        with self.store.transaction() as t:
+            t.written.update((self._assignments.domain, self._hints.domain, self._occupied.domain))
+            bitmap = self._bitmap(t.txn)
+            made = dict(self._assignments_made)
+            result = self._try_in_txn(t.txn, bitmap, made, key, str(assignment), reallocate_assigned)
+            bitmap.flush()
+        self._assignments_made = made
+        if result is True:
+            self.record_assignment(key, obj, assignment)
+        return result
+
+    #: If True, position keys with the original additive hash of their
+    #characters rather than :func:`key_digest`.  Existing assignments
+    #survive a change of hash either way, because the hint recorded for
+    #a key is always tried before any hashed position; this only
+    #matters for reproducing the old preferred position of a key that
+    #has no hint.
+    legacy_hash = False
 
     def hash_key(self, key, obj):
         '''Key hashed, bounded to low <= key <= high
@@ -368,15 +878,16 @@ class HashedRangeAssignments(HintedAssignments):
 '''
         assert isinstance(key, str)
         low, high = self.find_bounds(obj)
-        result = 0
-        for c in key: result += ord(c)
+        if self.legacy_hash:
+            result = 0
+            for c in key: result += ord(c)
+        else:
+            result = key_digest(key)
         try: size = high-low +1
         except TypeError:
             size = int(high)-int(low)+1
         return low, low + (result % size), high
 
-    
-
     def possible_assignments(self, key, obj):
         '''Finds the bounds for *obj* using :meth:`find_bounds` then returns all assignments within the bounds:
 
@@ -10,13 +10,13 @@ import logging
 logger = logging.getLogger("carthage.libvirt")
 
 import asyncio
+import functools
 import json
 import os
 import os.path
 import shutil
 import types
 import uuid
-import mako.lookup
 
 import carthage.network
 
@@ -30,7 +30,11 @@ from carthage.setup_tasks import SetupTaskMixin, setup_task
 from carthage.utils import when_needed, memoproperty
 
 _resources_path = os.path.join(os.path.dirname(__file__), "resources")
-_templates = mako.lookup.TemplateLookup([_resources_path + '/templates'])
+
+@functools.cache
+def _templates():
+    import mako.lookup
+    return mako.lookup.TemplateLookup([_resources_path + '/templates'])
 
 vm_image_key = InjectionKey('vm-image')
 
@@ -122,7 +126,7 @@ class Vm(Machine, SetupTaskMixin):
 
     async def write_config(self):
         from carthage.modeling import CarthageLayout
-        template = _templates.get_template("vm-config.mako")
+        template = _templates().get_template("vm-config.mako")
         await self.resolve_networking()
         # Instantiate the network technology class when we don't have enough information to
         # determine the interface without access to it. Links are instantiated either when
@@ -200,6 +204,7 @@ class Vm(Machine, SetupTaskMixin):
                                  _bg=True, _bg_exc=False)
                         raise e from None
             self.running = True
+            self.note_running_state()
 
     start_machine = start_vm
 
@@ -221,6 +226,7 @@ class Vm(Machine, SetupTaskMixin):
                            _bg_exc=False)
             for i in range(10):
                 await asyncio.sleep(5)
+                self.invalidate_running_state()
                 if not await self.is_machine_running(find_ip_address=False):
                     break
             if self.running:
@@ -266,11 +272,14 @@ class Vm(Machine, SetupTaskMixin):
         return await super().async_ready()
 
     async def is_machine_running(self, find_ip_address:bool=True):
-        domid = self.domid()
-        if domid and domid != '-':
-            self.running = True
-        else:
-            self.running = False
+        if not self.running_state_current():
+            try:
+                result = await sh.virsh('domid', self.full_name)
+                domid = str(result.stdout, 'utf-8').strip()
+            except sh.ErrorReturnCode_1:
+                domid = None
+            self.running = bool(domid and domid != '-')
+            self.note_running_state()
         if self.running and find_ip_address and (self.__class__.ip_address is Machine.ip_address):
             try:
                 self.ip_address
@@ -285,6 +294,7 @@ class Vm(Machine, SetupTaskMixin):
         time_remaining = timeout
         while await self.is_machine_running():
             await asyncio.sleep(5)
+            self.invalidate_running_state()
             time_remaining -= 5
             if time_remaining <= 0:
                 raise TimeoutError
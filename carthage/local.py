@@ -15,7 +15,7 @@ from .dependency_injection import *
 from . import sh
 from .utils import memoproperty, when_needed
 from .setup_tasks import SetupTaskMixin
-from .network import NetworkLink, BridgeNetwork, match_link
+from .network import NetworkLink, BridgeNetwork, LinkIndex, match_link
 from .deployment import DeletionPolicy, destroy_policy
 
 class LocalMachineMixin:
@@ -111,6 +111,7 @@ However if Carthage is configuring the local networking on the hypervisor, then
     from carthage.network.links import BridgeLink
     import netifaces
     excluded_links = set()
+    index = LinkIndex(model.network_links)
     gateways = netifaces.gateways()
     try: v4_gateway_interface = gateways['default'][netifaces.AF_INET][1]
     except (KeyError, IndexError): v4_gateway_interface = None
@@ -122,7 +123,7 @@ However if Carthage is configuring the local networking on the hypervisor, then
         except KeyError: address = None
         link = match_link(model.network_links, interface,
                           mac=mac, address=address,
-                          excluded_links=excluded_links)
+                          excluded_links=excluded_links, index=index)
         if link and address:
             link.merged_v4_config.address = IPv4Address(address)
             if interface == v4_gateway_interface:
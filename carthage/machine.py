@@ -10,17 +10,21 @@ from __future__ import annotations
 import abc
 import asyncio
 import contextlib
+import dataclasses
 import os
 import os.path
+import re
+import secrets
 import shlex
 import tempfile
+import time
 import typing
 from pathlib import Path
 
 from .dependency_injection import *
 from .config import ConfigLayout
 from .ssh import SshKey, SshAgent, RsyncPath, ssh_user_addr, ssh_handle_jump_host
-from .utils import memoproperty
+from .utils import memoproperty, wait_for_mount
 from . import sh, deployment
 import carthage.ssh
 from .setup_tasks import SetupTaskMixin, setup_task, TaskWrapperBase, TaskInspector, PathMixin
@@ -383,6 +387,147 @@ class AbstractMachineModel(NetworkedModel):
 
 
 
+
+@dataclasses.dataclass
+class BatchedCommandResult:
+
+    '''The outcome of one command run as part of a :class:`CommandBatch`.'''
+
+    #: The command as it was run in the remote shell
+    command: str
+    exit_code: int
+    stdout: bytes
+    stderr: bytes
+
+
+class BatchedCommandFailed(RuntimeError):
+
+    '''
+    A command in a :class:`CommandBatch` exited with a status not in its *_ok_code*.  Commands after the failed command are not run.
+
+    :attr:`result` is the :class:`BatchedCommandResult` of the failing command; :attr:`results` contains the results of all commands that ran including the failing command.
+    '''
+
+    def __init__(self, index, results):
+        self.index = index
+        self.results = results
+        self.result = results[index]
+        super().__init__(
+            f'Command {index} of batch ({self.result.command}) failed with exit code {self.result.exit_code}')
+
+    def __str__(self):
+        s = super().__str__()
+        stderr = self.result.stderr.decode('utf-8', 'replace').strip()
+        if stderr:
+            s += ': ' + stderr
+        return s
+
+
+class CommandBatch:
+
+    '''
+    Queue commands to run on a machine and run them all as one shell script with a single call to :meth:`Machine.run_command`.  For machines accessed over ssh, this is one round trip rather than one per command.  Usage::
+
+        async with machine.command_batch() as batch:
+            batch.run_command('mkdir', '-p', '/etc/foo')
+            batch.run_command('systemctl', 'daemon-reload')
+        # Commands have run by here; results are in batch.results
+
+    Commands run in order in the same remote shell with stdin redirected from ``/dev/null``.  The exit status, stdout and stderr of each command are collected separately.  The batch stops at the first command whose exit status is not in its *_ok_code*, and :class:`BatchedCommandFailed` is raised.
+
+    :param machine: Anything with a :meth:`~Machine.run_command` method.
+
+    '''
+
+    def __init__(self, machine, *, _user=None):
+        self.machine = machine
+        self.user = _user
+        self.commands = []
+        self.results = None
+
+    def run_command(self, *args, _ok_code=(0,)):
+        '''
+        Queue a command.
+
+        :returns: The index of the command's :class:`BatchedCommandResult` in :attr:`results`.
+        '''
+        if self.results is not None:
+            raise RuntimeError('This batch has already been run')
+        if isinstance(_ok_code, int):
+            _ok_code = (_ok_code,)
+        args = [str(a) for a in args]
+        self.commands.append((shlex.join(args), tuple(int(c) for c in _ok_code)))
+        return len(self.commands)-1
+
+    def __len__(self):
+        return len(self.commands)
+
+    def script(self, token):
+        lines = [
+            'd=$(mktemp -d) || exit 1',
+            "trap 'rm -rf \"$d\"' EXIT",
+        ]
+        for index, (command, ok_code) in enumerate(self.commands):
+            lines.append(f'{command} </dev/null >"$d/out" 2>"$d/err"; rc=$?')
+            lines.append(f'printf \'\\n{token} {index} %d %d %d\\n\' $rc $(wc -c <"$d/out") $(wc -c <"$d/err")')
+            lines.append('cat "$d/out" "$d/err"')
+            lines.append(f'case $rc in {"|".join(str(c) for c in ok_code)}) ;; *) exit 0;; esac')
+        return '\n'.join(lines)+'\n'
+
+    def parse_output(self, token, output):
+        header_re = re.compile(rb'\n' + token.encode() + rb' (\d+) (-?\d+) (\d+) (\d+)\n')
+        results = []
+        pos = 0
+        while True:
+            match = header_re.search(output, pos)
+            if not match:
+                break
+            index, exit_code, stdout_len, stderr_len = (int(x) for x in match.groups())
+            start = match.end()
+            results.append(BatchedCommandResult(
+                command=self.commands[index][0],
+                exit_code=exit_code,
+                stdout=output[start:start+stdout_len],
+                stderr=output[start+stdout_len:start+stdout_len+stderr_len]))
+            pos = start+stdout_len+stderr_len
+        return results
+
+    async def run(self):
+        '''
+        Run the queued commands.
+
+        :returns: A list of :class:`BatchedCommandResult`, one per queued command.
+        '''
+        if self.results is not None:
+            raise RuntimeError('This batch has already been run')
+        if not self.commands:
+            self.results = []
+            return self.results
+        token = 'carthage-batch-'+secrets.token_hex(8)
+        kwargs = {}
+        if self.user is not None:
+            kwargs['_user'] = self.user
+        result = await self.machine.run_command('sh', '-c', self.script(token), **kwargs)
+        output = result.stdout
+        if isinstance(output, str):
+            output = output.encode('utf-8')
+        results = self.parse_output(token, output)
+        self.results = results
+        if results and results[-1].exit_code not in self.commands[len(results)-1][1]:
+            raise BatchedCommandFailed(len(results)-1, results)
+        if len(results) != len(self.commands):
+            raise RuntimeError(f'Command batch on {self.machine!r} stopped after {len(results)} of {len(self.commands)} commands')
+        return results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc, val, tb):
+        if exc is None:
+            await self.run()
+        return False
+
+
 @inject_autokwargs(config_layout=ConfigLayout)
 class Machine(NetworkedMixin, AsyncInjectable, SshMixin):
 
@@ -561,6 +706,7 @@ class Machine(NetworkedMixin, AsyncInjectable, SshMixin):
         '''
         Must be overridden.  Start the machine.
         '''
+        self.invalidate_running_state()
         self.injector.emit_event(InjectionKey(Machine),
                                  "start_machine", self,
                                  adl_keys={InjectionKey(Machine, host=self.name)} |
@@ -569,6 +715,7 @@ class Machine(NetworkedMixin, AsyncInjectable, SshMixin):
     async def stop_machine(self):
         ''' Must be overridden; stop the machine.
         '''
+        self.invalidate_running_state()
         self.injector.emit_event(InjectionKey(Machine),
                                  "stop_machine", self,
                                  adl_keys={InjectionKey(Machine, host=self.name)} |
@@ -583,6 +730,31 @@ class Machine(NetworkedMixin, AsyncInjectable, SshMixin):
         '''
         raise NotImplementedError
 
+    #: Seconds for which the result of :meth:`is_machine_running` may be reused without asking the backend again.  Only implementations that consult :meth:`running_state_current` honor this.
+    running_state_ttl: float = 2.0
+
+    _running_state_time: float = None
+
+    def running_state_current(self) -> bool:
+        '''
+        Return true if :attr:`running` was determined within the last :attr:`running_state_ttl` seconds, so :meth:`is_machine_running` can return it without asking the backend.
+        '''
+        if self._running_state_time is None or self.running is None:
+            return False
+        return time.monotonic() - self._running_state_time < self.running_state_ttl
+
+    def note_running_state(self):
+        '''
+        Record that :attr:`running` has just been determined from the backend.
+        '''
+        self._running_state_time = time.monotonic()
+
+    def invalidate_running_state(self):
+        '''
+        Force the next :meth:`is_machine_running` to ask the backend.  Called by :meth:`start_machine` and :meth:`stop_machine`; call it when some other event may have changed the machine's state.
+        '''
+        self._running_state_time = None
+
     def __repr__(self):
         res = f"<{self.__class__.__name__} name:{self.name} "
         try:
@@ -635,6 +807,12 @@ it works like :meth:`carthage.container.Container.container_command` and is used
             shlex.join(args),
             _bg=_bg, _bg_exc=_bg_exc, **kwargs)
 
+    def command_batch(self, _user=None):
+        '''
+        Return a :class:`CommandBatch` that runs queued commands on this machine with a single :meth:`run_command` call.
+        '''
+        return CommandBatch(self, _user=_user)
+
 
     async def sshfs_process_factory(self, user):
         if user != self.ssh_login_user:
@@ -650,6 +828,9 @@ it works like :meth:`carthage.container.Container.container_command` and is used
             _bg_exc=False,
             _env = agent.agent_environ)
 
+    #: Seconds to wait for sshfs to mount in :meth:`filesystem_access`
+    sshfs_mount_timeout: float = 10.0
+
     @contextlib.asynccontextmanager
     async def filesystem_access(self, user=None):
 
@@ -681,33 +862,104 @@ it works like :meth:`carthage.container.Container.container_command` and is used
                         st = os.stat(self.sshfs_path)
                         unmounted_dev = st.st_dev
                         self.sshfs_process = await self.sshfs_process_factory(user=user)
-                        for x in range(5):
-                            alive, *rest = self.sshfs_process.process.is_alive()
-                            if not alive:
-                                await self.sshfs_process
-                                raise RuntimeError  # I'd expect that to have happened from an sh exit error already
-                            st = os.stat(self.sshfs_path)
-                            if st.st_dev != unmounted_dev:
-                                break
-                            await asyncio.sleep(0.4)
-                        else:
-                            raise TimeoutError("sshfs failed to mount")
+                        try:
+                            await wait_for_mount(
+                                lambda: os.stat(self.sshfs_path).st_dev != unmounted_dev,
+                                self.sshfs_process,
+                                timeout=self.sshfs_mount_timeout)
+                        except TimeoutError:
+                            raise TimeoutError("sshfs failed to mount") from None
                 yield Path(self.sshfs_path)
             finally:
                 self.sshfs_count -= 1
                 if self.sshfs_count <= 0:
                     self.sshfs_count = 0
+                    process = self.sshfs_process
                     try:
-                        self.sshfs_process.process.terminate()
+                        process.process.terminate()
                     except BaseException:
                         pass
                     dir = self.sshfs_path
                     self.sshfs_path = None
                     self.sshfs_process = None
-                    await asyncio.sleep(0.2)
+                    await stop_sshfs(process)
                     with contextlib.suppress(OSError):
                         os.rmdir(dir)
 
+    async def copy_tree_to(self, local_path, remote_path, *, _user=None):
+        '''
+        Copy the contents of the local directory *local_path* into *remote_path* on the machine, creating *remote_path* if needed.
+
+        Unlike copying through :meth:`filesystem_access`, which costs at least one sftp round trip per file, this streams a tar archive through a single :meth:`run_command`, so large trees of small files transfer at close to wire speed.
+
+        '''
+        async with self.machine_running(ssh_online=True):
+            local = None
+            read_fd, write_fd = os.pipe()
+            try:
+                with open(write_fd, 'wb') as writer:
+                    local = sh.tar('-C', str(local_path), '-cf', '-', '.', _out=writer)
+                # Once our copy of the write side is closed, the remote tar sees EOF when the local tar finishes.
+                with open(read_fd, 'rb') as reader:
+                    read_fd = None
+                    await self.run_command(
+                        'sh', '-c', 'mkdir -p "$1" && exec tar -C "$1" -xf -',
+                        'sh', str(remote_path),
+                        _in=reader, _user=_user)
+                await local
+                local = None
+            finally:
+                if read_fd is not None:
+                    os.close(read_fd)
+                await stop_process(local)
+
+    async def copy_tree_from(self, remote_path, local_path, *, _user=None):
+        '''
+        Copy the contents of *remote_path* on the machine into the local directory *local_path*, creating *local_path* if needed.  Like :meth:`copy_tree_to`, this streams a tar archive rather than going through :meth:`filesystem_access`.
+        '''
+        os.makedirs(local_path, exist_ok=True)
+        async with self.machine_running(ssh_online=True):
+            local = None
+            read_fd, write_fd = os.pipe()
+            try:
+                with open(read_fd, 'rb') as reader:
+                    local = sh.tar('-C', str(local_path), '-xf', '-', _in=reader)
+                with open(write_fd, 'wb') as writer:
+                    write_fd = None
+                    await self.run_command(
+                        'tar', '-C', str(remote_path), '-cf', '-', '.',
+                        _out=writer, _user=_user)
+                await local
+                local = None
+            finally:
+                if write_fd is not None:
+                    os.close(write_fd)
+                await stop_process(local)
+
+
+async def stop_sshfs(process, timeout=5.0):
+    '''
+    Wait for an sshfs *process* that has been asked to terminate to exit, so its mount point can be removed.
+    '''
+    if process is None:
+        return
+    with contextlib.suppress(Exception):
+        await asyncio.wait_for(_await_process(process), timeout)
+
+async def stop_process(process, timeout=5.0):
+    '''
+    Terminate *process* if it is still running and reap it, ignoring how it exits.
+    '''
+    if process is None:
+        return
+    if process.process.exit_code is None:
+        with contextlib.suppress(Exception):
+            process.process.terminate()
+    await stop_sshfs(process, timeout)
+
+async def _await_process(process):
+    return await process
+
 
 @inject_autokwargs(config_layout=ConfigLayout)
 class BaseCustomization(SetupTaskMixin, AsyncInjectable):
@@ -783,7 +1035,7 @@ class BaseCustomization(SetupTaskMixin, AsyncInjectable):
 
     def __getattr__(self, a):
         if a in ('ssh', 'ip_address', 'start_machine', 'stop_machine',
-                 'filesystem_access',
+                 'filesystem_access', 'copy_tree_to', 'copy_tree_from',
                  'model',
                  'name', 'ansible_inventory_name',
                  'machine_running', 'running',
@@ -805,6 +1057,11 @@ class BaseCustomization(SetupTaskMixin, AsyncInjectable):
                 *args, _user=_user,
                 **kwargs)
 
+    def command_batch(self, _user=None):
+        if _user is None:
+            _user = self.runas_user
+        return CommandBatch(self.host, _user=_user)
+
 
 class MachineCustomization(BaseCustomization):
 
@@ -1010,6 +1267,7 @@ __all__ = ['AbstractMachineModel',
            'ssh_origin',
            'ssh_jump_host',
            'Machine', 'MachineRunning', 'BareMetalMachine',
+           'CommandBatch', 'BatchedCommandResult', 'BatchedCommandFailed',
            'ResolvableModel', 'NetworkedMixin', 'NetworkedModel',
            'SshMixin', 'BaseCustomization', 'ContainerCustomization',
            'FilesystemCustomization',
@@ -7,16 +7,20 @@
 # LICENSE for details.
 
 import asyncio
+import contextlib
 import logging
 import os
+import time
 import types
 import typing
 from pathlib import Path
 import uuid
+import weakref
 from .implementation import *
 from .decorators import *
 from carthage.dependency_injection import *  # type: ignore
 from carthage.utils import when_needed, memoproperty
+from carthage.profiling import startup_profile
 from carthage import ConfigLayout, SetupTaskMixin, PathMixin
 import carthage.kvstore
 import carthage.network
@@ -38,6 +42,50 @@ def dependency_quote_class(c: type):
 __all__ += ['dependency_quote_class']
 
 
+_transclusion_cache = weakref.WeakKeyDictionary()
+_transclusion_statistics = dict(hits=0, rechecks=0, misses=0, seconds=0.0)
+startup_profile.add_statistics('transclusion', lambda: dict(_transclusion_statistics))
+
+
+def _transcluded_keys(cls, injector):
+    '''
+    :returns: The keys in *cls.__transclusions__* that *injector* or one of its parents provides.
+
+    Results are cached per class and injector.  Providers are only removed when an injector is closed, so a cached result remains valid except that keys not found may since have been added.  When an injector in the parent chain has gained providers, only those keys are checked again, and only against the injectors that changed.
+    '''
+    if not cls.__transclusions__:
+        return frozenset()
+    start = time.perf_counter()
+    chain = []
+    parent = injector
+    while parent is not None:
+        chain.append(parent)
+        parent = parent.parent_injector
+    ids = tuple(id(i) for i in chain)
+    generations = tuple(i._providers_generation for i in chain)
+    keys = tuple(cls.__transclusions__)
+    cache = _transclusion_cache.setdefault(injector, {})
+    try:
+        cached_ids, cached_generations, cached_keys, result = cache[cls]
+        current = cached_ids == ids and cached_keys == keys
+    except KeyError:
+        current = False
+    if not current:
+        _transclusion_statistics['misses'] += 1
+        result = frozenset(k for k in keys if injector.injector_containing(k))
+    elif cached_generations != generations:
+        _transclusion_statistics['rechecks'] += 1
+        changed = [i for i, old, new in zip(chain, cached_generations, generations) if old != new]
+        added = [k for k in keys if k not in result and any(k in i for i in changed)]
+        if added:
+            result = result | frozenset(added)
+    else:
+        _transclusion_statistics['hits'] += 1
+    cache[cls] = (ids, generations, keys, result)
+    _transclusion_statistics['seconds'] += time.perf_counter() - start
+    return result
+
+
 @inject_autokwargs(injector=Injector)
 class InjectableModel(Injectable, metaclass=InjectableModelType):
 
@@ -45,15 +93,14 @@ class InjectableModel(Injectable, metaclass=InjectableModelType):
         self.__class__._already_instantiated = True # no more calling modelmethods
         super().__init__(*args, **kwargs)
         injector = self.injector
-        dependency_providers: typing.Mapping[typing.Any, DependencyProvider] = {}
         ignored_keys = set()
         parent_injector = injector.parent_injector
         not_transcluded = set()
         if _not_transcluded: not_transcluded.update(_not_transcluded)
+        transcluded = _transcluded_keys(self.__class__, parent_injector)
         for k, to_ignore in self.__transclusions__.items():
             if k in not_transcluded: continue
-            target = parent_injector.injector_containing(k)
-            if target:
+            if k in transcluded:
                 ignored_keys |= to_ignore
                 # For each alias that a transcluded item may be known by, set up an injector_xref back to the base transcluded key
                 for alias in to_ignore:
@@ -63,12 +110,25 @@ class InjectableModel(Injectable, metaclass=InjectableModelType):
             else: not_transcluded |= to_ignore
         if not_transcluded: self.injector.add_provider(not_transcluded_key, not_transcluded)
         self.ignored_by_transclusion = frozenset(ignored_keys)
+        template = self.__class__._provider_template(self.ignored_by_transclusion)
+        if not template.apply(injector):
+            # Something already provides one of our keys; replace individually.
+            self.__class__._add_initial_injections(injector, self.ignored_by_transclusion)
+
+        for c in reversed(self.__class__.__mro__):
+            if isinstance(c, ModelingBase) and hasattr(c, '_callbacks'):
+                for cb in c._callbacks:
+                    cb(self)
+
+    @classmethod
+    def _add_initial_injections(cls, target, ignored_keys):
+        dependency_providers: typing.Mapping[typing.Any, DependencyProvider] = {}
         # This is complicated because we want to reuse the same
         # DependencyProvider when registering the same value more than
         # once so that instantiations alias and we don't accidentally
         # get multiple instances of the same type providing related
         # but different keys.
-        for k, info in self.__class__.__initial_injections__.items():
+        for k, info in cls.__initial_injections__.items():
             v, options = info
             if k in ignored_keys: continue
             try:
@@ -84,14 +144,27 @@ class InjectableModel(Injectable, metaclass=InjectableModelType):
                     pass
             options = dict(options)
             try:
-                self.injector.add_provider(k, dp, replace=True, **options)
+                target.add_provider(k, dp, replace=True, **options)
             except Exception as e:
                 raise RuntimeError(f'Failed registering {v} as provider for {k}') from e
 
-        for c in reversed(self.__class__.__mro__):
-            if isinstance(c, ModelingBase) and hasattr(c, '_callbacks'):
-                for cb in c._callbacks:
-                    cb(self)
+    @classmethod
+    def _provider_template(cls, ignored_keys):
+        '''
+        Return a :class:`ProviderTemplate` for :attr:`__initial_injections__` less *ignored_keys*.  Templates are shared by all instances of a class that end up ignoring the same keys for transclusion, so each instantiation only creates the providers rather than recomputing their keys.  A template is rebuilt if :attr:`__initial_injections__` is changed.
+        '''
+        templates = cls.__dict__.get('_provider_templates')
+        injections = tuple(cls.__initial_injections__.items())
+        if templates is None or templates[0] != injections:
+            templates = (injections, {})
+            cls._provider_templates = templates
+        try:
+            return templates[1][ignored_keys]
+        except KeyError:
+            template = ProviderTemplate()
+            cls._add_initial_injections(template, ignored_keys)
+            templates[1][ignored_keys] = template
+            return template
 
     def __init_subclass__(cls, *args, template=False, **kwargs):
         super().__init_subclass__(*args, **kwargs)
@@ -182,6 +255,26 @@ class NetworkConfigModel(InjectableModel,
 __all__ += ['NetworkConfigModel']
 
 
+def _in_model_order(models):
+    return sorted(models, key=lambda m: str(getattr(m, 'name', None) or type(m).__qualname__))
+
+
+async def _network_inputs(m):
+    # What NetworkConfig.resolve depends on for *m*, or None if unknown.
+    if not isinstance(m, carthage.machine.NetworkedMixin):
+        return None
+    ainjector = m.ainjector if hasattr(m, 'ainjector') else m.injector(AsyncInjector)
+    namespace = await ainjector.get_instance_async(InjectionKey(
+        carthage.machine.network_namespace_key, _optional=True, _ready=False))
+    if namespace is not None and namespace is not m:
+        return None
+    network_config = await ainjector.get_instance_async(InjectionKey(
+        carthage.network.NetworkConfig, _ready=True, _optional=True))
+    if network_config is None:
+        return None
+    return (network_config, network_config.generation)
+
+
 class ModelGroup(ModelContainer, AsyncInjectable):
 
     async def all_models(self, ready=None):
@@ -191,8 +284,21 @@ class ModelGroup(ModelContainer, AsyncInjectable):
             ready=ready)
         return [m[1] for m in models]
 
-    async def resolve_networking(self, force=False):
-        if hasattr(self, 'resolve_networking_models') and not force:
+    async def resolve_networking(self, force=False, *,
+                                 incremental=False,
+                                 concurrency=None,
+                                 progress=None):
+        '''
+        Resolve all the models in the group, including their network links.
+
+        Models are resolved in order of name, with at most *concurrency* (default :ref:`model_concurrency <config>`) resolving at once.  Every model is attempted; failures are logged against their model and the first is raised once all have finished.
+
+        :param incremental: Resolve again even if already resolved, but skip models whose :class:`~carthage.network.NetworkConfig` is the same object with the same links as the last time they were resolved by this group and that still have network links.  Changes to the objects a configuration refers to (for example replacing a :class:`~carthage.network.Network`) are not detected.
+
+        :param progress: Called as ``progress(stage, model, completed, total)`` each time a model finishes; *stage* is ``'resolve'``.
+
+        '''
+        if hasattr(self, 'resolve_networking_models') and not (force or incremental):
             return self.resolve_networking_models
 
         async def await_futures(pending_futures, event, target, **kwargs):
@@ -202,16 +308,30 @@ class ModelGroup(ModelContainer, AsyncInjectable):
             model_tasks = await self.ainjector.filter_instantiate_async(
                 ModelTasks, ['name'],
                 ready=False)
-            self.all_model_tasks = [m[1] for m in model_tasks]
-        models = await self.all_models(ready=False)
+            self.all_model_tasks = _in_model_order([m[1] for m in model_tasks])
+        models = _in_model_order(await self.all_models(ready=False))
+        network_inputs = self.__dict__.setdefault('_network_inputs', {})
+
+        async def resolve(m):
+            inputs = await _network_inputs(m)
+            recorded = network_inputs.get(id(m))
+            unchanged = inputs is not None and recorded is not None \
+                and recorded[0] is m and recorded[1] == inputs
+            if incremental and unchanged and m.network_links:
+                return
+            network_inputs.pop(id(m), None)
+            await m.resolve_model(force or incremental)
+            if inputs is not None:
+                network_inputs[id(m)] = (m, inputs)
+
+        kvstore = self.injector.get_instance(InjectionKey(carthage.kvstore.KvStore, _optional=True))
         with self.injector.event_listener_context(
                 InjectionKey(carthage.network.NetworkConfig), "resolved",
-                await_futures) as event_futures:
-            resolve_model_futures = []
-            for m in models:
-                resolve_model_futures.append(asyncio.ensure_future(m.resolve_model(force)))
-            if resolve_model_futures:
-                await asyncio.gather(*resolve_model_futures)
+                await_futures) as event_futures, \
+                (kvstore.read_snapshot() if kvstore else contextlib.nullcontext()):
+            await self._for_each_model(
+                'resolve', models, resolve,
+                concurrency=concurrency, progress=progress)
         if event_futures:
             await asyncio.gather(*event_futures)
         self.resolve_networking_models = models
@@ -224,25 +344,46 @@ class ModelGroup(ModelContainer, AsyncInjectable):
             pass
         super().close(canceled_futures)
 
-    async def generate(self):
-        async def cb(m):
-            try:
-                await m.async_become_ready()
-            except Exception:
-                logger.exception(f"Error generating for {repr(m)}")
-                raise
-        models = await self.resolve_networking()
-        models += self.all_model_tasks
-        futures = []
-        for m in models:
-            if not isinstance(m, AsyncInjectable):
-                continue
-            futures.append(asyncio.ensure_future(cb(m)))
-        if futures:
-            await asyncio.gather(*futures)
+    async def generate(self, *, concurrency=None, progress=None):
+        '''
+        Resolve networking and then bring every model and :class:`ModelTasks` in the group to ready, in order of name with at most *concurrency* at once.  *progress* is as for :meth:`resolve_networking`, called with *stage* ``'generate'`` for this pass.
+        '''
+        models = await self.resolve_networking(concurrency=concurrency, progress=progress)
+        models = [m for m in models + self.all_model_tasks if isinstance(m, AsyncInjectable)]
+        await self._for_each_model(
+            'generate', models, lambda m: m.async_become_ready(),
+            concurrency=concurrency, progress=progress)
         if hasattr(super(), 'generate'):
             await super().generate()
 
+    async def _for_each_model(self, stage, models, func, *, concurrency, progress):
+        if concurrency is None:
+            concurrency = self.injector(ConfigLayout).model_concurrency
+        workers = min(concurrency, len(models)) if concurrency > 0 else len(models)
+        pending = iter(enumerate(models))
+        results = [None]*len(models)
+        completed = 0
+
+        async def worker():
+            # Each worker takes the next model in order, so at most *workers* calls are in progress.
+            nonlocal completed
+            for i, m in pending:
+                try:
+                    await func(m)
+                except Exception as e:
+                    results[i] = e
+                finally:
+                    completed += 1
+                    if progress:
+                        progress(stage, m, completed, len(models))
+
+        await asyncio.gather(*(worker() for i in range(workers)))
+        failures = [(m, r) for m, r in zip(models, results) if isinstance(r, BaseException)]
+        for m, r in failures:
+            logger.error(f'Error in {stage} for {m!r}', exc_info=r)
+        if failures:
+            raise failures[0][1]
+
     async def async_ready(self):
         await self.resolve_networking()
         return await super().async_ready()
@@ -576,10 +717,11 @@ __all__ += ['CarthageLayout']
 
 @inject(ainjector=AsyncInjector)
 async def instantiate_layout(layout_name=None, *, ainjector, optional=False):
-    if layout_name:
-        layout = await ainjector.get_instance_async(InjectionKey(CarthageLayout, layout_name=layout_name, _optional=optional))
-    else:
-        layout = await ainjector.get_instance_async(InjectionKey(CarthageLayout, _optional=optional))
+    with startup_profile.phase('layout', layout_name or ''):
+        if layout_name:
+            layout = await ainjector.get_instance_async(InjectionKey(CarthageLayout, layout_name=layout_name, _optional=optional))
+        else:
+            layout = await ainjector.get_instance_async(InjectionKey(CarthageLayout, _optional=optional))
     return layout
 
 __all__ += ['instantiate_layout']
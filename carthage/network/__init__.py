@@ -15,8 +15,8 @@ from .mac import random_mac_addr, MacStore, persistent_random_mac, persistent_ra
 
 __all__ += ['random_mac_addr', 'MacStore', 'persistent_random_mac', 'persistent_random_mac_always']
 
-from .namespace import NetworkNamespace
-__all__ += ['NetworkNamespace']
+from .namespace import NetworkNamespace, NamespacePool
+__all__ += ['NetworkNamespace', 'NamespacePool']
 
 from .config import V4Config
 __all__ += ['V4Config']
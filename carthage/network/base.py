@@ -9,15 +9,22 @@
 from __future__ import annotations
 import asyncio
 import abc
+import collections
+import collections.abc
 import copy
 import dataclasses
+import hashlib
+import ipaddress
 import logging
+import os
+import os.path
 import re
 import typing
 import weakref
 from ipaddress import IPv4Address
 from .. import sh
 from ..dependency_injection import *
+from ..dependency_injection import is_obj_ready
 from ..config import ConfigLayout
 from ..utils import permute_identifier, when_needed, memoproperty, is_optional_type, get_type_args
 import carthage.kvstore
@@ -67,6 +74,115 @@ def if_name(type_prefix, layout, net, host=""):
     assert False  # never should be reached
 
 
+class IpCommandFailed(RuntimeError):
+
+    '''
+    An ``ip`` operation run through :class:`IpBatcher` failed.  *command* is the list of arguments to ``ip`` and *message* is what ``ip`` reported for that operation.
+    '''
+
+    def __init__(self, command, message):
+        self.command = command
+        self.message = message
+        super().__init__(f'ip {" ".join(command)}: {message}')
+
+    @property
+    def exists(self):
+        "True if the failure is because the object being created already exists."
+        return 'exists' in self.message.lower()
+
+
+class IpBatcher:
+
+    '''
+    Coalesce ``ip`` operations into ``ip -force -batch`` invocations.
+
+    Operations submitted with :meth:`run` within :attr:`window` seconds of each other are run by one ``ip`` process, in submission order.  ``-force`` keeps ``ip`` going after a failing line, and the failures it reports are attributed back to the individual operations, which raise :class:`IpCommandFailed`.  Operations are fire and forget as far as output is concerned; use ``sh.ip`` directly when the output is needed.
+
+    '''
+
+    #: Seconds to wait for further operations before running a batch
+    window: float = 0.002
+
+    _failure_re = re.compile(r'^Command failed -:(\d+)$')
+
+    def __init__(self):
+        self.pending = []
+        self.flush_task = None
+
+    def run(self, *args):
+        '''
+        Queue ``ip`` with *args*.
+
+        :returns: A future that completes when the operation has run.
+        '''
+        args = [str(a) for a in args]
+        if any('\n' in a for a in args):
+            raise ValueError('ip arguments may not contain newlines')
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((args, future))
+        if self.flush_task is None or self.flush_task.get_loop() is not loop:
+            self.flush_task = loop.create_task(self._flush_later())
+        return future
+
+    async def run_sequence(self, *commands):
+        '''
+        Queue each of *commands*, a sequence of argument lists, and wait for all of them.  If any fail, raise the first failure.
+        '''
+        results = await asyncio.gather(
+            *(self.run(*c) for c in commands),
+            return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+
+    async def _flush_later(self):
+        batch = None
+        try:
+            await asyncio.sleep(self.window)
+            batch, self.pending = self.pending, []
+            self.flush_task = None
+            await self._run_batch(batch)
+        finally:
+            if batch is None:
+                # Cancelled while waiting for the window; nothing else will run the queued operations.
+                batch, self.pending = self.pending, []
+                if self.flush_task is asyncio.current_task():
+                    self.flush_task = None
+            for args, future in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def _run_batch(self, batch):
+        script = ''.join(' '.join(args)+'\n' for args, future in batch)
+        try:
+            result = await sh.ip('-force', '-batch', '-', _in=script, _ok_code=range(256))
+        except Exception as e:
+            for args, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        failures = {}
+        message = []
+        for line in str(result.stderr, 'utf-8', 'replace').splitlines():
+            if m := self._failure_re.match(line):
+                failures[int(m.group(1))] = '\n'.join(message)
+                message = []
+            else:
+                message.append(line)
+        for line_number, (args, future) in enumerate(batch, start=1):
+            if future.done():
+                continue
+            if line_number in failures:
+                future.set_exception(IpCommandFailed(args, failures[line_number]))
+            else:
+                future.set_result(None)
+
+
+#: The :class:`IpBatcher` used by :class:`BridgeNetwork`
+ip_batcher = IpBatcher()
+
+
 @dataclasses.dataclass
 class NetworkInterface:
 
@@ -83,9 +199,10 @@ class NetworkInterface:
             return
         if self.delete_interface:
             self.delete_networking()
+        _allocated_interfaces.discard(self.ifname)
         self.closed = True
 
-    def delete_networking():
+    def delete_networking(self):
         try:
             sh.ip("link", "del", self.ifname, _bg=False)
         except sh.ErrorReturnCode:
@@ -255,6 +372,7 @@ class BridgeNetwork(TechnologySpecificNetwork):
         self.delete_bridge = delete_bridge
         self.name = net.name
         self.interfaces = weakref.WeakValueDictionary()
+        self._allocated_bridge_name = bridge_name is None
         if bridge_name is None:
             self.bridge_name = if_name('br', self.config_layout.container_prefix, self.name)
         else:
@@ -266,26 +384,35 @@ class BridgeNetwork(TechnologySpecificNetwork):
         if delete_interfaces is None:
             delete_interfaces = not self.config_layout.persist_local_networking
         self.delete_interfaces = delete_interfaces
+        self.veth_pool = None
 
     async def async_ready(self):
         try:
-            sh.ip('link', 'show', self.bridge_name, _bg=False)
-        except sh.ErrorReturnCode_1:
-            sh.ip('link', 'add', self.bridge_name, 'type', 'bridge', _bg=False)
-            sh.ip("link", "set", self.bridge_name,
-                  "type", "bridge", "stp_state", "1",
-                  "forward_delay", "3", _bg=False)
-            sh.ip("link", "set", self.bridge_name, "up", _bg=False)
+            await ip_batcher.run('link', 'show', self.bridge_name)
+        except IpCommandFailed:
+            await ip_batcher.run_sequence(
+                ['link', 'add', self.bridge_name, 'type', 'bridge'],
+                ["link", "set", self.bridge_name,
+                 "type", "bridge", "stp_state", "1",
+                 "forward_delay", "3"],
+                ["link", "set", self.bridge_name, "up"])
+        if self.config_layout.network_pool_size > 0:
+            self.veth_pool = VethPool(self, self.config_layout.network_pool_size)
         return await super().async_ready()
 
     def close(self):
         if self.closed:
             return
+        if self.veth_pool:
+            self.veth_pool.close()
+            self.veth_pool = None
         self.members.clear()
         if self.delete_interfaces:
             self.delete_networking()
         self.closed = True
         self.interfaces.clear()
+        if self._allocated_bridge_name:
+            _allocated_interfaces.discard(self.bridge_name)
 
     def delete_networking(self):
         # Copy the list because we will mutate
@@ -303,13 +430,22 @@ class BridgeNetwork(TechnologySpecificNetwork):
         self.close()
 
     def add_member(self, interface):
+        '''
+        Add *interface* to the bridge.  This blocks until ``ip`` completes; from a coroutine prefer :meth:`async_add_member`, which batches the operation with others.
+        '''
         sh.ip("link", "set",
               interface.ifname,
               "master", self.bridge_name, "up", _bg=False)
         # We also keep a reference so that if it is a weak interface off another object it is not GC'd
         self.members.append(interface)
 
-    def add_veth(self, link, namespace):
+    async def async_add_member(self, interface):
+        await ip_batcher.run("link", "set",
+                             interface.ifname,
+                             "master", self.bridge_name, "up")
+        self.members.append(interface)
+
+    def _veth_args(self, link, namespace):
         bridge_member = if_name('ci', self.config_layout.container_prefix, self.name, link.machine.name)
         args = []
         if link.mtu:
@@ -320,6 +456,18 @@ class BridgeNetwork(TechnologySpecificNetwork):
         args.extend(['name', link.interface])
         args.extend(['netns', namespace.name])
         logger.debug('Network {} creating virtual ethernet for {}'.format(self.name, link.machine.name))
+        return bridge_member, args
+
+    def _add_veth_interface(self, link, bridge_member):
+        ve = VethInterface(network=self, ifname=bridge_member, internal_name=link.interface, delete_interface=False)
+        self.interfaces[bridge_member] = ve
+        return ve
+
+    def add_veth(self, link, namespace):
+        '''
+        Create a veth pair with one end in the bridge and the other in *namespace*.  This blocks until ``ip`` completes and does not use the :class:`VethPool`; from a coroutine prefer :meth:`async_add_veth`.
+        '''
+        bridge_member, args = self._veth_args(link, namespace)
         try:
             sh.ip('link', 'add', 'dev', bridge_member,
                   *args, _bg=False)
@@ -327,26 +475,163 @@ class BridgeNetwork(TechnologySpecificNetwork):
             logger.warn("Network {}: {} appears to exist; deleting".format(self.name, bridge_member))
             sh.ip('link', 'del', bridge_member, _bg=False)
             sh.ip('link', 'add', 'dev', bridge_member,
-                  *args)
+                  *args, _bg=False)
         sh.ip('link', 'set', bridge_member, 'master', self.bridge_name, 'up', _bg=False)
-        ve = VethInterface(network=self, ifname=bridge_member, internal_name=link.interface, delete_interface=False)
-        self.interfaces[bridge_member] = ve
-        return ve
+        return self._add_veth_interface(link, bridge_member)
+
+    async def async_add_veth(self, link, namespace):
+        if self.veth_pool:
+            ve = await self.veth_pool.attach(link, namespace)
+            if ve: return ve
+        bridge_member, args = self._veth_args(link, namespace)
+        try:
+            await ip_batcher.run('link', 'add', 'dev', bridge_member, *args)
+        except IpCommandFailed as e:
+            if not e.exists:
+                raise
+            logger.warn("Network {}: {} appears to exist; deleting".format(self.name, bridge_member))
+            await ip_batcher.run_sequence(
+                ['link', 'del', bridge_member],
+                ['link', 'add', 'dev', bridge_member, *args])
+        await ip_batcher.run('link', 'set', bridge_member, 'master', self.bridge_name, 'up')
+        return self._add_veth_interface(link, bridge_member)
+
+    def _vlan_args(self, ifname, id):
+        return ["link", "add",
+                "link", self.bridge_name,
+                "name", ifname,
+                "type", "vlan",
+                "id", id]
 
     def expose_vlan(self, id):
+        '''
+        Create a VLAN interface for *id* on the bridge.  This blocks until ``ip`` completes; from a coroutine prefer :meth:`async_expose_vlan`.
+        '''
         iface = VlanInterface(id, self)
         ifname = iface.ifname
         try:
-            sh.ip("link", "add",
-                  "link", self.bridge_name,
-                  "name", ifname,
-                  "type", "vlan",
-                  "id", id, _bg=False)
+            sh.ip(*self._vlan_args(ifname, id), _bg=False)
         except sh.ErrorReturnCode_2:
             logger.warn("{} appears to already exist".format(ifname))
         self.interfaces[ifname] = iface
         return iface
 
+    async def async_expose_vlan(self, id):
+        iface = VlanInterface(id, self)
+        ifname = iface.ifname
+        try:
+            await ip_batcher.run(*self._vlan_args(ifname, id))
+        except IpCommandFailed as e:
+            if not e.exists:
+                raise
+            logger.warn("{} appears to already exist".format(ifname))
+        self.interfaces[ifname] = iface
+        return iface
+
+
+class VethPool:
+
+    '''Veth pairs created ahead of need for a :class:`BridgeNetwork`.  The bridge side of each pair is already a member of the bridge and up; the other side waits in the root namespace under a temporary name.  :meth:`attach` moves a waiting end into a namespace, renaming it and setting its MAC and MTU, in one ``ip link set``.  The pool refills in the background and unused pairs are deleted on :meth:`close`.
+    '''
+
+    def __init__(self, bridge, size):
+        self.bridge = bridge
+        self.size = size
+        self.available = collections.deque()
+        self.closed = False
+        self._refill_task = None
+        # Pooled interfaces are not tied to a host, so they are named from a random token and a counter rather than with if_name.
+        self._token = os.urandom(3).hex()
+        self._counter = 0
+        self.refill()
+
+    def _name(self, type_prefix):
+        while True:
+            self._counter += 1
+            name = f'{type_prefix}{self._token}{self._counter:x}'
+            if len(name) > 15:
+                self._token = os.urandom(3).hex()
+                self._counter = 0
+                continue
+            if name in _allocated_interfaces or os.path.exists(f'/sys/class/net/{name}'):
+                continue
+            _allocated_interfaces.add(name)
+            return name
+
+    def refill(self):
+        if self.closed: return
+        if self._refill_task and not self._refill_task.done(): return
+        if len(self.available) >= self.size: return
+        self._refill_task = asyncio.ensure_future(self._refill())
+
+    async def _refill(self):
+        bridge = self.bridge
+        while not self.closed and len(self.available) < self.size:
+            host = self._name('cp')
+            peer = self._name('cq')
+            try:
+                await ip_batcher.run_sequence(
+                    ['link', 'add', 'dev', host, 'type', 'veth', 'peer', 'name', peer],
+                    ['link', 'set', host, 'master', bridge.bridge_name, 'up'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception('Error adding pooled veth for %s', bridge.name)
+                # Only delete the pair if this pool created it; a failed add may be an interface that is in use.
+                if not (isinstance(e, IpCommandFailed) and e.command[:2] == ['link', 'add']):
+                    self._delete(host, peer)
+                else:
+                    _allocated_interfaces.difference_update((host, peer))
+                return
+            if self.closed:
+                self._delete(host, peer)
+                return
+            self.available.append((host, peer))
+
+    async def attach(self, link, namespace):
+        '''Move a pooled pair into *namespace* for *link*.
+
+        :returns: The :class:`VethInterface` or None if the pool is empty or the pair could not be used, in which case the caller creates one itself.
+        '''
+        try: host, peer = self.available.popleft()
+        except IndexError: return None
+        finally: self.refill()
+        args = ['link', 'set', 'dev', peer, 'netns', namespace.name, 'name', link.interface]
+        if link.mac:
+            args.extend(['address', str(link.mac)])
+        commands = [args]
+        if link.mtu:
+            args.extend(['mtu', link.mtu])
+            commands.append(['link', 'set', host, 'mtu', link.mtu])
+        try:
+            await ip_batcher.run_sequence(*commands)
+        except IpCommandFailed:
+            logger.debug('Unable to use pooled veth %s for %s', host, link.interface, exc_info=True)
+            self._delete(host, peer)
+            return None
+        # The peer now has the link's name within the namespace
+        _allocated_interfaces.discard(peer)
+        logger.debug('Network %s using pooled veth %s for %s', self.bridge.name, host, link.machine.name)
+        ve = VethInterface(network=self.bridge, ifname=host, internal_name=link.interface, delete_interface=False)
+        self.bridge.interfaces[host] = ve
+        return ve
+
+    @staticmethod
+    def _delete(host, peer):
+        try:
+            sh.ip('link', 'del', host, _bg=False)
+        except sh.ErrorReturnCode:
+            pass
+        _allocated_interfaces.difference_update((host, peer))
+
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        if self._refill_task and not self._refill_task.done():
+            self._refill_task.cancel()
+        while self.available:
+            self._delete(*self.available.popleft())
+
 
 @dataclasses.dataclass
 class VethInterface(NetworkInterface):
@@ -363,6 +648,27 @@ class VethInterface(NetworkInterface):
         super().close()
 
 
+def _shared_network(injector, value):
+    '''If *value* is an :class:`InjectionKey` or :class:`~carthage.modeling.injector_access` naming a :class:`Network` that has already been instantiated where it is provided, return that network.
+
+    Networks are typically provided once at the layout or enclave level and shared by thousands of machines.  The first link to resolve the network instantiates it through the injector; every later link finds the instance recorded on the providing injector and skips a round trip through :func:`resolve_deferred`.  Because the instance is looked up in the injector each time rather than remembered separately, replacing the provider is seen immediately.  Returns None when the normal resolution path is needed.
+    '''
+    if isinstance(value, InjectionKey):
+        key = value
+    else:
+        from ..modeling.decorators import injector_access
+        if not isinstance(value, injector_access): return None
+        key = value.key
+    try: provider, target = injector._get_parent(key)
+    except KeyError: return None
+    if provider.allow_multiple: return None
+    instance = provider.provider
+    if isinstance(instance, dependency_quote): instance = instance.value
+    if not isinstance(instance, Network): return None
+    if not (key.ready is False or is_obj_ready(instance)): return None
+    return instance
+
+
 class NetworkConfig:
 
     '''Represents a network configuration for a :class:`~carthage.machine.Machine`.  A network config maps interface names to a network alink.  A network link contains a MAC address, a network, and other information.  Eventually a MAC is represented as a string and a
@@ -375,6 +681,9 @@ class NetworkConfig:
 
     '''
 
+    #: Incremented each time a link is added, so callers can tell whether the configuration has changed.
+    generation = 0
+
     def __init__(self):
         self.link_specs = {}
 
@@ -384,6 +693,7 @@ class NetworkConfig:
         kwargs['net'] = net
         NetworkLink.validate(kwargs, unresolved=True)
         self.link_specs[interface] = kwargs
+        self.generation += 1
 
     def __repr__(self):
         res = f'<{self.__class__.__name__}  {repr(self.link_specs)}>'
@@ -493,6 +803,10 @@ class NetworkConfig:
                     or isinstance(v, InjectionKey)
                     or isinstance(v, list)
                 ):
+                    shared = _shared_network(ainjector.injector, v)
+                    if shared is not None:
+                        link_args[k] = shared
+                        continue
                     futures.append(asyncio.ensure_future(resolve1(v, i, link_args, k)))
                 else:
                     link_args[k] = v
@@ -953,10 +1267,65 @@ def access_ssh_origin(ssh_origin, ssh_origin_vrf=None, extra_nsenter=[]):
                            *vrf)
 
 
-def hash_network_links(network_links: dict[str, NetworkLink]):
+def hash_network_links(network_links: dict[str, NetworkLink], previous: str = None):
     '''
     Return a hash value suitable for determining whether network_links have changed in setup_tasks.
+
+    The result is a hex digest of a canonical rendering of the links, so it is stable across runs and independent of the order links were added, but unlike a sum of characters it changes when values are merely permuted between links or attributes.
+
+    :param previous: The hash stored in the task's stamp, if any.  Stamps written by earlier versions hold a sum of characters instead.  If *previous* is that legacy hash of *network_links*, it is returned unchanged, so upgrading does not by itself rerun tasks keyed on this hash.
 '''
+    if previous and previous == str(_legacy_hash_network_links(network_links)):
+        return previous
+    digest = hashlib.blake2b(digest_size=16)
+
+    def hash_subitem(i):
+        if i is None:
+            digest.update(b'N;')
+        elif isinstance(i, (str, int, float,
+                            ipaddress.IPv4Address, ipaddress.IPv4Network,
+                            ipaddress.IPv6Address, ipaddress.IPv6Network)):
+            digest.update(bytes(f'{type(i).__name__}:{i};', 'utf-8'))
+        elif isinstance(i, dict):
+            digest.update(b'{')
+            for k in sorted(i, key=str):
+                hash_subitem(k)
+                hash_subitem(i[k])
+            digest.update(b'}')
+        elif isinstance(i, (set, frozenset)):
+            hash_subitem(sorted(i, key=repr))
+        elif isinstance(i, (list, tuple, collections.abc.KeysView, collections.abc.ValuesView)):
+            digest.update(b'[')
+            for v in i:
+                hash_subitem(v)
+            digest.update(b']')
+        # Other objects (models, links) have no stable rendering and are skipped.
+
+    for k in sorted(network_links):
+        v = network_links[k]
+        hash_subitem(k)
+        hash_subitem(v.net.name)
+        hash_subitem(v.mac)
+        hash_subitem(v.machine.name if v.machine else None)
+        hash_subitem(v.mtu)
+        # Do not include public_v4_address because it tends to change regularly
+        if v.allowed_vlans:
+            hash_subitem(VlanList.canonicalize(v.allowed_vlans, v))
+        hash_subitem(v.untagged_vlan)
+        if v.v4_config:
+            hash_subitem({k: val for k, val in v.v4_config.__dict__.items()
+                          if k != 'public_address'})
+        for attr in ('speed', 'portchannel_member', 'breakout_mode'):
+            hash_subitem(getattr(v, attr, ''))
+        try:
+            hash_subitem(v.members)
+        except AttributeError:
+            pass
+    return digest.hexdigest()
+
+
+def _legacy_hash_network_links(network_links):
+    # The hash used before hash_network_links switched to a digest; kept to recognize existing stamps.
     def hash_subitem(i):
         result = 0
         if i is None:
@@ -985,7 +1354,6 @@ def hash_network_links(network_links: dict[str, NetworkLink]):
             result += hash_subitem(v.machine.name)
         if v.mtu:
             result += v.mtu
-        # Do not include public_v4_address because it tends to change regularly
         if v.allowed_vlans:
             result += hash_subitem(VlanList.canonicalize(v.allowed_vlans, v))
         if v.untagged_vlan:
@@ -1008,6 +1376,8 @@ NetworkConfig NetworkLink
 VlanList collect_vlans
 hash_network_links
 this_network
+IpBatcher IpCommandFailed
+VethPool
     '''.split()
 @inject_autokwargs(
     injector=Injector,
@@ -1069,14 +1439,19 @@ class V4Pool(carthage.kvstore.HashedRangeAssignments):
         return f'{link.machine.name}|{link.interface}'
 
     def assignment_loop(self, links):
+        forced = []
+        to_assign = []
         for link in links:
             bounds = self.find_bounds(link)
             if not bounds: continue
             key = self.link_key(link)
             if link.v4_config and link.v4_config.address:
-                self.force_assignment(key, link, link.v4_config.address)
+                forced.append((key, link, link.v4_config.address))
             else:
-                self._assign(key, link)
+                to_assign.append((key, link))
+        # Statically addressed links are recorded first so dynamic
+        # assignments never collide with them.
+        self.assign_many(to_assign, forced=forced)
 
     def str_to_assignment(self, assignment):
         return IPv4Address(assignment)
@@ -1086,10 +1461,27 @@ class V4Pool(carthage.kvstore.HashedRangeAssignments):
     
 __all__ += ['V4Pool']
 
+class LinkIndex:
+
+    '''An index of a machine's links by MAC address and by IPv4 address for use with :func:`match_link`.  When matching many interfaces against the same links, build the index once and pass it to each call rather than letting each call scan every link.
+    '''
+
+    def __init__(self, links: dict[str, NetworkLink]):
+        self.links = links
+        self.by_mac = {}
+        self.by_address = {}
+        for link in links.values():
+            if link.mac is not None:
+                self.by_mac.setdefault(link.mac, []).append(link)
+            address = link.merged_v4_config.address
+            if address is not None:
+                self.by_address.setdefault(address, []).append(link)
+
+
 def match_link(links: dict[str,NetworkLink], 
                interface, *,
                mac=None, net:Network=None, address=None,
-               excluded_links=None):
+               excluded_links=None, index:LinkIndex=None):
     '''Attempt to find the :class:`NetworkLink` corresponding to an interface on a VM.
     Ideally, links can be matched by name.  However, not all :class:`~carthage.machine.Machine` implementations will preserve link names in all situations.
 
@@ -1110,6 +1502,8 @@ def match_link(links: dict[str,NetworkLink],
     If a matching link is found and *excluded_links* is specified, it
     will be added to *excluded_links*.  That way, when this function
     is used in a a loop, links are matched at most once.
+
+    :param index: A :class:`LinkIndex` of *links*.  If not supplied, one is built only if MAC or address matching is needed.
     '''
     def compatible(a,b):
         if a is None or b is None: return True
@@ -1124,18 +1518,18 @@ def match_link(links: dict[str,NetworkLink],
     if match:
         if not (compatible(match.mac, mac) and compatible(match.net, net)):
             match = None
-    # if we did not find a match,  enumerate if we have a mac address
+    if match is None and (mac is not None or address is not None) and index is None:
+        index = LinkIndex(links)
+    # if we did not find a match,  look up by mac address
     if mac is not None and match is None:
-        for match in links.values():
+        for match in index.by_mac.get(mac, ()):
             if match.interface in excluded_links: continue
-            if match.mac != mac: continue
             if compatible(match.net, net): break
         else: match = None
     # Now try address matching
     if match is None and address is not None:
-        for match in links.values():
+        for match in index.by_address.get(address, ()):
             if match.interface in excluded_links: continue
-            if match.merged_v4_config.address != address: continue
             if compatible(mac, match.mac) and compatible(net, match.net): break
         else: match = None
     if match:
@@ -1144,7 +1538,7 @@ def match_link(links: dict[str,NetworkLink],
                  interface, mac, net, address, match)
     return match
 
-__all__ += ['match_link']
+__all__ += ['LinkIndex', 'match_link']
 
 def shared_network_links(m1, m2):
     for l1 in m1.values():
@@ -8,13 +8,14 @@
 
 import collections.abc
 import contextlib
+import hashlib
 import os
 import random
-import yaml
 from pathlib import Path
 from ..dependency_injection import *
 from ..config import ConfigLayout
 import carthage.kvstore
+from ..utils import yaml_load
 
 
 def random_mac_addr():
@@ -42,23 +43,46 @@ class MacStore(Injectable):
         self.config_layout = self.injector(ConfigLayout)
         state_dir = Path(self.config_layout.state_dir)
         self.path = state_dir / "macs.yml"
-        self.domain = self.kvstore.domain('mac', True)
+        # Persistent MAC lookups repeat heavily while a layout resolves networking.
+        self.domain = self.kvstore.domain('mac', True, cached=True)
+        self.sources = self.kvstore.domain('mac/sources', False)
+        self.imported = self.kvstore.domain('mac/imported', False)
         self.load()
         
 
     def load(self):
+        '''Import :attr:`path` (``macs.yml`` in the state directory) into the store.  The file's modification time, size and digest are recorded in the store; if they are unchanged since the last import, the file is not read again.  The value imported for each entry is also recorded.  When the file changes, only entries whose value in the file differs from the last import are written, all in one transaction, so values changed in the store since then are kept unless the file changes them too.
+        '''
         def recurse(current, base_key):
             for k, v in current.items():
                 if isinstance(v, dict):
                     recurse(v, base_key + (k,))
                 else:
-                    self[base_key + (k,)] = v
-
-        if self.path.exists():
-            yaml_dict = yaml.safe_load(self.path.read_text())
-            assert isinstance(yaml_dict, dict)
-            recurse(yaml_dict, tuple())
-
+                    entries[self.handle_tuple_key(base_key + (k,))] = v
+
+        try: stat = self.path.stat()
+        except FileNotFoundError: return
+        source_key = str(self.path)
+        stamp = f'{stat.st_mtime_ns} {stat.st_size}'
+        recorded = self.sources.get(source_key)
+        if recorded:
+            recorded_stamp, _, recorded_digest = recorded.rpartition(' ')
+            if recorded_stamp == stamp: return
+        else: recorded_digest = None
+        contents = self.path.read_bytes()
+        digest = hashlib.sha256(contents).hexdigest()
+        with self.kvstore.transaction():
+            if digest != recorded_digest:
+                yaml_dict = yaml_load(contents)
+                assert isinstance(yaml_dict, dict)
+                entries = {}
+                recurse(yaml_dict, tuple())
+                imported = self.imported.get_many(entries.keys())
+                changed = {k: v for k, v in entries.items() if imported[k] != v}
+                if changed:
+                    self.domain.put_many(changed, overwrite=True)
+                    self.imported.put_many(changed, overwrite=True)
+            self.sources.put(source_key, f'{stamp} {digest}', overwrite=True)
 
     def __contains__(self, k):
         k = self.handle_tuple_key(k)
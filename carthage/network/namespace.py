@@ -7,9 +7,12 @@
 # LICENSE for details.
 
 from __future__ import annotations
+import asyncio
+import collections
 import dataclasses
 import typing
 from ..dependency_injection import *
+from ..config import ConfigLayout
 from .base import NetworkInterface, logger, NetworkLink, BridgeNetwork, VethInterface
 from .. import sh
 
@@ -19,8 +22,12 @@ class NetworkNamespace:
 
     name: str
     network_links: typing.Dict[str, NetworkLink]
+    #: If True, the namespace already exists (for example it came from a :class:`NamespacePool`) and is adopted rather than created.
+    existing: bool = False
 
     def __post_init__(self):
+        self.closed = False
+        if self.existing: return
         logger.debug("Bringing up network namespace for %s", self.name)
         try:
             sh.ip(
@@ -29,12 +36,11 @@ class NetworkNamespace:
         except sh.ErrorReturnCode_1:  # link exists
             sh.ip("netns", "delete", self.name)
             sh.ip("netns", "add", self.name)
-        self.closed = False
 
     async def start_networking(self):
         for interface, link in self.network_links.items():
             net = await link.instantiate(BridgeNetwork)
-            veth = net.add_veth(link, self)
+            veth = await net.async_add_veth(link, self)
 
     def close(self):
         if self.closed:
@@ -45,3 +51,70 @@ class NetworkNamespace:
             sh.ip("netns", "delete", self.name)
         except sh.ErrorReturnCode:
             logger.exception("Error deleting network namespace")
+
+
+@inject_autokwargs(config_layout=ConfigLayout)
+class NamespacePool(Injectable):
+
+    '''Network namespaces created ahead of need so that starting a container does not wait on ``ip netns add``.  Up to *size* (by default the *network_pool_size* config setting) namespaces are kept ready, and the pool refills in the background as they are taken.  Namespaces still in the pool are deleted when the pool is closed, which happens when the injector providing it closes.
+    '''
+
+    def __init__(self, size=None, **kwargs):
+        super().__init__(**kwargs)
+        if size is None:
+            size = self.config_layout.network_pool_size
+        self.size = size
+        self.available = collections.deque()
+        self.closed = False
+        self._refill_task = None
+        self._counter = 0
+        self.refill()
+
+    def take(self, network_links) -> NetworkNamespace | None:
+        ''':returns: A :class:`NetworkNamespace` for *network_links* using a namespace from the pool, or None if the pool is empty.
+        '''
+        try: name = self.available.popleft()
+        except IndexError: name = None
+        self.refill()
+        if name is None: return None
+        return NetworkNamespace(name, network_links, existing=True)
+
+    def refill(self):
+        if self.closed or self.size <= 0: return
+        if self._refill_task and not self._refill_task.done(): return
+        if len(self.available) >= self.size: return
+        try: asyncio.get_running_loop()
+        except RuntimeError: return
+        self._refill_task = asyncio.ensure_future(self._refill())
+
+    async def _refill(self):
+        while not self.closed and len(self.available) < self.size:
+            self._counter += 1
+            name = f'{self.config_layout.container_prefix}pool-{id(self):x}-{self._counter}'
+            try:
+                await sh.ip('netns', 'add', name)
+            except sh.ErrorReturnCode:
+                logger.exception('Error adding pooled network namespace %s', name)
+                return
+            if self.closed:
+                self._delete(name)
+                return
+            self.available.append(name)
+
+    @staticmethod
+    def _delete(name):
+        try:
+            sh.ip('netns', 'delete', name, _bg=False)
+        except sh.ErrorReturnCode:
+            logger.debug('Error deleting pooled network namespace %s', name)
+
+    def close(self, canceled_futures=None):
+        if self.closed: return
+        self.closed = True
+        if self._refill_task and not self._refill_task.done():
+            self._refill_task.cancel()
+            if canceled_futures is not None:
+                canceled_futures.append(self._refill_task)
+        while self.available:
+            self._delete(self.available.popleft())
+        super().close(canceled_futures)
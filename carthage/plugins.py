@@ -7,15 +7,19 @@
 # LICENSE for details.
 
 from __future__ import annotations
+import concurrent.futures
+import copy
 import dataclasses
+import functools
 import importlib
+import json
 import logging
+import os
 import re
 import sh #Not carthage sh
 import sys
 import types
 import typing
-import yaml
 from pathlib import Path
 from importlib.util import spec_from_file_location, module_from_spec, find_spec
 from typing import Union
@@ -23,6 +27,8 @@ from urllib.parse import urlparse
 from .dependency_injection import *
 from .config import ConfigLayout
 from .files import checkout_git_repo
+from .profiling import startup_profile
+from .utils import yaml_load, yaml_dump
 
 
 logger = logging.getLogger('carthage.plugins')
@@ -190,8 +196,19 @@ def load_plugin(spec: plugin_spec,
 
     * A ``git+ssh`` URL to a git repository
 
+    * A dict with *type* ``git``, a *url*, and optionally a *branch* or a *revision*.  If *revision* (a commit or tag) is given, the checkout is pinned to it and the remote is only contacted if that revision is not already available locally.
+
     :param ignore_import_errors:  If True, succeed and register the plugin even if the python code raises.  This is intended to allow the plugin to be loaded so its metadata can be examined to determine dependencies.  Obviously the plugin is unlikely to be functional in such a state.
     '''
+    with startup_profile.phase('plugin', _describe_spec(spec)):
+        return _load_plugin(spec, injector=injector, ignore_import_errors=ignore_import_errors)
+
+def _describe_spec(spec):
+    if isinstance(spec, dict):
+        return spec.get('url') or spec.get('path') or spec.get('name') or str(spec)
+    return str(spec)
+
+def _load_plugin(spec, *, injector, ignore_import_errors):
     spec = _parse_plugin_spec(spec)
     orig_spec = spec
     plugin_mappings = injector.get_instance(PluginMappings)
@@ -222,7 +239,7 @@ def handle_path_url(spec: dict, injector, ignore_import_errors):
     metadata_path = path / "carthage_plugin.yml"
     if not metadata_path.exists():
         raise FileNotFoundError(f'{metadata_path} not found')
-    metadata = yaml.safe_load(metadata_path.read_text())
+    metadata = _read_plugin_metadata(metadata_path)
     if 'resource_dir' not in metadata:
         metadata['resource_dir'] = path
     if 'name' not in metadata:
@@ -278,7 +295,8 @@ def handle_module_spec(injector, *, module_spec, metadata, ignore_import_errors,
                     setattr(parent_module, stem, package)
 
                 sys.modules[module_name] = package
-                module_spec.loader.exec_module(package)
+                with startup_profile.phase('import', module_name):
+                    module_spec.loader.exec_module(package)
             except BaseException as e:
                 try: del sys.modules[module_name]
                 except KeyError: pass
@@ -293,43 +311,219 @@ def handle_module_spec(injector, *, module_spec, metadata, ignore_import_errors,
                     import_error=import_error, config_handled=True)
 
 def handle_git_url(spec, injector):
-    parsed = urlparse(spec['url'])
     config = injector(ConfigLayout)
-    branch = spec.get('branch', None)
-    stem = Path(parsed.path).name
+    dest = _git_checkout_dir(spec, Path(config.checkout_dir))
+    _managed_checkouts.add(dest.resolve())
+    fetched_key = (dest, spec.get('branch'), spec.get('revision'))
+    if fetched_key in _fetched_checkouts:
+        return dest
+
+    def clone(url, dest, branch):
+        injector(checkout_git_repo, url, dest, branch=branch, shallow=True, foreground=True)
+    _update_git_checkout(spec, dest, pull=config.pull_plugins, clone=clone)
+    _fetched_checkouts.add(fetched_key)
+    return dest
+
+#: (checkout, branch, revision) already updated by this process, which need not be pulled again.
+_fetched_checkouts: set[tuple] = set()
+
+#: Checkouts Carthage manages under *checkout_dir*; metadata is only cached inside their ``.git``.
+_managed_checkouts: set[Path] = set()
+
+def _git_checkout_dir(spec, checkout_dir):
+    stem = Path(urlparse(spec['url']).path).name
     if stem.endswith('.git'):
         stem = stem[:-4]
-    dest = Path(config.checkout_dir) / stem
+    return checkout_dir / stem
+
+def _update_git_checkout(spec, dest, *, pull, clone, git=None):
+    # Only uses git and the filesystem so that prefetch_plugins can
+    # call it from worker threads.
+    git = git or sh.git
+    url = urlparse(spec['url']).geturl()
+    branch = spec.get('branch', None)
+    revision = spec.get('revision', None)
     # .git can be a symlink or can be a pointer file (for
     # submodules). Especially in the submodule case, we do not want to
     # pull; if someone goes to the trouble of setting up submodules,
     # we respect that.
     if dest.is_dir() and dest.joinpath('.git').is_dir():
-        if not config.pull_plugins:
-            return dest
+        if revision:
+            # A pinned revision never needs the remote once present.
+            if not _revision_checked_out(dest, revision, git):
+                _checkout_revision(url, dest, revision, git)
+            return
+        if not pull:
+            return
         if branch:
-            current_branch = str(sh.git('branch', '--show-current', _cwd=dest)).strip()
+            current_branch = str(git('branch', '--show-current', _cwd=dest)).strip()
             if branch != current_branch:
                 logger.info('Switching %s to %s', dest, branch)
                 try:
-                    sh.git('switch', branch, _cwd=dest)
+                    git('switch', branch, _cwd=dest)
                 except sh.ErrorReturnCode:
                     logger.debug('creating branch %s', branch)
-                    sh.git('fetch', parsed.geturl(), branch, _cwd=dest)
-                    sh.git('switch', '-c', branch, 'FETCH_HEAD', _cwd=dest)
-                    return dest
+                    git('fetch', url, branch, _cwd=dest)
+                    git('switch', '-c', branch, 'FETCH_HEAD', _cwd=dest)
+                    return
         logger.info('Pulling %s', dest)
         if branch:
             branch_opt = (branch,)
         else:
             branch_opt = tuple()
-        sh.git('pull', '-q', '--ff-only', parsed.geturl(), *branch_opt, _cwd=dest)
-        return dest
+        git('pull', '-q', '--ff-only', url, *branch_opt, _cwd=dest)
+        return
     elif dest.exists():
-        return dest
-    logger.info(f'Checking out {parsed.geturl()}')
-    injector(checkout_git_repo, parsed.geturl(), dest, branch=branch, shallow=True, foreground=True)
-    return dest
+        return
+    logger.info(f'Checking out {url}')
+    clone(url, dest, branch)
+    if revision:
+        _checkout_revision(url, dest, revision, git)
+
+def _revision_checked_out(dest, revision, git=None):
+    git = git or sh.git
+    try:
+        head, pinned = str(git('rev-parse', 'HEAD', f'{revision}^{{commit}}', _cwd=dest)).split()
+    except sh.ErrorReturnCode:
+        return False
+    return head == pinned
+
+def _checkout_revision(url, dest, revision, git=None):
+    git = git or sh.git
+    logger.info('Checking out %s at %s', dest, revision)
+    try:
+        git('checkout', '-q', '--detach', revision, _cwd=dest)
+        return
+    except sh.ErrorReturnCode:
+        pass
+    depth = ('--depth=1',) if dest.joinpath('.git/shallow').exists() else ()
+    git('fetch', '-q', *depth, url, revision, _cwd=dest)
+    git('checkout', '-q', '--detach', 'FETCH_HEAD', _cwd=dest)
+
+def _noninteractive_git_env():
+    # Prefetching runs several fetches at once without the terminal, so
+    # credential and host key prompts must fail rather than wait;
+    # handle_git_url retries in the foreground.
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    ssh_command = env.get('GIT_SSH_COMMAND') or \
+        str(sh.git('config', '--get', 'core.sshCommand', _ok_code=[0, 1])).strip() or 'ssh'
+    env['GIT_SSH_COMMAND'] = ssh_command + ' -o BatchMode=yes'
+    return env
+
+def _clone_quietly(url, dest, branch, git=None):
+    git = git or sh.git
+    args = ['--branch', branch] if branch else []
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    git('clone', '-q', '--depth=1', *args, url, str(dest))
+
+@inject(injector=Injector)
+def prefetch_plugins(specs, *, injector):
+    '''
+    Clone or update the git plugins among *specs* concurrently, along with the git plugins they list in their own configuration.  Loading the plugins afterwards with :func:`load_plugin` imports them in dependency order without fetching them again.
+
+    Prefetching never prompts: git and ssh are run without a terminal and in batch mode.  Failures, including those needing a password or host key confirmation, are only logged here; such plugins are fetched in the foreground when loaded.
+    '''
+    config = injector(ConfigLayout)
+    checkout_dir = Path(config.checkout_dir)
+    pull = config.pull_plugins
+    plugin_mappings = injector.get_instance(PluginMappings)
+
+    def git_spec(spec):
+        try:
+            spec = plugin_mappings.map(_parse_plugin_spec(spec))
+        except Exception:
+            return None
+        return spec if spec.get('type') == 'git' else None
+
+    pending = [s for s in map(git_spec, specs) if s]
+    if not pending:
+        return
+    git = sh.git.bake(_env=_noninteractive_git_env())
+    clone = functools.partial(_clone_quietly, git=git)
+    seen = set()
+    with startup_profile.phase('plugin fetch', f'{len(pending)} plugins'), \
+         concurrent.futures.ThreadPoolExecutor(
+             max_workers=max(1, config.plugin_fetch_concurrency)) as executor:
+        while pending:
+            futures = {}
+            for spec in pending:
+                dest = _git_checkout_dir(spec, checkout_dir)
+                fetched_key = (dest, spec.get('branch'), spec.get('revision'))
+                if dest in seen or fetched_key in _fetched_checkouts:
+                    continue
+                seen.add(dest)
+                _managed_checkouts.add(dest.resolve())
+                futures[executor.submit(
+                    _update_git_checkout, spec, dest,
+                    pull=pull, clone=clone, git=git)] = fetched_key
+            pending = []
+            for future in concurrent.futures.as_completed(futures):
+                fetched_key = futures[future]
+                dest = fetched_key[0]
+                try:
+                    future.result()
+                    metadata = _read_plugin_metadata(dest / 'carthage_plugin.yml')
+                except Exception:
+                    logger.debug('Unable to prefetch plugin into %s', dest, exc_info=True)
+                    continue
+                _fetched_checkouts.add(fetched_key)
+                pending.extend(s for s in map(git_spec, metadata.get('config', {}).get('plugins', [])) if s)
+
+_metadata_cache = {}
+
+def _git_head(path):
+    # Reads the revision of a checkout without running git
+    git_dir = path / '.git'
+    try:
+        head = git_dir.joinpath('HEAD').read_text().strip()
+        if not head.startswith('ref: '):
+            return head
+        ref = head[5:]
+        try:
+            return git_dir.joinpath(ref).read_text().strip()
+        except FileNotFoundError:
+            for line in git_dir.joinpath('packed-refs').read_text().splitlines():
+                revision, _, name = line.partition(' ')
+                if name == ref:
+                    return revision
+    except OSError:
+        pass
+    return None
+
+def _read_plugin_metadata(metadata_path: Path):
+    '''
+    Return the parsed contents of *metadata_path*, a ``carthage_plugin.yml``.  Results are cached keyed by the file's size and modification time and, for a plugin at the top of a git checkout, its revision.  For such plugins in checkouts Carthage manages, the cache is also kept alongside the checkout in ``.git`` so that later invocations need not parse the file.  Callers receive a copy they may modify.
+    '''
+    stat = metadata_path.stat()
+    plugin_dir = metadata_path.parent
+    revision = _git_head(plugin_dir)
+    key = [revision, stat.st_mtime_ns, stat.st_size]
+    try:
+        cached_key, metadata = _metadata_cache[metadata_path]
+        if cached_key == key:
+            return copy.deepcopy(metadata)
+    except KeyError:
+        pass
+    cache_path = None
+    if revision and plugin_dir.resolve() in _managed_checkouts:
+        cache_path = plugin_dir / '.git' / 'carthage_plugin_metadata.json'
+    metadata = None
+    if cache_path:
+        try:
+            cached = json.loads(cache_path.read_text())
+            if cached['key'] == key:
+                metadata = cached['metadata']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    if metadata is None:
+        metadata = yaml_load(metadata_path.read_text())
+        if cache_path:
+            try:
+                cache_path.write_text(json.dumps(dict(key=key, metadata=metadata)))
+            except (OSError, TypeError, ValueError):
+                pass
+    _metadata_cache[metadata_path] = (key, metadata)
+    return copy.deepcopy(metadata)
 
 
 @inject(injector=Injector)
@@ -350,8 +544,11 @@ def load_plugin_from_package(package: typing.Optional[types.ModuleTyp],
         if not package.__spec__.origin:
             raise SyntaxError(f'{package.__name__} is not a Carthage plugin')
         try:
-            metadata = yaml.safe_load(importlib.resources.files(
-                package).joinpath('carthage_plugin.yml').read_text())
+            resource = importlib.resources.files(package).joinpath('carthage_plugin.yml')
+            if isinstance(resource, Path):
+                metadata = _read_plugin_metadata(resource)
+            else:
+                metadata = yaml_load(resource.read_text())
             metadata_path = package.__file__
         except (FileNotFoundError, ImportError):
             # consider the case of hadron-operations
@@ -360,7 +557,7 @@ def load_plugin_from_package(package: typing.Optional[types.ModuleTyp],
             components = len(package.__name__.split("."))
             path_root = Path(package.__file__).parents[components]
             if path_root.joinpath("carthage_plugin.yml").exists():
-                metadata = yaml.safe_load(path_root.joinpath("carthage_plugin.yml").read_text())
+                metadata = _read_plugin_metadata(path_root.joinpath("carthage_plugin.yml"))
                 metadata_path = path_root.joinpath('carthage_plugin.yml')
                 if 'resource_dir' not in metadata:
                     metadata['resource_dir'] = path_root
@@ -415,10 +612,10 @@ def _handle_plugin_config(injector, metadata, path, ignore_import_errors):
     # hierarchy
     config = injector(ConfigLayout)
     if 'config' in metadata:
-        config.load_yaml(yaml.dump(metadata['config']), path=path, ignore_import_errors=ignore_import_errors)
+        config.load_yaml(yaml_dump(metadata['config']), path=path, ignore_import_errors=ignore_import_errors)
 
 
 def _setup_carthage_plugins_module():
     from types import ModuleType
     sys.modules['carthage.carthage_plugins'] = ModuleType('carthage.carthage_plugins')
-__all__ = ['load_plugin', 'load_plugin_from_spec']
+__all__ = ['load_plugin', 'load_plugin_from_spec', 'prefetch_plugins']
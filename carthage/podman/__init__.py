@@ -39,6 +39,8 @@ class PodmanConfig(carthage.config.ConfigSchema, prefix='podman'):
     pull_policy:str = 'newer'
     #: An image used to gain access to volumes. Must have /bin/sh.
     volume_access_image: str = 'ghcr.io/hadron/carthage_volume_access:latest'
+    #: Seconds to trust a snapshot of a container host's containers, pods, images and volumes before listing them again; 0 to always inspect objects individually
+    inventory_max_age: int = 60
     
     
 class PodmanDeployableFinder(carthage.DeployableFinder):
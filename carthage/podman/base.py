@@ -304,14 +304,9 @@ class PodmanPod(HasContainerHostMixin, PodmanNetworkMixin, carthage.machine.Netw
             inspect_arg = self.id
         else:
             inspect_arg = self.name
-        try:
-            result = await self.podman(
-                'pod', 'inspect', inspect_arg, _log=False)
-        except sh.ErrorReturnCode:
+        pod_info = await self.container_host.inventory.inspect('pod', inspect_arg)
+        if pod_info is None:
             return False
-        pod_info = json.loads(str(result.stdout, 'utf-8'))
-        if isinstance(pod_info, list):
-            pod_info = pod_info[0]
         self.pod_info = pod_info
         return dateutil.parser.isoparse(pod_info['Created']).timestamp()
 
@@ -412,21 +407,20 @@ An OCI container implemented using ``podman``.  While it is possible to set up a
 
 
     async def find(self):
+        return await self._find()
+
+    async def _find(self, current=False):
         if not self.container_host:
             await self.ainjector(instantiate_container_host, self)
         if not await self.container_host.find():
             logger.debug('%s does not exist because its container host does not exist', self)
             return False
         await self.resolve_networking()
-        try:
-            result = await self.podman(
-                'container', 'inspect', self.full_name,
-                _bg=True, _bg_exc=False, _log=False)
-        except sh.ErrorReturnCode:
+        info = await self.container_host.inventory.inspect('container', self.full_name, current=current)
+        if info is None:
             return False
-        containers = json.loads(str(result))
-        process_inspect_result(self, containers[0])
-        self.container_info = containers[0]
+        process_inspect_result(self, info)
+        self.container_info = info
         ports = self.container_info['NetworkSettings']['Ports']
         if not hasattr(self, 'ssh_port') and '22/tcp' in ports:
             if ports['22/tcp']:
@@ -434,7 +428,7 @@ An OCI container implemented using ``podman``.  While it is possible to set up a
         self.id = self.container_info['Id']
         self.running = self.container_info['State']['Running']
         try:
-            return dateutil.parser.isoparse(containers[0]['Created']).timestamp()
+            return dateutil.parser.isoparse(info['Created']).timestamp()
         except Exception as e:
             raise ValueError(f'Invalid ISO string: {self.container_info["Created"]}')
 
@@ -497,15 +491,20 @@ An OCI container implemented using ``podman``.  While it is possible to set up a
             _bg=True, _bg_exc=False)
 
     async def is_machine_running(self):
+        if self.running_state_current():
+            return self.running
         if self.container_host is None:
             await self.ainjector(instantiate_container_host, self)
         if not await self.container_host.start_container_host(False):
             # When the container host is not running, the container is not running
             self.running = False
+            self.note_running_state()
             return False
-        if not await self.find():
+        # The inventory may predate the container exiting or being stopped outside Carthage.
+        if not await self._find(current=True):
             return False # Containers that do not exist are not running
         self.running = self.container_info['State']['Running']
+        self.note_running_state()
         return self.running
 
     async def start_machine(self):
@@ -522,6 +521,7 @@ An OCI container implemented using ``podman``.  While it is possible to set up a
             await self.podman(
                 'container', 'start', self.full_name,
                 _bg=True, _bg_exc=False)
+            self.invalidate_running_state()
         await self.is_machine_running()
 
     async def stop_machine(self):
@@ -768,13 +768,9 @@ class PodmanImage(OciImage, SetupTaskMixin, no_auto_inject=True):
             to_find = self.id
         else:
             to_find = self.oci_image_tag
-        try:
-            result = await self.podman(
-                'image', 'inspect', to_find,
-                _log=False)
-        except sh.ErrorReturnCode:
+        info = await self.container_host.inventory.inspect('image', to_find)
+        if info is None:
             return False
-        info = json.loads(str(result))[0]
         self.id = info['Id']
         process_inspect_result(self, info)
         self.image_info = info
@@ -1148,16 +1144,13 @@ class ContainerfileImage(OciImage, no_auto_inject=True):
         if not await self.container_host.find():
             logger.debug('%s does not exist because its container host does not exist', self)
             return False
-        try: inspect_result = await self.container_host.podman(
-                'image', 'inspect',
-                self.oci_image_tag, _log=False)
-        except sh.ErrorReturnCode: return False
-        inspect_json = json.loads(str(inspect_result.stdout, 'utf-8'))
-        created = dateutil.parser.isoparse(inspect_json[0]['Created']).timestamp()
-        process_inspect_result(self, inspect_json[0])
-        info = self.image_info = inspect_json[0]
+        info = await self.container_host.inventory.inspect('image', self.oci_image_tag)
+        if info is None: return False
+        created = dateutil.parser.isoparse(info['Created']).timestamp()
+        process_inspect_result(self, info)
+        self.image_info = info
         self.id = info['Id']
-        hadron_mtime_str = inspect_json[0]['Annotations'].get('com.hadronindustries.carthage.image_mtime')
+        hadron_mtime_str = info['Annotations'].get('com.hadronindustries.carthage.image_mtime')
         if hadron_mtime_str:
             hadron_mtime = dateutil.parser.isoparse(hadron_mtime_str).timestamp()
             if self.container_context_mtime(self.container_context) > hadron_mtime+5: return False
@@ -1218,12 +1211,9 @@ class PodmanVolume(HasContainerHostMixin, OciManaged):
         if not await self.container_host.find():
             logger.debug(f'{self} does not exist because the container host does not exist.')
             return False
-        try:
-            result = await self.podman(
-                'volume', 'inspect', self.name, _log=False)
-        except sh.ErrorReturnCode:
+        info = await self.container_host.inventory.inspect('volume', self.name)
+        if info is None:
             return False
-        info = json.loads(str(result))[0]
         process_inspect_result(self, info)
         try:
             return dateutil.parser.isoparse(info['CreatedAt']).timestamp()
@@ -24,8 +24,8 @@ import dateutil.parser
 import carthage.machine
 from carthage.dependency_injection import *
 from .. import sh, ConfigLayout, become_privileged, deployment
-from ..machine import AbstractMachineModel, Machine
-from ..utils import memoproperty
+from ..machine import AbstractMachineModel, Machine, stop_sshfs
+from ..utils import memoproperty, wait_for_mount, NotPresent
 from ..oci import *
 
 __all__ = []
@@ -34,12 +34,251 @@ logger = logging.getLogger('carthage.podman')
 
 CARTHAGE_SOCKET_DIRECTORY = Path('/var/lib/carthage/podman_sockets')
 
+class PodmanInventory:
+
+    '''
+    A snapshot of the containers, pods, images and volumes on a :class:`PodmanContainerHost`.  Finding objects one at a time costs a ``podman inspect`` each, and a round trip each on a :class:`RemotePodmanHost`.  Instead, the inventory lists each kind of object once and inspects everything listed in a single call, so the *find* methods can consult :meth:`inspect` first.
+
+    Implementations of :meth:`PodmanContainerHost.podman` run each command within :meth:`command`.  Names mentioned by a command that may change the host are inspected individually until a snapshot taken after the command completes replaces the current one; the rest of the snapshot stays valid, so creating many objects does not repeatedly list the host.  Commands whose effects cannot be tied to names (pruning, or volumes created as a side effect of creating a container) discard the snapshots of the kinds they affect, and those kinds are inspected individually while such a command runs.
+
+    Snapshots are also discarded by :meth:`invalidate` and once they are older than the *podman.inventory_max_age* setting.  Whether a container is running can change outside Carthage at any time, so :meth:`PodmanContainer.is_machine_running` does not answer from the snapshot.  Objects that are not in the snapshot are still inspected individually when the snapshot cannot be trusted to be complete, such as images referred to by a short name.
+    '''
+
+    #: For each kind of object, the command listing them and the field of the listing to pass to inspect.
+    listings = dict(
+        container=(('ps', '-a', '--format', 'json'), 'Id'),
+        pod=(('pod', 'ps', '--format', 'json'), 'Id'),
+        image=(('image', 'ls', '--format', 'json'), 'Id'),
+        volume=(('volume', 'ls', '--format', 'json'), 'Name'),
+    )
+
+    #: Podman subcommands that do not change what the inventory records.
+    read_only_commands = frozenset({
+        'ps', 'ls', 'list', 'images', 'inspect', 'exists', 'exec', 'logs',
+        'mount', 'port', 'top', 'stats', 'diff', 'history', 'version', 'info',
+        'search', 'login', 'push', 'save', 'export', 'cp', 'healthcheck',
+    })
+
+    #: For commands that change the host, the kind of object named in their arguments and the other kinds they may change.  Commands of a kind (``podman volume create``) not listed here act on that kind; other commands may change anything.
+    command_effects = {
+        'create': ('container', ('volume',)),
+        'run': ('container', ('volume',)),
+        'commit': ('container', ('image',)),
+        **{c: ('container', ()) for c in (
+            'start', 'stop', 'restart', 'kill', 'rm', 'rename', 'wait',
+            'pause', 'unpause', 'attach', 'update')},
+        **{c: ('image', ()) for c in (
+            'build', 'pull', 'tag', 'untag', 'rmi', 'load', 'import')},
+        'pod': ('pod', ('container',)),
+    }
+
+    #: How many objects to pass to a single inspect
+    batch_size = 200
+
+    def __init__(self, container_host: PodmanContainerHost):
+        self.container_host = container_host
+        self._snapshots = {}
+        self._locks = collections.defaultdict(asyncio.Lock)
+        # A clock advanced by each change, used to tell whether a change completed before a snapshot was started.
+        self._clock = 0
+        # For each kind, the names being or recently changed: name -> [commands in flight, clock at last completion]
+        self._changed_names = {kind: {} for kind in self.listings}
+        # For each kind, changes not tied to names: [commands in flight, clock at last completion]
+        self._changed_kinds = {kind: [0, 0] for kind in self.listings}
+
+    def invalidate(self):
+        '''Discard all snapshots; the next lookup takes a new one.'''
+        self._snapshots.clear()
+
+    def _command_effects(self, args):
+        words = [a for a in args if isinstance(a, str) and not a.startswith('-')]
+        if not words or words[0] in self.read_only_commands:
+            return None
+        if words[0] in self.listings:
+            if len(words) > 1 and words[1] in self.read_only_commands:
+                return None
+            kind, others = self.command_effects.get(words[0], (words[0], ()))
+            if words[0] == 'container' and len(words) > 1:
+                kind, others = self.command_effects.get(words[1], (kind, others))
+            names = words[2:]
+        elif words[0] in self.command_effects:
+            kind, others = self.command_effects[words[0]]
+            names = words[1:]
+        else:
+            return None, tuple(self.listings), ()
+        if 'prune' in words[:2] or '--all' in args or '-a' in args:
+            return None, (kind, *others), ()
+        # Values of --option=value may be names too
+        names.extend(a.partition('=')[2] for a in args
+                     if isinstance(a, str) and a.startswith('--') and '=' in a)
+        return kind, others, names
+
+    def _aliases(self, kind, names):
+        # Objects are found by name or ID; a change to either must cover both.
+        result = set(names)
+        try:
+            snapshot = self._snapshots[kind][1] or {}
+        except KeyError:
+            return result
+        for name in names:
+            for candidate in self._candidate_names(kind, name):
+                if info := snapshot.get(candidate):
+                    result.update(k for k in (info.get('Id'), info.get('Name')) if k)
+                    result.update(info.get('RepoTags') or [])
+        return result
+
+    @contextlib.contextmanager
+    def command(self, args):
+        '''
+        A context manager around running podman with *args*; used by :meth:`PodmanContainerHost.podman` implementations.  Commands other than :attr:`read_only_commands` are recorded as changes to the inventory for as long as they run and after they complete.
+        '''
+        effects = self._command_effects(args)
+        if effects is None:
+            yield
+            return
+        kind, others, names = effects
+        changed_names = self._changed_names.get(kind, {})
+        names = self._aliases(kind, names) if kind else set()
+        changed_kinds = [self._changed_kinds[k] for k in others]
+        for name in names:
+            changed_names.setdefault(name, [0, 0])[0] += 1
+        for k in changed_kinds:
+            k[0] += 1
+        for k in others:
+            self._snapshots.pop(k, None)
+        try:
+            yield
+        finally:
+            self._clock += 1
+            for name in names:
+                entry = changed_names[name]
+                entry[0] -= 1
+                entry[1] = self._clock
+            for k in changed_kinds:
+                k[0] -= 1
+                k[1] = self._clock
+            for k in others:
+                self._snapshots.pop(k, None)
+
+    async def inspect(self, kind: str, name: str, *, current: bool = False):
+        '''
+        :param kind: One of ``container``, ``pod``, ``image`` or ``volume``.
+
+        :param name: A name or ID; for images a tag or ID.
+
+        :param current: Inspect the object individually rather than consulting the snapshot.  Used for state that changes outside Carthage, such as whether a container is running.
+
+        :returns: What ``podman *kind* inspect *name*`` would return for the object, or *None* if it does not exist.
+        '''
+        info = NotPresent if current else await self._lookup(kind, name)
+        if info is not NotPresent:
+            return info
+        try:
+            result = await self.container_host.podman(kind, 'inspect', name, _log=False)
+        except sh.ErrorReturnCode:
+            return None
+        info = json.loads(str(result))
+        if isinstance(info, list):
+            info = info[0]
+        return info
+
+    def _changed(self, kind, name):
+        changed_names = self._changed_names[kind]
+        return self._changed_kinds[kind][0] > 0 or any(
+            candidate in changed_names for candidate in self._candidate_names(kind, name))
+
+    async def _lookup(self, kind, name):
+        if self._changed(kind, name):
+            return NotPresent
+        snapshot = await self._snapshot(kind)
+        # A change may have started while the snapshot was taken
+        if snapshot is None or self._changed(kind, name):
+            return NotPresent
+        for candidate in self._candidate_names(kind, name):
+            try:
+                return snapshot[candidate]
+            except KeyError:
+                pass
+        if kind == 'image':
+            # Short names are resolved by podman against registries.conf, so absence from the snapshot is not conclusive.
+            return NotPresent
+        return None
+
+    @staticmethod
+    def _candidate_names(kind, name):
+        yield name
+        if kind == 'image' and '@' not in name and ':' not in name.rpartition('/')[2]:
+            yield name + ':latest'
+
+    async def _snapshot(self, kind):
+        max_age = self.container_host.injector(ConfigLayout).podman.inventory_max_age
+        if max_age <= 0:
+            return None
+        loop = asyncio.get_running_loop()
+        async with self._locks[kind]:
+            try:
+                taken, snapshot = self._snapshots[kind]
+                if loop.time() - taken < max_age:
+                    return snapshot
+            except KeyError:
+                pass
+            started = self._clock
+            taken = loop.time()
+            snapshot = await self._take_snapshot(kind)
+            in_flight, completed = self._changed_kinds[kind]
+            if in_flight or completed > started:
+                # Changes not tied to names overlapped the snapshot
+                return None
+            # A failed snapshot is remembered too, so objects are inspected individually until it expires rather than listing the host again on every lookup.
+            self._snapshots[kind] = (taken, snapshot)
+            if snapshot is None:
+                return None
+            # Changes completed before the snapshot started are reflected in it.
+            changed_names = self._changed_names[kind]
+            for name, (in_flight, completed) in list(changed_names.items()):
+                if not in_flight and completed <= started:
+                    del changed_names[name]
+            return snapshot
+
+    async def _take_snapshot(self, kind):
+        listing, field = self.listings[kind]
+        try:
+            listed = json.loads(str(await self.container_host.podman(*listing, _log=False)) or '[]')
+            names = [entry[field] for entry in listed or []]
+            objects = []
+            for start in range(0, len(names), self.batch_size):
+                result = await self.container_host.podman(
+                    kind, 'inspect', *names[start:start+self.batch_size], _log=False)
+                result = json.loads(str(result))
+                objects.extend(result if isinstance(result, list) else [result])
+        except Exception:
+            # The snapshot is only an optimization; individual inspects report any real problem.
+            logger.debug('Unable to take %s inventory of %s; inspecting individually', kind, self.container_host, exc_info=True)
+            return None
+        snapshot = {}
+        for info in objects:
+            for key in ('Id', 'Name'):
+                if info.get(key):
+                    snapshot[info[key]] = info
+            if kind == 'image':
+                for tag in info.get('RepoTags') or []:
+                    snapshot[tag] = info
+        return snapshot
+
+__all__ += ['PodmanInventory']
+
+
 class PodmanContainerHost(AsyncInjectable):
 
     @memoproperty
     def podman_log(self):
         return self.injector.get_instance(InjectionKey("podman_log", _optional=True))
 
+    @memoproperty
+    def inventory(self):
+        '''The :class:`PodmanInventory` for this host.  Implementations of :meth:`podman` run commands within :meth:`PodmanInventory.command`.'''
+        return PodmanInventory(self)
+
     def podman(self, *args,
                _bg=True, _bg_exc=True, **kwargs):
         raise NotImplementedError
@@ -125,14 +364,15 @@ class LocalPodmanContainerHost(PodmanContainerHost):
         if _log and self.podman_log:
             options['_out']=str(self.podman_log)
             options['_err_to_out'] = True
-        result = sh.podman(
-            *args,
-            _fg=_fg,
-            **options,
-            **kwargs)
-        if not _fg:
-            return await result
-        return result
+        with self.inventory.command(args):
+            result = sh.podman(
+                *args,
+                _fg=_fg,
+                **options,
+                **kwargs)
+            if not _fg:
+                return await result
+            return result
 
     @contextlib.asynccontextmanager
     async def tar_volume_context(self, volume):
@@ -182,33 +422,30 @@ async def filesystem_access_core(context,  remote_path, sshfs_process_factory):
                 context.sshfs_path = tempfile.mkdtemp(
                     dir=context.path_dir, prefix=context.path_prefix, )
                 context.sshfs_process = await sshfs_process_factory(context.sshfs_path)
-                for t in [0.5, 1, 1.5, 2, 2, 2, 2, 2, 4, 8]:
-                    alive, *rest = context.sshfs_process.process.is_alive()
-                    if not alive:
-                        await context.sshfs_process
-                        raise RuntimeError  # I'd expect that to have happened from an sh exit error already
-                    path = os.path.join(context.sshfs_path, remote_path)
-                    if os.path.exists(path):
-                        break
-                    else:
-                        logger.info(f'waiting for: {path}')
-                    await asyncio.sleep(t)
-                else:
-                    raise TimeoutError("sshfs failed to mount")
+                path = os.path.join(context.sshfs_path, remote_path)
+                logger.debug(f'waiting for: {path}')
+                try:
+                    await wait_for_mount(
+                        lambda: os.path.exists(path),
+                        context.sshfs_process,
+                        timeout=25)
+                except TimeoutError:
+                    raise TimeoutError("sshfs failed to mount") from None
         path = os.path.join(context.sshfs_path, remote_path)
         yield Path(path)
     finally:
         context.sshfs_count -= 1
         if context.sshfs_count <= 0:
             context.sshfs_count = 0
+            process = context.sshfs_process
             try:
-                context.sshfs_process.process.terminate()
+                process.process.terminate()
             except BaseException:
                 pass
             dir = context.sshfs_path
             context.sshfs_path = None
             context.sshfs_process = None
-            await asyncio.sleep(0.2)
+            await stop_sshfs(process)
             with contextlib.suppress(OSError):
                 if dir:
                     os.rmdir(dir)
@@ -377,15 +614,16 @@ class RemotePodmanHost(PodmanContainerHost):
         if _log and self.podman_log:
             options['_out']=str(self.podman_log)
             options['_err_to_out'] = True
-        result = sh.podman(
-            self.extra_args,
-                *args,
-                _fg=_fg,
-            **options,
-            **kwargs)
-        if not _fg:
-            return await result
-        return result
+        with self.inventory.command(args):
+            result = sh.podman(
+                self.extra_args,
+                    *args,
+                    _fg=_fg,
+                **options,
+                **kwargs)
+            if not _fg:
+                return await result
+            return result
 
     async def podman_nosocket(self, *args, _log=True, **kwargs):
         options = {}
@@ -393,13 +631,14 @@ class RemotePodmanHost(PodmanContainerHost):
         if _log and self.podman_log:
             options['_out']=str(self.podman_log)
             options['_err_to_out'] = True
-        result = self.machine.run_command(
-            'podman',
-            *args,
-            _user=self.user,
-            **options,
-            **kwargs)
-        return await result
+        with self.inventory.command(args):
+            result = self.machine.run_command(
+                'podman',
+                *args,
+                _user=self.user,
+                **options,
+                **kwargs)
+            return await result
 
     @contextlib.asynccontextmanager
     async def filesystem_access(self, *args):
@@ -455,15 +694,16 @@ class LocalPodmanSocket(PodmanContainerHost):
         if _log and self.podman_log:
             options['_out']=str(self.podman_log)
             options['_err_to_out'] = True
-        result = sh.podman(
-            '--remote',
-            *args,
-            _fg=_fg,
-            **options,
-            **kwargs)
-        if not _fg:
-            return await result
-        return result
+        with self.inventory.command(args):
+            result = sh.podman(
+                '--remote',
+                *args,
+                _fg=_fg,
+                **options,
+                **kwargs)
+            if not _fg:
+                return await result
+            return result
 
     @contextlib.asynccontextmanager
     async def filesystem_access_container(self, container_name):
@@ -0,0 +1,208 @@
+# Copyright (C) 2026, Hadron Industries, Inc.
+# Carthage is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation. It is distributed
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
+# LICENSE for details.
+
+'''
+Records where time goes while Carthage starts: importing carthage, loading configuration and plugins, and instantiating the layout.  Recording is always on; each phase costs a couple of clock reads.  ``carthage-runner startup_profile`` reports the results for the current invocation.
+
+This module must only depend on the standard library because it is imported before the rest of carthage.
+'''
+
+from __future__ import annotations
+import contextlib
+import contextvars
+import dataclasses
+import json
+import os
+import sys
+import time
+import typing
+
+__all__ = []
+
+
+@dataclasses.dataclass
+class Phase:
+
+    name: str
+    detail: str
+    #: Seconds from the start of recording
+    start: float
+    depth: int
+    #: Index in :attr:`StartupProfile.phases` of the enclosing phase
+    parent: typing.Optional[int] = None
+    duration: typing.Optional[float] = None
+    #: Time not accounted for by nested phases
+    self_time: typing.Optional[float] = None
+
+    def as_dict(self):
+        return dataclasses.asdict(self)
+
+__all__ += ['Phase']
+
+
+class StartupProfile:
+
+    '''
+    A timed breakdown of start-up phases.  Phases nest: a configuration file that loads a plugin records the plugin load inside the configuration phase, and :attr:`Phase.self_time` excludes nested phases.  Nesting is tracked per thread and asyncio task, so phases in concurrent tasks nest within the phase that was open where the task was created rather than within each other.
+
+    Phases that start once :attr:`max_phases` have been recorded, such as layouts instantiated long after start-up, are timed but not recorded; they are counted in :attr:`dropped`.
+
+    Subsystems may register statistics with :meth:`add_statistics`; they are included in reports.
+    '''
+
+    #: Phases recorded before further phases are dropped
+    max_phases = 1000
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[Phase] = []
+        self.dropped = 0
+        self.statistics: dict[str, typing.Callable[[], dict]] = {}
+        self._current = contextvars.ContextVar(f'current_phase_{id(self):x}', default=None)
+
+    def begin(self, name, detail=''):
+        parent = self._current.get()
+        phase = Phase(name=name, detail=str(detail),
+                      start=time.perf_counter() - self.started,
+                      depth=0 if parent is None else self.phases[parent].depth+1,
+                      parent=parent)
+        if len(self.phases) >= self.max_phases:
+            self.dropped += 1
+            return phase
+        self.phases.append(phase)
+        self._current.set(len(self.phases)-1)
+        return phase
+
+    def end(self, phase):
+        phase.duration = time.perf_counter() - self.started - phase.start
+        # Phases are normally closed in order, but tolerate one left open by an exception.
+        current = self._current.get()
+        while current is not None:
+            if self.phases[current] is phase:
+                self._current.set(phase.parent)
+                break
+            current = self.phases[current].parent
+
+    @contextlib.contextmanager
+    def phase(self, name, detail=''):
+        phase = self.begin(name, detail)
+        try:
+            yield phase
+        finally:
+            self.end(phase)
+
+    def add_statistics(self, name, statistics: typing.Callable[[], dict]):
+        '''Include the dict returned by *statistics* under *name* in reports.
+        '''
+        self.statistics[name] = statistics
+
+    def _compute_self_times(self):
+        nested = [0.0]*len(self.phases)
+        for phase in self.phases:
+            if phase.parent is not None and phase.duration is not None:
+                nested[phase.parent] += phase.duration
+        for phase, nested_time in zip(self.phases, nested):
+            if phase.duration is not None:
+                phase.self_time = max(0.0, phase.duration-nested_time)
+
+    def _in_tree_order(self):
+        children = [[] for p in self.phases]
+        roots = []
+        for i, phase in enumerate(self.phases):
+            (roots if phase.parent is None else children[phase.parent]).append(i)
+        stack = list(reversed(roots))
+        while stack:
+            i = stack.pop()
+            yield self.phases[i]
+            stack.extend(reversed(children[i]))
+
+    def plugin_costs(self):
+        ''':returns: A dict mapping each loaded plugin to its total and self load time.
+        '''
+        self._compute_self_times()
+        return {p.detail: dict(total=p.duration, self=p.self_time)
+                for p in self.phases if p.name == 'plugin' and p.duration is not None}
+
+    def as_dict(self, imports=None):
+        '''
+        :param imports: Results of :func:`module_import_times` to include.
+        '''
+        self._compute_self_times()
+        result = dict(
+            elapsed=time.perf_counter() - self.started,
+            phases=[p.as_dict() for p in self.phases],
+            dropped=self.dropped,
+            plugins=self.plugin_costs(),
+            statistics={k: v() for k, v in self.statistics.items()},
+        )
+        if imports is not None:
+            result['imports'] = imports
+        return result
+
+    def to_json(self, imports=None):
+        return json.dumps(self.as_dict(imports=imports), indent=2, default=str)
+
+    def format_table(self, imports=None):
+        self._compute_self_times()
+        detail_width = min(60, max([len(p.detail) for p in self.phases] + [6]))
+        name_width = max([len(p.name) + 2*p.depth for p in self.phases] + [5])
+        lines = [f'{"phase":<{name_width}}  {"detail":<{detail_width}}  {"start":>8}  {"total":>8}  {"self":>8}']
+        for p in self._in_tree_order():
+            name = '  '*p.depth + p.name
+            detail = p.detail if len(p.detail) <= detail_width else '...' + p.detail[-(detail_width-3):]
+            lines.append(f'{name:<{name_width}}  {detail:<{detail_width}}  {p.start:8.3f}  '
+                         + (f'{p.duration:8.3f}  {p.self_time:8.3f}' if p.duration is not None else f'{"open":>8}'))
+        lines.append(f'elapsed: {time.perf_counter()-self.started:.3f}s')
+        if self.dropped:
+            lines.append(f'{self.dropped} later phases not recorded')
+        for name, statistics in self.statistics.items():
+            lines.append('')
+            lines.append(f'{name}:')
+            for k, v in statistics().items():
+                lines.append(f'  {k}: {v}')
+        if imports:
+            lines.append('')
+            lines.append(f'{"module":<50}  {"self":>8}  {"total":>8}')
+            for entry in imports:
+                lines.append(f'{entry["module"]:<50}  {entry["self"]:8.3f}  {entry["total"]:8.3f}')
+        return '\n'.join(lines)
+
+__all__ += ['StartupProfile']
+
+#: The profile of this process's start-up.
+startup_profile = StartupProfile()
+
+__all__ += ['startup_profile']
+
+
+def module_import_times(modules=('carthage',), limit=25):
+    '''
+    Import *modules* in a fresh interpreter with ``-X importtime``.  Modules already imported by this process cannot be timed after the fact, so this measures a separate import.
+
+    :returns: A list of the *limit* modules with the highest self import time, each a dict with *module*, *self* and *total* in seconds.
+    '''
+    import subprocess
+    statement = '; '.join(f'import {m}' for m in modules)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True, text=True, check=True, env=env)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, total_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # header
+        entries.append(dict(module=fields[2].strip(), self=self_us/1e6, total=total_us/1e6))
+    entries.sort(key=lambda e: e['self'], reverse=True)
+    return entries[:limit]
+
+__all__ += ['module_import_times']
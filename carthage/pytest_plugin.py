@@ -11,10 +11,10 @@ import asyncio
 import json
 import logging
 import pytest
-import yaml
 
 from. import base_injector, ConfigLayout, InjectionKey
 from .dependency_injection import AsyncInjector
+from .utils import yaml_load
 
 
 @pytest.fixture(scope='session')
@@ -86,7 +86,7 @@ def pytest_configure(config):
             c.close()
     test_params_yaml = config.getoption('test_parameters')
     if test_params_yaml:
-        config.carthage_test_parameters = yaml.load(test_params_yaml)
+        config.carthage_test_parameters = yaml_load(test_params_yaml)
         test_params_yaml.close()
 
 
@@ -9,14 +9,15 @@
 from __future__ import annotations
 import argparse
 from .console import CarthageRunnerCommand
-from . import *
+from .dependency_injection import AsyncInjectable, InjectionKey
+from .machine import Machine
+from .kvstore import persistent_seed_path
 from . import kvstore
 import asyncio
 
 class MachineCommand(CarthageRunnerCommand):
 
     async def should_register(self):
-        from .machine import Machine
         return any(self.ainjector.filter(Machine, ['host']))
 
     def setup_subparser(self, subparser):
@@ -114,7 +115,7 @@ class DumpAssignmentsCommand(CarthageRunnerCommand):
         layout = await self.ainjector.get_instance_async(CarthageLayout)
         models = await layout.all_models(ready=False)
         self.model_names = set((getattr(m, 'name',"") for m in models))
-        store.dump(args.path, self.dump_filter)
+        await store.async_dump(args.path, self.dump_filter)
 
     def dump_filter(self, domain, key, value):
         # Several domains have keys of the form model|interface
@@ -127,6 +128,33 @@ class DumpAssignmentsCommand(CarthageRunnerCommand):
         return True
     
 
+class StartupProfileCommand(CarthageRunnerCommand):
+
+    name = 'startup_profile'
+
+    subparser_kwargs = dict(
+        help='Report how long each phase of starting this invocation took, including per-plugin load and per-module import costs.',
+        )
+
+    def setup_subparser(self, parser):
+        parser.add_argument('--json', action='store_true',
+                            help='Print the profile as JSON, for example to track regressions in CI')
+        parser.add_argument('--imports', type=int, default=25, metavar='count',
+                            help='Report the count modules most expensive to import (measured in a fresh interpreter); 0 to skip')
+
+    async def run(self, args):
+        from .profiling import startup_profile, module_import_times
+        imports = None
+        if args.imports > 0:
+            loop = asyncio.get_running_loop()
+            imports = await loop.run_in_executor(
+                None, module_import_times, ('carthage', 'carthage.modeling'), args.imports)
+        if args.json:
+            print(startup_profile.to_json(imports=imports))
+        else:
+            print(startup_profile.format_table(imports=imports))
+
+
 def enable_runner_commands(ainjector):
     ainjector.add_provider(StartCommand)
     ainjector.add_provider(ListMachines)
@@ -134,4 +162,5 @@ def enable_runner_commands(ainjector):
     ainjector.add_provider(StopCommand)
     ainjector.add_provider(DeleteCommand)
     ainjector.add_provider(DumpAssignmentsCommand)
+    ainjector.add_provider(StartupProfileCommand)
 
@@ -8,6 +8,7 @@
 
 
 import asyncio as _asyncio
+import os as _os
 import sh as _sh
 
 '''
@@ -17,36 +18,113 @@ Also, by default for commands retrieved through this module set _bg=True and _bg
 try:
     # Setting _async to true doesn't do much except it tends to override _bg, and too much of our code gets confused by that.
     _sh_context = _sh.bake(_return_cmd=True, _bg=True, _bg_exc=False, _truncate_exc=False)
-    async def test_return_cmd():
-        import warnings
-        c = await _sh_context.ls(_async=True, _return_cmd=True)
-        if not isinstance(c, _sh.RunningCommand):
-            warnings.warn('This sh is too old to properly handle _async _return_cmd=True')
-            return True
-        try:
-            await _sh_context.false(_return_cmd=True, _async=True)
-            warnings.warn('sh drops exceptions on await')
-            return True
-        except _sh.ErrorReturnCode:
-            return False
-        
-        return False
-    force_override_await = _asyncio.run(test_return_cmd())
+    #: Whether sh's own ``__await__`` needs to be overridden; *None* until probed on the first await.
+    _force_override_await = None
 except AttributeError:
     _sh_context = _sh(_bg=True, _bg_exc=False)
-    force_override_await = False
+    _force_override_await = False
+
+#: The probe of sh's ``__await__`` behavior, if one is in progress.
+_await_probe = None
 
 def __getattr__(name):
     val = getattr(_sh_context, name)
     globals()[name] = val
     return val
 
+def _open_pidfd(command):
+    '''
+    Return a pidfd for the process behind *command*, or *None* if the platform does not support pidfds or the process has already been reaped.
+    '''
+    try:
+        pidfd = _os.pidfd_open(command.pid)
+    except (AttributeError, OSError):
+        return None
+    if command.process.exit_code is not None:
+        # sh's own threads reaped the process; the pid may since have been reused.
+        _os.close(pidfd)
+        return None
+    return pidfd
+
+async def _wait_for_exit(command):
+    '''
+    Wait for *command* to exit without tying up an executor thread.
+
+    A pidfd becomes readable when its process exits, so the event loop can watch it directly rather than an executor thread blocking for the life of the process.  Once the process has exited, :meth:`RunningCommand.wait` collects the exit status and joins sh's output threads.  That join lasts as long as anything, such as a grandchild, holds the output open, so it too runs in the default executor; only the pidfd wait happens on the loop.  Where pidfds are not available, the whole wait runs in the executor.
+    '''
+    loop = _asyncio.get_running_loop()
+    pidfd = _open_pidfd(command)
+    if pidfd is not None:
+        try:
+            exited = loop.create_future()
+            def on_exit():
+                if not exited.done():
+                    exited.set_result(None)
+            loop.add_reader(pidfd, on_exit)
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+        finally:
+            _os.close(pidfd)
+    return await loop.run_in_executor(None, command.wait)
+
+class _NativeAwait:
+
+    '''
+    Await a command with sh's own ``__await__``, bypassing our override.
+    '''
+
+    def __init__(self, command):
+        self.command = command
+
+    def __await__(self):
+        return _native_await(self.command)
+
+async def _probe_native_await():
+    import warnings
+    c = await _NativeAwait(_sh_context.ls(_async=True, _return_cmd=True))
+    if not isinstance(c, _sh.RunningCommand):
+        warnings.warn('This sh is too old to properly handle _async _return_cmd=True')
+        return True
+    try:
+        await _NativeAwait(_sh_context.false(_return_cmd=True, _async=True))
+        warnings.warn('sh drops exceptions on await')
+        return True
+    except _sh.ErrorReturnCode:
+        return False
+
+async def _needs_override_await():
+    '''
+    Return whether sh's own ``__await__`` needs to be overridden.  The first call probes sh's behavior; the result is cached for the life of the interpreter.
+    '''
+    global _force_override_await, _await_probe
+    if _force_override_await is not None:
+        return _force_override_await
+    loop = _asyncio.get_running_loop()
+    if _await_probe is None or _await_probe.get_loop() is not loop:
+        _await_probe = loop.create_task(_probe_native_await())
+    try:
+        result = await _asyncio.shield(_await_probe)
+    except _asyncio.CancelledError:
+        raise
+    except Exception:
+        # Our override works with any sh, so it is the safe choice.
+        result = True
+    _force_override_await = result
+    _await_probe = None
+    return result
+
 def running_command_await(self):
-    loop = _asyncio.get_event_loop()
-    res =  yield from loop.run_in_executor(None, self.wait)
+    if _native_await is None \
+       or getattr(self, 'aio_output_complete', True) is None \
+       or (yield from _needs_override_await().__await__()):
+        res = yield from _wait_for_exit(self).__await__()
+        return res
+    res = yield from _native_await(self)
     return res
 
-if not hasattr(_sh.RunningCommand, '__await__') or force_override_await:
+_native_await = getattr(_sh.RunningCommand, '__await__', None)
+if _native_await is None or _force_override_await is not False:
     _sh.RunningCommand.__await__ = running_command_await
 del running_command_await
-del force_override_await
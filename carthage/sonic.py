@@ -209,7 +209,8 @@ A mixin for :class:`AbstractMachineModel` for SONiC network switches.
 
     @sonic_config.hash()
     def sonic_config(self):
-        return str(hash_network_links(self.network_links))
+        _, previous = self.check_stamp('sonic_config')
+        return str(hash_network_links(self.network_links, previous=previous))
 
     @sonic_config.invalidator()
     def sonic_config(self, last_run):
@@ -92,7 +92,9 @@ class SystemdNetworkModelMixin(SetupTaskMixin, AsyncInjectable):
 
     @generate_network_config.hash()
     def generate_network_config(self):
-        return "20221106" + str(hash_network_links(self.network_links))
+        _, previous = self.check_stamp('generate_network_config')
+        return "20221106" + str(hash_network_links(
+            self.network_links, previous=previous.removeprefix("20221106")))
 
     def _render_network_configuration(self, link: NetworkLink, dir: Path):
         templates = templates_for_link(link)
@@ -8,20 +8,25 @@
 
 import argparse
 import asyncio
+import collections
 import contextlib
+import copy
 import fcntl
 import functools
+import hashlib
 import logging
 import os
 import posix
 from pathlib import Path
 import re
+import select
 import sys
 import typing
 import types
 import weakref
 import importlib.resources
-import mako.lookup
+import yaml
+from .profiling import startup_profile
 
 
 async def possibly_async(r):
@@ -260,8 +265,13 @@ def carthage_main_argparser(*args, **kwargs):
 
 
 def carthage_main_setup(parser=None, unknown_ok=False, ignore_import_errors=False):
+    with startup_profile.phase('setup'):
+        return _carthage_main_setup(parser, unknown_ok, ignore_import_errors)
+
+
+def _carthage_main_setup(parser, unknown_ok, ignore_import_errors):
     from . import base_injector, ConfigLayout
-    from .plugins import load_plugin
+    from .plugins import load_plugin, prefetch_plugins
     if parser is None:
         parser = carthage_main_argparser()
     if unknown_ok:
@@ -296,6 +306,7 @@ def carthage_main_setup(parser=None, unknown_ok=False, ignore_import_errors=Fals
         config.pull_plugins = args.pull_plugins
     for f in args.config:
         config.load_yaml(f, ignore_import_errors=ignore_import_errors)
+    base_injector(prefetch_plugins, args.plugins)
     for p in args.plugins:
         base_injector(load_plugin, p, ignore_import_errors=ignore_import_errors)
     if args.tasks_verbose:
@@ -353,6 +364,63 @@ def TemporaryMountPoint(**kwargs):
         os.rmdir(dir)
 
 
+async def wait_for_mount(mounted, process=None, timeout=30.0):
+    '''
+    Wait for a filesystem to be mounted.
+
+    :param mounted: A callable returning true once the mount is usable.  It is called initially, each time the mount table changes, and periodically in between.
+
+    :param process: The process (typically a :class:`sh.RunningCommand`) performing the mount, if any.  If it exits before *mounted* returns true, awaiting it is expected to raise; if it does not, :class:`RuntimeError` is raised.
+
+    :raises TimeoutError: If *mounted* is not true within *timeout* seconds.
+
+    Changes to the mount table are detected through :file:`/proc/self/mountinfo`, which signals *EPOLLPRI* on every mount and unmount, so no time is spent sleeping once the filesystem is mounted.  *mounted* is also polled with exponential backoff, capped at one second, because what it checks may become true only after the mount table changes (for example a path within the new mount appearing), and because the mount table cannot always be watched.
+    '''
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    changed = asyncio.Event()
+    exited = None
+    with contextlib.ExitStack() as stack:
+        try:
+            mountinfo = stack.enter_context(open('/proc/self/mountinfo', 'rb'))
+            watcher = stack.enter_context(select.epoll())
+            watcher.register(mountinfo.fileno(), select.EPOLLPRI)
+        except (OSError, AttributeError):
+            watcher = None
+        if watcher:
+            def on_change():
+                watcher.poll(0)
+                changed.set()
+            loop.add_reader(watcher.fileno(), on_change)
+            stack.callback(loop.remove_reader, watcher.fileno())
+        if process is not None:
+            async def wait_for_process():
+                return await process
+            exited = asyncio.ensure_future(wait_for_process())
+            stack.callback(exited.cancel)
+        backoff = 0.01
+        while True:
+            changed.clear()
+            if mounted():
+                return
+            if exited and exited.done():
+                exited.result()
+                raise RuntimeError('Mount process exited without mounting')
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError('Timed out waiting for filesystem to mount')
+            remaining = min(remaining, backoff)
+            backoff = min(backoff*2, 1.0)
+            change_waiter = asyncio.ensure_future(changed.wait())
+            try:
+                await asyncio.wait(
+                    [change_waiter] + ([exited] if exited else []),
+                    timeout=remaining,
+                    return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                change_waiter.cancel()
+
+
 def import_resources_files(package):
     "stub for importlib.resources.files"
     try:
@@ -364,8 +432,88 @@ def import_resources_files(package):
             return Path(package.__path__[0])
 
 
-mako_lookup = mako.lookup.TemplateLookup([import_resources_files(__package__) / "resources/templates"],
-                                         strict_undefined=True)
+#: The libyaml backed loader and dumper when PyYAML was built with libyaml, otherwise the pure Python safe implementations.
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def yaml_load(stream):
+    "Like :func:`yaml.safe_load` but using :data:`YamlLoader`."
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def yaml_dump(data, stream=None, **kwargs):
+    "Like :func:`yaml.safe_dump` but using :data:`YamlDumper`."
+    return yaml.dump(data, stream, Dumper=YamlDumper, **kwargs)
+
+
+class _YamlCache:
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, contents):
+        if isinstance(contents, str):
+            contents = contents.encode('utf-8')
+        digest = hashlib.sha256(contents).digest()
+        try:
+            data = self.entries[digest]
+            self.entries.move_to_end(digest)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            data = yaml_load(contents)
+            self.entries[digest] = data
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        try:
+            return _copy_yaml_data(data)
+        except RecursionError:
+            return copy.deepcopy(data)
+
+    def statistics(self):
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses)
+
+
+def _copy_yaml_data(data):
+    # Much faster than deepcopy for the plain containers a safe load produces; scalars are immutable.
+    if isinstance(data, dict):
+        return {k: _copy_yaml_data(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [_copy_yaml_data(v) for v in data]
+    if isinstance(data, set):
+        return set(data)
+    return data
+
+
+_yaml_cache = _YamlCache(64)
+startup_profile.add_statistics('yaml cache', _yaml_cache.statistics)
+
+
+def yaml_load_cached(source):
+    """
+    Parse YAML with :func:`yaml_load`, remembering the result by the digest of the document so that files read repeatedly within a process (configuration includes, plugin configuration) are parsed only once.  Each call returns a fresh copy that the caller may modify.
+
+    :param source: A string, bytes, or a file opened for reading.
+    """
+    if hasattr(source, 'read'):
+        source = source.read()
+    return _yaml_cache.load(source)
+
+
+def __getattr__(name):
+    # Importing mako also imports pygments and most of its lexers, so
+    # the template lookup is only constructed when first used.
+    if name == 'mako_lookup':
+        global mako_lookup
+        import mako.lookup
+        mako_lookup = mako.lookup.TemplateLookup([import_resources_files(__package__) / "resources/templates"],
+                                                 strict_undefined=True)
+        return mako_lookup
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def is_optional_type(t):
@@ -471,7 +619,10 @@ __all__ = ['when_needed', 'possibly_async', 'permute_identifier', 'memoproperty'
            'validate_shell_safe',
            'is_optional_type',
            'TemporaryMountPoint',
+           'wait_for_mount',
            'import_resources_files',
+           'YamlLoader', 'YamlDumper',
+           'yaml_load', 'yaml_dump', 'yaml_load_cached',
            'mako_lookup',
            'file_locked',
            'file_last_modified',
@@ -200,8 +200,8 @@ class DistributedPortgroup(VmwareNetwork):
         for n in others:
             if isinstance(n, BridgeNetwork):
                 trunk = await self._get_trunk()
-                ni = trunk.expose_vlan(self.network.vlan_id)
-                n.add_member(ni)
+                ni = await trunk.async_expose_vlan(self.network.vlan_id)
+                await n.async_add_member(ni)
 
     async def _get_trunk(self):
         trunk_base = await self.ainjector.get_instance_async(vmware_trunk_key)
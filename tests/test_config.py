@@ -8,9 +8,11 @@
 
 import pytest
 import os.path
+import threading
 import yaml
 from carthage.config import *
 from carthage.config import types as ct
+from carthage.config.schema import ConfigResolutionFailed, _cached_resolution
 from carthage.dependency_injection import Injector, inject
 resource_dir = os.path.dirname(__file__)
 
@@ -59,3 +61,77 @@ def test_config_bool(ainjector):
     assert injector(ct.ConfigBool, '') is False
     assert injector(ct.ConfigBool, 'false') is False
     
+
+def test_config_string_cache(ainjector):
+    class CachedStrings(ConfigSchema, prefix="cache_test"):
+        top: str = "a"
+        leaf: str = "{cache_test.top}/leaf"
+        env: str = "${CARTHAGE_CACHE_TEST-unset}"
+    injector = ainjector.injector(Injector)
+    cl = injector(ConfigLayout)
+    assert cl.cache_test.leaf == "a/leaf"
+    cl.cache_test.top = "b"
+    assert cl.cache_test.leaf == "b/leaf"
+    child = injector(Injector)
+    child.add_provider(config_key("cache_test.top"), "c")
+    assert child(ConfigLayout).cache_test.leaf == "c/leaf"
+    assert cl.cache_test.leaf == "b/leaf"
+    assert cl.cache_test.env == "unset"
+    os.environ['CARTHAGE_CACHE_TEST'] = 'set'
+    try:
+        assert cl.cache_test.env == "set"
+    finally:
+        del os.environ['CARTHAGE_CACHE_TEST']
+
+def test_config_cache_threads(ainjector):
+    class ThreadStrings(ConfigSchema, prefix="thread_test"):
+        top: str = "a"
+        leaf: str = "{thread_test.top}/leaf"
+    injector = ainjector.injector(Injector)
+    cl = injector(ConfigLayout)
+    resolutions = 0
+    def resolve():
+        # A lookup in another thread must not be recorded against this resolution.
+        nonlocal resolutions
+        resolutions += 1
+        thread = threading.Thread(target=lambda: cl.thread_test.leaf)
+        thread.start()
+        thread.join()
+        return "value"
+    assert _cached_resolution(injector, "thread_test", resolve) == "value"
+    cl.thread_test.top = "b"
+    assert _cached_resolution(injector, "thread_test", resolve) == "value"
+    assert resolutions == 1
+
+def test_config_string_compile(ainjector):
+    injector = ainjector.injector
+    assert ct.ConfigString.compile(r"a\{b$c") == ("a{b$c",)
+    assert ct.ConfigString.compile("x{a{b}}${v-d}") == (
+        "x", (False, ("a", (False, ("b",)))), (True, ("v-d",)))
+    with pytest.raises(ValueError):
+        ct.ConfigString.compile("{a")
+    with pytest.raises(ValueError):
+        ct.ConfigString.compile("a}")
+    assert injector(ct.ConfigString, r"\{literal\}") == "{literal}"
+
+def test_config_snapshot(ainjector):
+    class SnapshotStrings(ConfigSchema, prefix="snapshot_test"):
+        top: str = "a"
+        leaf: str = "{snapshot_test.top}/leaf"
+        broken: str = "{snapshot_test.missing}"
+        count: int = 3
+    injector = ainjector.injector(Injector)
+    cl = injector(ConfigLayout)
+    snapshot = cl.snapshot_test._snapshot()
+    assert snapshot.leaf == "a/leaf"
+    assert snapshot.count == 3
+    assert cl._snapshot().snapshot_test.leaf == "a/leaf"
+    with pytest.raises(ConfigResolutionFailed):
+        snapshot.broken
+    with pytest.raises(TypeError):
+        snapshot.top = "b"
+    assert cl.snapshot_test._snapshot() is snapshot
+    cl.snapshot_test.top = "b"
+    snapshot = cl.snapshot_test._snapshot()
+    assert snapshot.leaf == "b/leaf"
+    assert snapshot._asdict()['top'] == "b"
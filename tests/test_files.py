@@ -0,0 +1,62 @@
+# Copyright (C) 2026, Hadron Industries, Inc.
+# Carthage is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation. It is distributed
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
+# LICENSE for details.
+
+import asyncio
+import contextlib
+import os
+import shutil
+import pytest
+from pathlib import Path
+import carthage
+from carthage.pytest import *
+import carthage.files
+from carthage.files import prepare_git_tree, git_tree_hash
+
+state_dir = Path(__file__).parent.joinpath("test_state")
+
+
+@pytest.fixture()
+def ainjector(ainjector):
+    ainjector = ainjector.claim("test_files.py")
+    config = ainjector.injector(carthage.ConfigLayout)
+    config.state_dir = state_dir
+    os.makedirs(state_dir, exist_ok=True)
+    yield ainjector
+    ainjector.close()
+    shutil.rmtree(state_dir, ignore_errors=True)
+
+
+@async_test
+async def test_prepare_git_tree_cached(ainjector):
+    resource_dir = Path(__file__).parent
+    prepared = await ainjector(prepare_git_tree, resource_dir)
+    assert prepared.name == git_tree_hash(resource_dir)
+    assert prepared.joinpath('carthage/files.py').exists()
+    prepared.joinpath('marker').write_text('')
+    assert await ainjector(prepare_git_tree, resource_dir.parent) == prepared
+    # Reused rather than cloned again
+    assert prepared.joinpath('marker').exists()
+
+
+@async_test
+async def test_prepare_git_tree_concurrent(ainjector):
+    resource_dir = Path(__file__).parent
+    results = await asyncio.gather(*(ainjector(prepare_git_tree, resource_dir) for i in range(4)))
+    assert len(set(results)) == 1
+
+
+@async_test
+async def test_prepare_git_tree_prune_in_use(ainjector, monkeypatch):
+    resource_dir = Path(__file__).parent
+    monkeypatch.setattr(carthage.files, 'git_tree_cache_retain', 0)
+    with contextlib.ExitStack() as stack:
+        prepared = await ainjector(prepare_git_tree, resource_dir, stack=stack)
+        await ainjector(prepare_git_tree, resource_dir)
+        assert prepared.exists()
+    await ainjector(prepare_git_tree, resource_dir)
+    assert not prepared.exists()
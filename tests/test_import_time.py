@@ -0,0 +1,61 @@
+# Copyright (C) 2026, Hadron Industries, Inc.
+# Carthage is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation. It is distributed
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
+# LICENSE for details.
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+import carthage
+
+source_root = Path(carthage.__file__).parents[1]
+
+#: Modules that ``import carthage`` should not pull in.  Adding an
+#: eager import of one of these is almost always an accidental
+#: regression in start-up time.
+lazy_modules = {
+    'mako', 'pygments',
+    'carthage.debian', 'carthage.dns', 'carthage.pki',
+    'carthage.system_dependency', 'carthage.vm',
+}
+
+
+def import_carthage(module='carthage'):
+    '''Import *module* in a fresh interpreter.
+
+    :returns: A tuple of the modules loaded and the cumulative import time of carthage in microseconds as reported by ``-X importtime``.
+    '''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f'import sys, json, {module}; print(json.dumps(sorted(sys.modules)))'],
+        cwd=source_root, capture_output=True, text=True, check=True)
+    modules = set(json.loads(result.stdout.splitlines()[-1]))
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == 'carthage':
+            return modules, int(fields[1])
+    raise AssertionError('carthage import time not reported')
+
+
+def test_import_time():
+    modules, import_us = import_carthage()
+    print(f'import carthage: {import_us/1000:.1f}ms, {len(modules)} modules')
+    assert not (modules & lazy_modules), f'eagerly imported: {modules & lazy_modules}'
+
+
+def test_runner_commands_import():
+    modules, import_us = import_carthage('carthage.runner_commands')
+    assert not (modules & lazy_modules), f'eagerly imported: {modules & lazy_modules}'
+
+
+def test_lazy_names():
+    from carthage.debian import DebianContainerImage
+    assert carthage.DebianContainerImage is DebianContainerImage
+    assert carthage.pki.PkiManager
+    assert 'DnsZone' in dir(carthage)
+    for name in carthage.__all__:
+        assert getattr(carthage, name) is not None
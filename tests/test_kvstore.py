@@ -5,15 +5,18 @@
 # WITHOUT ANY WARRANTY; without even the implied warranty of
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
+import asyncio
 import dataclasses
 import os
 import shutil
 import pytest
+import yaml
 from pathlib import Path
 import carthage
 from carthage.pytest import *
 from carthage import *
 from carthage.kvstore import *
+from carthage.kvstore import kv_key
 from carthage.modeling import *
 
 class TestAssignments(HashedRangeAssignments):
@@ -161,7 +164,8 @@ async def test_dump_load(ainjector):
     o2 = AssignedObj(2,6)
     o3 = AssignedObj(1,6)
     o4 = AssignedObj(3,5)
-    objs = [o1, o2, o3, o4]
+    # Most constrained first so any hash placement can satisfy all four
+    objs = [o4, o1, o2, o3]
     assignments = await ainjector(TestAssignments, objs)
     assignments.do_assignments()
     kvstore = ainjector.get_instance(KvStore)
@@ -178,6 +182,244 @@ async def test_dump_load(ainjector):
         assert o.assignment == correct_assignments[o.key]
         
     
+@async_test
+async def test_assign_many(ainjector):
+    objs = [AssignedObj(10, 40) for i in range(20)]
+    for o in objs: o.hash = 20
+    assignments = await ainjector(TestAssignments, objs)
+    assignments.new_assignments()
+    static = AssignedObj(10, 40)
+    assignments.assign_many([(o.key, o) for o in objs],
+                            forced=[(static.key, static, 20)])
+    static.assignment = 20
+    assignments.objs.append(static)
+    assignments.check_consistency()
+    # An exhausted batch records nothing
+    extra = [AssignedObj(10, 40) for i in range(20)]
+    assignments.new_assignments()
+    with pytest.raises(AssignmentsExhausted):
+        assignments.assign_many([(o.key, o) for o in extra])
+    assert all(o.assignment is None for o in extra)
+
+@async_test
+async def test_occupancy_rebuilt(ainjector):
+    "Stores written before the occupancy bitmap existed still avoid taken assignments"
+    o1 = AssignedObj(0, 3)
+    o2 = AssignedObj(0, 3)
+    o1.hash = o2.hash = 0
+    assignments = await ainjector(TestAssignments, [o1])
+    assignments.do_assignments()
+    kvstore = ainjector.get_instance(KvStore)
+    with kvstore.environment.begin(write=True) as txn:
+        prefix = kv_key('test_domain/occupied', '')
+        with txn.cursor() as csr:
+            csr.set_range(prefix)
+            while csr.key().startswith(prefix) and csr.delete(): pass
+    assignments2 = await ainjector(TestAssignments, [o2, o1])
+    assignments2.do_assignments()
+    assert o1.assignment == 0
+    assignments2.check_consistency()
+
+@async_test
+async def test_occupancy_other_writers(ainjector):
+    "Assignments written or deleted without updating the bitmap are noticed"
+    objs = [AssignedObj(0, 3) for i in range(2)]
+    for o in objs: o.hash = 0
+    assignments = await ainjector(TestAssignments, objs)
+    assignments.do_assignments()
+    assert {o.assignment for o in objs} == {0, 1}
+    # Written behind the bitmap's back
+    assignments._assignments.put('2', 'other')
+    assignments.valid_key = lambda key: key == 'other' or any(o.key == key for o in assignments.objs)
+    late = AssignedObj(0, 3)
+    late.hash = 2
+    assignments.objs.append(late)
+    assignments._assign(late.key, late)
+    assert late.assignment == 3
+    assert assignments._assignments.get('2') == 'other'
+    # Deleted behind the bitmap's back; the per-assignment interface also keeps it current
+    assignments._assignments.delete('2')
+    again = AssignedObj(0, 3)
+    assert assignments._try_assignment(again.key, again, '2', False) is True
+    assert again.assignment == 2
+    with assignments.store.transaction() as t:
+        assert 2 in assignments._bitmap(t.txn)
+
+@async_test
+async def test_occupancy_jump(ainjector, monkeypatch):
+    "In a nearly full range only the nearest free assignment is examined"
+    objs = [AssignedObj(0, 99) for i in range(99)]
+    for o in objs: o.hash = 50
+    assignments = await ainjector(TestAssignments, objs)
+    assignments.do_assignments()
+    free = (set(range(100)) - {o.assignment for o in objs}).pop()
+    last = AssignedObj(0, 99)
+    last.hash = 50
+    assignments.objs.append(last)
+    tried = []
+    try_in_txn = assignments._try_in_txn
+    def counting_try(txn, bitmap, made, key, assignment, reallocate):
+        tried.append(assignment)
+        return try_in_txn(txn, bitmap, made, key, assignment, reallocate)
+    monkeypatch.setattr(assignments, '_try_in_txn', counting_try)
+    assignments._assign(last.key, last)
+    assert last.assignment == free
+    assert tried == [str(free)]
+    assignments.check_consistency()
+
+def probe_counts(assignments, keys, size, occupancy_levels):
+    "Mean probes per insertion, sampled as the range fills past each level."
+    taken = set()
+    results = {}
+    window = []
+    obj = AssignedObj(0, size-1)
+    levels = iter(occupancy_levels)
+    level = next(levels)
+    for key in keys:
+        probes = 0
+        for candidate in assignments.possible_assignments(key, obj):
+            probes += 1
+            if candidate not in taken: break
+        taken.add(candidate)
+        window.append(probes)
+        if len(taken) >= level*size:
+            results[level] = sum(window)/len(window)
+            window = []
+            try: level = next(levels)
+            except StopIteration: break
+    return results
+
+@async_test
+async def test_hash_probe_counts(ainjector, record_property):
+    "Compare probes at 50/90/99% occupancy for digest and legacy hashing"
+    size = 1024
+    keys = [f'web{i:02d}|eth{i%4}' for i in range(size)]
+    levels = (0.5, 0.9, 0.99)
+    assignments = await ainjector(TestAssignments, [])
+    digest = probe_counts(assignments, keys, size, levels)
+    assignments.legacy_hash = True
+    legacy = probe_counts(assignments, keys, size, levels)
+    for level in levels:
+        record_property(f'probes_{level:.0%}_digest', round(digest[level], 2))
+        record_property(f'probes_{level:.0%}_legacy', round(legacy[level], 2))
+        assert digest[level] < legacy[level]
+    assert digest[0.5] < 3
+
+@async_test
+async def test_hash_migration_keeps_hints(ainjector):
+    "Assignments made with the legacy hash survive switching hash"
+    objs = [AssignedObj(0, 63) for i in range(10)]
+    assignments = await ainjector(TestAssignments, objs)
+    assignments.legacy_hash = True
+    assignments.do_assignments()
+    before = {o.key: o.assignment for o in objs}
+    assignments.legacy_hash = False
+    assignments.do_assignments()
+    assert before == {o.key: o.assignment for o in objs}
+
+@async_test
+async def test_transaction(ainjector):
+    kvstore = ainjector.get_instance(KvStore)
+    d1 = kvstore.domain('txn/one', False)
+    d2 = kvstore.domain('txn/two', True)
+    with kvstore.transaction():
+        d1.put_many({'a': '1', 'b': '2'})
+        d2.put('c', '3')
+        with kvstore.transaction() as inner:
+            assert d1.get('a') == '1'
+    assert d1.get_many(['a', 'b', 'z'], default='none') == dict(a='1', b='2', z='none')
+    with pytest.raises(KvConsistency):
+        d1.put_many(dict(b='4', e='5'))
+    assert d1.get('e') is None
+    with pytest.raises(RuntimeError):
+        with kvstore.transaction():
+            d1.put('f', '6')
+            d2.delete('c')
+            raise RuntimeError
+    assert d1.get('f') is None
+    assert d2['c'] == '3'
+    with kvstore.transaction(write=False):
+        with pytest.raises(KvConsistency):
+            d1.put('g', '7')
+    # A task outliving the transaction it inherited cannot keep writing
+    started = asyncio.Event()
+    async def late_writer():
+        await started.wait()
+        d1.put('h', '8')
+    with kvstore.transaction():
+        task = asyncio.create_task(late_writer())
+    started.set()
+    with pytest.raises(KvConsistency):
+        await task
+    assert d1.get('h') is None
+
+@async_test
+async def test_dump_domains(ainjector):
+    kvstore = ainjector.get_instance(KvStore)
+    kvstore.domain('a', True).put_many({'1': 'one', 'yes': 'no'})
+    kvstore.domain('a:b', True).put('x', 'y')
+    kvstore.domain('private', False).put('secret', 's')
+    kvstore.domain('zz', True)
+    await kvstore.async_dump(state_dir/'dump.yml', lambda d, k, v: k != 'yes')
+    assert yaml.safe_load((state_dir/'dump.yml').read_text()) == {
+        'a': {'1': 'one'},
+        'a:b': {'x': 'y'},
+        'zz': {}}
+    # Existing values win over the dump
+    kvstore.domain('a', True).put('1', 'changed', overwrite=True)
+    kvstore.domain('a', True).delete('yes')
+    kvstore.domain('a:b', True).delete('x')
+    await kvstore.async_load(state_dir/'dump.yml')
+    assert kvstore.domain('a', True).get_many(['1', 'yes']) == {'1': 'changed', 'yes': None}
+    assert kvstore.domain('a:b', True)['x'] == 'y'
+
+@async_test
+async def test_read_snapshot(ainjector):
+    kvstore = ainjector.get_instance(KvStore)
+    cached = kvstore.domain('snap', False, cached=True)
+    other = kvstore.domain('snap', False)
+    cached.put('a', '1')
+    with kvstore.read_snapshot():
+        assert cached.get('a') == '1'
+        snapshot = kvstore._current_snapshot.get()
+        assert snapshot.caches['snap'] == {'a': '1'}
+        # Writes through any domain object are visible
+        other.put('a', '2', overwrite=True)
+        assert cached.get('a') == '2'
+        with kvstore.transaction():
+            other.put('b', '3')
+            assert cached.get('b') == '3'
+        assert cached['b'] == '3'
+        with pytest.raises(RuntimeError):
+            with kvstore.transaction():
+                other.put('c', '4')
+                raise RuntimeError
+        assert cached.get('c') is None
+    assert kvstore._current_snapshot.get() is None
+
+@async_test
+async def test_mac_store_load(ainjector):
+    macs = state_dir/'macs.yml'
+    macs.write_text(yaml.dump({'m1': {'eth0': '02:00:00:00:00:01', 'eth1': '02:00:00:00:00:02'}}))
+    store = await ainjector(MacStore)
+    assert store[('m1', 'eth0')] == '02:00:00:00:00:01'
+    store[('m1', 'eth1')] = '02:00:00:00:00:ff'
+    # Unchanged file is not reimported
+    store = await ainjector(MacStore)
+    assert store[('m1', 'eth1')] == '02:00:00:00:00:ff'
+    # A touched file with the same contents is not reimported either
+    os.utime(macs, ns=(0, 0))
+    store = await ainjector(MacStore)
+    assert store[('m1', 'eth1')] == '02:00:00:00:00:ff'
+    # Only entries changed in the file are written
+    macs.write_text(yaml.dump({'m1': {'eth0': '02:00:00:00:00:03', 'eth1': '02:00:00:00:00:02'}}))
+    store = await ainjector(MacStore)
+    assert store[('m1', 'eth0')] == '02:00:00:00:00:03'
+    assert store[('m1', 'eth1')] == '02:00:00:00:00:ff'
+    macs.write_text(yaml.dump({'m1': {'eth0': '02:00:00:00:00:03', 'eth1': '02:00:00:00:00:04'}}))
+    store = await ainjector(MacStore)
+    assert store[('m1', 'eth1')] == '02:00:00:00:00:04'
+
 class layout(CarthageLayout):
     class config(NetworkConfigModel):
         add('eth0', mac=None, net=injector_access('pool_network'),
@@ -515,3 +515,88 @@ async def test_machine_model_leakage(ainjector):
     filter_result = l.injector.filter(MachineModel, ['role'])
     assert filter_result == []
     
+
+def test_provider_template(injector):
+    class Foo(Injectable): pass
+    class Layout(InjectableModel):
+        add_provider(InjectionKey("foo"), Foo)
+        add_provider(InjectionKey("other_foo"), Foo)
+    first = injector(Layout)
+    second = injector(Layout)
+    assert Layout._provider_templates[1].keys() == {frozenset()}
+    for model in (first, second):
+        foo = model.injector.get_instance(InjectionKey("foo"))
+        assert isinstance(foo, Foo)
+        assert model.injector.get_instance(InjectionKey("other_foo")) is foo
+        assert model.injector.get_instance(Foo) is foo
+    assert first.injector.get_instance(Foo) is not second.injector.get_instance(Foo)
+    # A provider already present in the instance injector is replaced individually
+    class Preset(Injectable):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.injector.add_provider(InjectionKey("foo"), "placeholder")
+    class Replaced(Layout, Preset): pass
+    replaced = injector(Replaced)
+    assert isinstance(replaced.injector.get_instance(InjectionKey("foo")), Foo)
+
+@async_test
+async def test_bounded_resolve_networking(ainjector):
+    resolved = []
+    tasks = set()
+    class Counted(MachineModel, template=True):
+        async def resolve_model(self, force=False):
+            resolved.append(self.name)
+            tasks.add(asyncio.current_task())
+            return await super().resolve_model(force=force)
+
+    class Layout(ModelGroup):
+
+        class net(NetworkModel):
+            name = "the-net"
+
+        class zeta(Counted):
+            name = "zeta.foo.com"
+            class nc(NetworkConfigModel):
+                add('eth0', net=injector_access('net'), mac=None)
+
+        class alpha(Counted):
+            name = "alpha.foo.com"
+            class nc(NetworkConfigModel):
+                add('eth0', net=injector_access('net'), mac=None)
+
+    l = await ainjector(Layout)
+    resolved.clear()
+    tasks.clear()
+    progress = []
+    await l.resolve_networking(force=True, concurrency=1,
+                               progress=lambda stage, m, completed, total: progress.append((stage, m.name, completed, total)))
+    assert resolved == ["alpha.foo.com", "zeta.foo.com"]
+    assert progress == [('resolve', 'alpha.foo.com', 1, 2), ('resolve', 'zeta.foo.com', 2, 2)]
+    # One worker resolved both models rather than a task per model
+    assert len(tasks) == 1
+    resolved.clear()
+    await l.resolve_networking(incremental=True)
+    assert resolved == []
+    nc = l.alpha.injector.get_instance(NetworkConfig)
+    nc.add('eth1', net=l.net, mac=None)
+    await l.resolve_networking(incremental=True)
+    assert resolved == ["alpha.foo.com"]
+    assert set(l.alpha.network_links) == {'eth0', 'eth1'}
+
+def test_transclusion_cache(injector):
+    from carthage.modeling.base import _transclusion_statistics
+    key = InjectionKey("transcluded")
+    class Model(InjectableModel):
+        add_provider(key, "inner")
+    Model.__transclusions__[key] = frozenset({key})
+    parent = injector(Injector)
+    parent.claim()
+    assert injector(Model).injector.get_instance(key) == "inner"
+    assert parent(Model).injector.get_instance(key) == "inner"
+    hits = _transclusion_statistics['hits']
+    assert parent(Model).injector.get_instance(key) == "inner"
+    assert _transclusion_statistics['hits'] == hits+1
+    parent.add_provider(key, "outer")
+    rechecks = _transclusion_statistics['rechecks']
+    assert parent(Model).injector.get_instance(key) == "outer"
+    assert _transclusion_statistics['rechecks'] == rechecks+1
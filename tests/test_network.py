@@ -6,13 +6,14 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
 
+import asyncio
 from carthage.pytest import *
 import pytest
 import posix
 from ipaddress import *
-from carthage import base_injector
+from carthage import base_injector, sh, ConfigLayout, config_key
 import carthage.network.config
-from carthage.network import Network, BridgeNetwork, V4Config, address_within_network
+from carthage.network import Network, BridgeNetwork, V4Config, address_within_network, LinkIndex, match_link
 from carthage.dependency_injection import *
 from carthage.modeling import *
 
@@ -41,6 +42,52 @@ async def test_network_veth(injector, loop):
     net.close()
 
 
+@async_test
+async def test_network_pools(injector, loop):
+    from types import SimpleNamespace
+    from carthage.network import NamespacePool
+    from carthage.network.base import _allocated_interfaces
+    injector.replace_provider(ConfigLayout)
+    injector.add_provider(config_key("network_pool_size"), 2)
+    ainjector = injector(AsyncInjector)
+    pool = await ainjector(NamespacePool)
+    net = await ainjector(Network, name="poolnet")
+    bridge = await net.access_by(BridgeNetwork)
+    try:
+        for i in range(100):
+            if len(pool.available) == 2 and len(bridge.veth_pool.available) == 2: break
+            await asyncio.sleep(0.05)
+        pooled_names = list(pool.available)
+        assert len(pooled_names) == 2
+        link = SimpleNamespace(interface='eth0', mac='02:00:00:00:01:01', mtu=1400,
+                               machine=SimpleNamespace(name='pooled'))
+        namespace = pool.take({'eth0': link})
+        assert namespace.name == pooled_names[0]
+        host, peer = bridge.veth_pool.available[0]
+        veth_names = {n for pair in bridge.veth_pool.available for n in pair}
+        ve = await bridge.async_add_veth(link, namespace)
+        assert ve.ifname == host
+        inside = str(await sh.ip('-n', namespace.name, 'link', 'show', 'eth0'))
+        assert '02:00:00:00:01:01' in inside and 'mtu 1400' in inside
+        namespace.close()
+        ve.close()
+    finally:
+        pool.close()
+        bridge.close()
+        net.close()
+    namespaces = str(await sh.ip('netns', 'list'))
+    assert not any(name in namespaces for name in pooled_names)
+    # Names are released once their interfaces are gone
+    assert not (veth_names | {bridge.bridge_name}) & _allocated_interfaces
+
+def test_veth_pool_names():
+    from carthage.network.base import VethPool, _allocated_interfaces
+    pool = VethPool(bridge=None, size=0)
+    names = [pool._name('cp') for i in range(1000)]
+    assert len(set(names)) == 1000
+    assert all(len(n) <= 15 for n in names)
+    _allocated_interfaces.difference_update(names)
+
 @async_test
 async def test_v4_config_secondary_expand(ainjector):
     '''Test v4_config with deferred elements and secondary addresses
@@ -113,3 +160,78 @@ async def test_address_within(ainjector):
     l = await ainjector(layout)
     assert str(l.machine.network_links['eth0'].merged_v4_config.address) == '10.0.0.1'
     
+
+
+@async_test
+async def test_match_link_index(ainjector):
+    class layout(CarthageLayout):
+
+        @provides('net')
+        class net(NetworkModel):
+            v4_config = V4Config(network='10.0.0.0/8')
+
+        class machine(MachineModel):
+            class net_config(NetworkConfigModel):
+                add('eth0', mac='02:00:00:00:00:01', net=InjectionKey('net'),
+                    v4_config=V4Config(address='10.0.0.1'))
+                add('eth1', mac='02:00:00:00:00:02', net=InjectionKey('net'),
+                    v4_config=V4Config(address='10.0.0.2'))
+                add('eth2', mac=None, net=InjectionKey('net'),
+                    v4_config=V4Config(address='10.0.0.3'))
+
+    l = await ainjector(layout)
+    links = l.machine.network_links
+    index = LinkIndex(links)
+    excluded = set()
+    assert match_link(links, 'ens4', mac='02:00:00:00:00:02', index=index, excluded_links=excluded) is links['eth1']
+    assert match_link(links, 'ens5', address='10.0.0.3', index=index, excluded_links=excluded) is links['eth2']
+    assert match_link(links, 'ens6', mac='02:00:00:00:00:02', index=index, excluded_links=excluded) is None
+    assert match_link(links, 'eth0', mac='02:00:00:00:00:01', index=index, excluded_links=excluded) is links['eth0']
+    assert excluded == {'eth0', 'eth1', 'eth2'}
+    # Networks already instantiated are reused when links are resolved again
+    await l.machine.resolve_networking(force=True)
+    assert l.machine.network_links['eth0'].net is l.net
+
+@async_test
+async def test_ip_batch_attribution(loop):
+    from carthage.network.base import IpBatcher, IpCommandFailed
+    batcher = IpBatcher()
+    results = await asyncio.gather(
+        batcher.run('link', 'show', 'lo'),
+        batcher.run('link', 'show', 'carthagenone0'),
+        batcher.run('link', 'show', 'lo'),
+        return_exceptions=True)
+    assert results[0] is None
+    assert isinstance(results[1], IpCommandFailed)
+    assert 'carthagenone0' in results[1].message
+    assert results[2] is None
+
+
+@async_test
+async def test_ip_batch_cancelled(loop):
+    from carthage.network.base import IpBatcher
+    batcher = IpBatcher()
+    batcher.window = 10
+    future = batcher.run('link', 'show', 'lo')
+    await asyncio.sleep(0)
+    batcher.flush_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(future, 1)
+    assert batcher.pending == [] and batcher.flush_task is None
+
+
+def test_hash_network_links_legacy_stamp():
+    from types import SimpleNamespace
+    from carthage.network.base import hash_network_links, _legacy_hash_network_links
+    def link(mtu):
+        return SimpleNamespace(
+            net=SimpleNamespace(name='net'), mac='02:00:00:00:00:01',
+            machine=SimpleNamespace(name='host'), mtu=mtu,
+            allowed_vlans=None, untagged_vlan=None, v4_config=None)
+    links = {'eth0': link(1500)}
+    legacy = str(_legacy_hash_network_links(links))
+    # A stamp from before the digest still matches unchanged links
+    assert hash_network_links(links, previous=legacy) == legacy
+    assert hash_network_links(links) != legacy
+    changed = {'eth0': link(9000)}
+    assert hash_network_links(changed, previous=legacy) == hash_network_links(changed)
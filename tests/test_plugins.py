@@ -42,3 +42,55 @@ def test_plugin_mappings(injector):
         expected = _parse_plugin_spec(test['expected'])
         assert mapped == expected, f'Unexpected result mapping {spec}'
         
+
+def make_plugin_repo(path, name, **metadata):
+    '''Create a git repository containing a plugin with two commits; return the first revision.
+    '''
+    import sh
+    git = sh.git.bake('-c', 'user.name=Carthage', '-c', 'user.email=carthage@example.com', _cwd=path)
+    path.mkdir()
+    git.init('-q')
+    metadata_path = path/'carthage_plugin.yml'
+    metadata_path.write_text(yaml.safe_dump(dict(name=name, **metadata)))
+    git.add('carthage_plugin.yml')
+    git.commit('-qm', 'first')
+    first = str(git('rev-parse', 'HEAD')).strip()
+    metadata_path.write_text(yaml.safe_dump(dict(name=name, second=True, **metadata)))
+    git.commit('-qam', 'second')
+    return first
+
+def test_git_plugins(injector, tmp_path):
+    from carthage import plugins, config_key, ConfigLayout
+    from carthage.plugins import prefetch_plugins, CarthagePlugin
+    base_revision = make_plugin_repo(tmp_path/'plugin-base', 'git_test_base')
+    base_spec = dict(type='git', url=f'file://{tmp_path}/plugin-base', revision=base_revision)
+    make_plugin_repo(tmp_path/'plugin-top', 'git_test_top', config=dict(plugins=[base_spec]))
+    checkout = tmp_path/'checkout'
+    injector.replace_provider(ConfigLayout)
+    injector.add_provider(config_key('checkout_dir'), str(checkout))
+    plugins._fetched_checkouts.clear()
+    # Fetches the plugin named in plugin-top's configuration as well
+    injector(prefetch_plugins, [dict(type='git', url=f'file://{tmp_path}/plugin-top')])
+    assert plugins._git_head(checkout/'plugin-base') == base_revision
+    assert 'second' in (checkout/'plugin-top/carthage_plugin.yml').read_text()
+    # A pinned revision that is already checked out does not need the remote
+    plugins._fetched_checkouts.clear()
+    (tmp_path/'plugin-base').rename(tmp_path/'moved')
+    injector(load_plugin, base_spec)
+    plugin = injector.get_instance(InjectionKey(CarthagePlugin, name='git_test_base'))
+    assert 'second' not in plugin.metadata
+    assert (checkout/'plugin-base/.git/carthage_plugin_metadata.json').exists()
+
+
+def test_path_plugin_metadata_not_cached_in_git(injector, tmp_path):
+    from carthage.plugins import _read_plugin_metadata
+    make_plugin_repo(tmp_path/'plugin-path', 'git_test_path')
+    assert _read_plugin_metadata(tmp_path/'plugin-path/carthage_plugin.yml')['name'] == 'git_test_path'
+    assert not (tmp_path/'plugin-path/.git/carthage_plugin_metadata.json').exists()
+
+def test_prefetch_does_not_prompt(injector, tmp_path, monkeypatch):
+    from carthage import plugins
+    monkeypatch.setenv('GIT_SSH_COMMAND', 'ssh -F /dev/null')
+    env = plugins._noninteractive_git_env()
+    assert env['GIT_TERMINAL_PROMPT'] == '0'
+    assert env['GIT_SSH_COMMAND'] == 'ssh -F /dev/null -o BatchMode=yes'
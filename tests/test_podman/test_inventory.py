@@ -0,0 +1,142 @@
+# Copyright (C) 2026, Hadron Industries, Inc.
+# Carthage is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation. It is distributed
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
+# LICENSE for details.
+
+import asyncio
+import json
+import pytest
+import carthage.sh
+from carthage import *
+from carthage.podman.container_host import PodmanContainerHost
+from carthage.pytest import *
+
+
+class ScriptedContainerHost(PodmanContainerHost):
+
+    '''Answers podman commands from canned objects rather than running podman.'''
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.commands = []
+        self.listing_fails = False
+        self.objects = dict(
+            container=[dict(Id=f'c{i}', Name=f'container-{i}', Created='2026-01-01T00:00:00Z') for i in range(10)],
+            pod=[],
+            image=[dict(Id='i1', RepoTags=['localhost/base:latest'], Created='2026-01-01T00:00:00Z')],
+            volume=[dict(Name='data', CreatedAt='2026-01-01T00:00:00Z')],
+        )
+
+    async def podman(self, *args, _log=True, **kwargs):
+        with self.inventory.command(args):
+            return await self.run_podman(*args)
+
+    async def run_podman(self, *args):
+        self.commands.append(args)
+        if self.listing_fails and args[0] == 'ps':
+            raise OSError('connection to container host lost')
+        if args[0] == 'ps':
+            return json.dumps([dict(Id=c['Id']) for c in self.objects['container']])
+        if args[1] == 'ps' or args[1] == 'ls':
+            field = 'Name' if args[0] == 'volume' else 'Id'
+            return json.dumps([{field: o[field]} for o in self.objects[args[0]]])
+        if args[1] == 'inspect':
+            found = [o for o in self.objects[args[0]]
+                     if o.get('Id') in args[2:] or o.get('Name') in args[2:]
+                     or set(o.get('RepoTags', [])) & set(args[2:])]
+            if not found:
+                raise carthage.sh.ErrorReturnCode_125(' '.join(args).encode(), b'', b'no such object')
+            return json.dumps(found)
+        if args[:2] == ('container', 'create'):
+            await asyncio.sleep(0.05)
+            name = args[args.index('--name')+1]
+            self.objects['container'].append(dict(Id='id-'+name, Name=name, Created='2026-01-01T00:00:00Z'))
+        return ''
+
+
+@async_test
+async def test_inventory_snapshot(ainjector):
+    host = await ainjector(ScriptedContainerHost)
+    inventory = host.inventory
+    for i in range(10):
+        info = await inventory.inspect('container', f'container-{i}')
+        assert info['Id'] == f'c{i}'
+    assert await inventory.inspect('container', 'missing') is None
+    assert host.commands == [('ps', '-a', '--format', 'json'),
+                             ('container', 'inspect', *(f'c{i}' for i in range(10)))]
+    assert (await inventory.inspect('image', 'localhost/base'))['Id'] == 'i1'
+    assert (await inventory.inspect('volume', 'data'))['Name'] == 'data'
+    # Images absent from the snapshot are inspected individually
+    host.commands.clear()
+    assert await inventory.inspect('image', 'base:other') is None
+    assert host.commands == [('image', 'inspect', 'base:other')]
+    # Read-only commands leave the snapshot alone; anything else discards it.
+    await host.podman('container', 'logs', 'container-1')
+    host.commands.clear()
+    await inventory.inspect('container', 'container-1')
+    assert host.commands == []
+    await host.podman('container', 'create', '--name', 'container-10', 'localhost/base')
+    assert (await inventory.inspect('container', 'container-10'))['Id'] == 'id-container-10'
+    # Only the created container is inspected individually; the rest of the snapshot stands.
+    host.commands.clear()
+    await inventory.inspect('container', 'container-2')
+    assert host.commands == []
+
+
+@async_test
+async def test_inventory_concurrent_create(ainjector):
+    host = await ainjector(ScriptedContainerHost)
+    inventory = host.inventory
+    async def create_and_find(name):
+        await host.podman('container', 'create', '--name', name, 'localhost/base')
+        return await inventory.inspect('container', name)
+    async def find_during_create():
+        await asyncio.sleep(0.01)
+        return await inventory.inspect('container', 'container-1')
+    created, found = await asyncio.gather(create_and_find('new'), find_during_create())
+    assert created['Id'] == 'id-new'
+    assert found['Id'] == 'c1'
+    # The snapshot taken during the create remains in use for other containers.
+    listings = sum(1 for c in host.commands if c[0] == 'ps')
+    for i in range(10):
+        await inventory.inspect('container', f'container-{i}')
+    assert sum(1 for c in host.commands if c[0] == 'ps') == listings
+    assert (await inventory.inspect('container', 'new'))['Id'] == 'id-new'
+
+
+@async_test
+async def test_inventory_disabled(ainjector):
+    ainjector.replace_provider(ConfigLayout)
+    ainjector.injector(ConfigLayout).podman.inventory_max_age = 0
+    host = await ainjector(ScriptedContainerHost)
+    assert (await host.inventory.inspect('container', 'container-3'))['Id'] == 'c3'
+    assert await host.inventory.inspect('volume', 'missing') is None
+    assert host.commands == [('container', 'inspect', 'container-3'),
+                             ('volume', 'inspect', 'missing')]
+
+
+@async_test
+async def test_inventory_current(ainjector):
+    host = await ainjector(ScriptedContainerHost)
+    inventory = host.inventory
+    assert (await inventory.inspect('container', 'container-1'))['Id'] == 'c1'
+    host.objects['container'][1]['State'] = dict(Running=False)
+    host.commands.clear()
+    # State changed outside Carthage is seen when the snapshot is bypassed.
+    info = await inventory.inspect('container', 'container-1', current=True)
+    assert info['State'] == dict(Running=False)
+    assert host.commands == [('container', 'inspect', 'container-1')]
+
+
+@async_test
+async def test_inventory_failure_cached(ainjector):
+    host = await ainjector(ScriptedContainerHost)
+    host.listing_fails = True
+    for i in range(3):
+        assert (await host.inventory.inspect('container', f'container-{i}'))['Id'] == f'c{i}'
+    # The failed listing is not retried for each lookup.
+    assert host.commands == [('ps', '-a', '--format', 'json'),
+                             *(('container', 'inspect', f'container-{i}') for i in range(3))]
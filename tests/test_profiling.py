@@ -0,0 +1,76 @@
+# Copyright (C) 2026, Hadron Industries, Inc.
+# Carthage is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation. It is distributed
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
+# LICENSE for details.
+
+import asyncio
+import json
+import time
+from carthage.profiling import StartupProfile, startup_profile, module_import_times
+
+
+def test_phases():
+    profile = StartupProfile()
+    with profile.phase('config', 'carthage.yml'):
+        with profile.phase('plugin', 'one'):
+            time.sleep(0.02)
+        with profile.phase('plugin', 'two'):
+            with profile.phase('import', 'two'):
+                pass
+    profile.add_statistics('example', lambda: dict(hits=3))
+    config, one, two, imported = profile.phases
+    assert (one.depth, imported.depth) == (1, 2)
+    costs = profile.plugin_costs()
+    assert costs['one']['total'] >= 0.02
+    assert config.self_time < 0.02 <= config.duration
+    result = json.loads(profile.to_json())
+    assert result['statistics'] == dict(example=dict(hits=3))
+    assert [p['name'] for p in result['phases']] == ['config', 'plugin', 'plugin', 'import']
+    assert 'carthage.yml' in profile.format_table()
+
+
+def test_concurrent_phases():
+    profile = StartupProfile()
+    async def task(name):
+        with profile.phase('plugin', name):
+            await asyncio.sleep(0.01)
+            with profile.phase('import', name):
+                await asyncio.sleep(0.01)
+    async def main():
+        with profile.phase('config'):
+            await asyncio.gather(task('one'), task('two'))
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert set(profile.plugin_costs()) == {'one', 'two'}
+    config = profile.phases[0]
+    for phase in profile.phases[1:]:
+        parent = profile.phases[phase.parent]
+        assert parent.name == ('config' if phase.name == 'plugin' else 'plugin')
+        assert parent.detail == phase.detail or parent is config
+    assert config.self_time < 0.01
+
+
+def test_phase_limit():
+    profile = StartupProfile()
+    profile.max_phases = 3
+    for i in range(5):
+        with profile.phase('layout', str(i)):
+            pass
+    assert len(profile.phases) == 3
+    assert profile.dropped == 2
+    with profile.phase('config'):
+        pass
+
+
+def test_startup_profile():
+    assert startup_profile.phases[0].detail == 'carthage'
+    assert startup_profile.phases[0].duration > 0
+    imports = module_import_times(limit=5)
+    assert len(imports) == 5
+    assert all(entry['total'] >= entry['self'] for entry in imports)
@@ -7,6 +7,7 @@
 # LICENSE for details.
 
 import asyncio
+import contextlib
 import os
 import pytest
 import os.path
@@ -495,3 +496,120 @@ async def test_machine_running_stop_race(ainjector):
     await second_task
     
     
+
+class BatchMachine:
+
+    name = 'batch-machine'
+    calls = 0
+
+    async def run_command(self, *args):
+        self.calls += 1
+        command, *args = args
+        return await carthage.sh.Command(command)(*args)
+
+
+@async_test
+async def test_command_batch(ainjector):
+    machine = BatchMachine()
+    async with carthage.machine.CommandBatch(machine) as batch:
+        echo = batch.run_command('echo', 'hello world')
+        batch.run_command('sh', '-c', 'echo err >&2; exit 3', _ok_code=[0, 3])
+        printf = batch.run_command('printf', 'no newline')
+    assert machine.calls == 1
+    assert batch.results[echo].stdout == b'hello world\n'
+    assert batch.results[1].exit_code == 3
+    assert batch.results[1].stderr == b'err\n'
+    assert batch.results[printf].stdout == b'no newline'
+
+
+@async_test
+async def test_command_batch_failure(ainjector):
+    machine = BatchMachine()
+    batch = carthage.machine.CommandBatch(machine)
+    batch.run_command('true')
+    batch.run_command('sh', '-c', 'echo broken >&2; exit 2')
+    batch.run_command('touch', state_dir/'not_created')
+    with pytest.raises(carthage.machine.BatchedCommandFailed) as failure:
+        await batch.run()
+    assert failure.value.index == 1
+    assert failure.value.result.exit_code == 2
+    assert 'broken' in str(failure.value)
+    assert len(batch.results) == 2
+    assert not (state_dir/'not_created').exists()
+
+
+@async_test
+async def test_copy_tree(ainjector):
+    machine = await ainjector(carthage.LocalMachine, name='local')
+    source = state_dir/'copy_source'
+    for i in range(50):
+        source.joinpath(str(i%5)).mkdir(parents=True, exist_ok=True)
+        source.joinpath(str(i%5), f'file{i}').write_text(str(i))
+    await machine.copy_tree_to(source, state_dir/'copy_remote')
+    await machine.copy_tree_from(state_dir/'copy_remote', state_dir/'copy_back')
+    for i in range(50):
+        assert state_dir.joinpath('copy_back', str(i%5), f'file{i}').read_text() == str(i)
+
+
+@async_test
+async def test_running_state_cache(ainjector):
+    class CountingMachine(carthage.machine.BareMetalMachine):
+
+        name = 'counting'
+        probes = 0
+
+        async def is_machine_running(self):
+            if self.running_state_current():
+                return self.running
+            self.probes += 1
+            self.running = bool(self.running)
+            self.note_running_state()
+            return self.running
+
+        async def ssh_online(self): pass
+
+    machine = await ainjector(CountingMachine)
+    await machine.is_machine_running()
+    await machine.is_machine_running()
+    assert machine.probes == 1
+    await machine.start_machine()
+    assert machine.running
+    await machine.is_machine_running()
+    assert machine.probes == 2
+    machine.running_state_ttl = 0
+    await machine.is_machine_running()
+    assert machine.probes == 3
+
+
+class FailingRemoteMachine(carthage.LocalMachine):
+
+    async def run_command(self, *args, **kwargs):
+        raise RuntimeError('remote failed')
+
+
+def local_tar_children():
+    children = []
+    for task in os.listdir('/proc/self/task'):
+        with open(f'/proc/self/task/{task}/children') as f:
+            children.extend(f.read().split())
+    tars = []
+    for pid in children:
+        with contextlib.suppress(OSError), open(f'/proc/{pid}/comm') as f:
+            if f.read().strip() == 'tar':
+                tars.append(pid)
+    return tars
+
+
+@async_test
+async def test_copy_tree_remote_failure(ainjector):
+    machine = await ainjector(FailingRemoteMachine, name='local')
+    source = state_dir/'copy_source'
+    source.mkdir(parents=True, exist_ok=True)
+    # Larger than a pipe buffer, so the local tar blocks writing.
+    source.joinpath('big').write_bytes(os.urandom(1 << 20))
+    with pytest.raises(RuntimeError):
+        await machine.copy_tree_to(source, state_dir/'copy_remote')
+    assert local_tar_children() == []
+    with pytest.raises(RuntimeError):
+        await machine.copy_tree_from(state_dir/'copy_remote', state_dir/'copy_back')
+    assert local_tar_children() == []
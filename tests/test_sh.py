@@ -0,0 +1,75 @@
+# Copyright (C) 2026, Hadron Industries, Inc.
+# Carthage is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation. It is distributed
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
+# LICENSE for details.
+
+import asyncio
+import concurrent.futures
+import time
+import pytest
+from carthage.pytest import *
+from carthage import sh
+import carthage.sh
+
+
+@async_test
+async def test_wait_for_exit(loop):
+    result = await carthage.sh._wait_for_exit(sh.echo('hello'))
+    assert str(result) == 'hello\n'
+    with pytest.raises(sh.ErrorReturnCode):
+        await carthage.sh._wait_for_exit(sh.false())
+
+
+@async_test
+async def test_wait_for_exit_no_executor(loop):
+    # Running commands must not hold executor threads; with a single
+    # worker, waits that each held it would run one after another.
+    saved = loop._default_executor
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    loop.set_default_executor(executor)
+    try:
+        start = time.monotonic()
+        commands = [sh.sleep('0.2') for i in range(20)]
+        await asyncio.gather(*(carthage.sh._wait_for_exit(c) for c in commands))
+        assert time.monotonic() - start < 2
+    finally:
+        loop._default_executor = saved
+        executor.shutdown()
+
+
+@async_test
+async def test_wait_for_exit_output_held(loop):
+    # A grandchild holding output open must not block the event loop.
+    command = sh.sh('-c', 'sleep 0.5 & echo started')
+    ticks = 0
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+    ticker = loop.create_task(tick())
+    try:
+        result = await carthage.sh._wait_for_exit(command)
+    finally:
+        ticker.cancel()
+    assert str(result) == 'started\n'
+    assert ticks > 10
+
+
+@async_test
+async def test_lazy_await_probe(loop):
+    saved = carthage.sh._force_override_await
+    carthage.sh._force_override_await = None
+    try:
+        async def run(word):
+            return await sh.echo(word)
+        results = await asyncio.gather(run('a'), run('b'))
+        assert [str(r) for r in results] == ['a\n', 'b\n']
+        assert carthage.sh._force_override_await in (True, False)
+        with pytest.raises(sh.ErrorReturnCode):
+            await sh.false()
+    finally:
+        carthage.sh._force_override_await = saved
@@ -6,7 +6,11 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the file
 # LICENSE for details.
 
-from carthage.utils import memoproperty
+import io
+import time
+import yaml
+from carthage.pytest import *
+from carthage.utils import memoproperty, yaml_load, yaml_dump, yaml_load_cached, YamlLoader, wait_for_mount
 
 
 def test_memo_prop():
@@ -22,3 +26,25 @@ def test_memo_prop():
     mo = m()
     assert mo.foo == 99
     assert mo.foo == 99  # and not called a second time
+
+
+def test_yaml_load_cached():
+    document = 'a: {b: [1, 2]}\nc: !!set {x: null}\n'
+    first = yaml_load_cached(document)
+    assert first == yaml.safe_load(document)
+    first['a']['b'].append(3)
+    first['c'].add('y')
+    second = yaml_load_cached(io.StringIO(document))
+    assert second == yaml.safe_load(document)
+    assert yaml_load(yaml_dump(second)) == second
+    assert yaml_load_cached(document.encode('utf-8')) == second
+    if yaml.__with_libyaml__:
+        assert YamlLoader is yaml.CSafeLoader
+
+
+@async_test
+async def test_wait_for_mount_without_event(loop):
+    # The condition can become true without any mount table change.
+    start = time.monotonic()
+    await wait_for_mount(lambda: time.monotonic() > start+0.2, timeout=10)
+    assert time.monotonic() - start < 2